@@ -21,6 +21,7 @@ using Queue = Amazon.CDK.AWS.SQS.Queue;
 namespace HeronPipeline {
   internal sealed class ArmadillinModel: Construct {
     public EcsRunTask armadillinTask;
+    public EcsRunTask armadillinWorkerTask;
     public Succeed skipArmadillinTask;
     private Construct scope;
     private string id;
@@ -131,6 +132,45 @@ namespace HeronPipeline {
 
       this.armadillinTask.AddRetry(this.retryItem);
       skipArmadillinTask = new Succeed(this, "skipArmadillinTask");
+
+      // Warm worker that works through the day's iterations as prepareSequences readies them
+      this.armadillinWorkerTask = new EcsRunTask(this, this.id + "_armadillinWorkerTask", new EcsRunTaskProps
+      {
+          IntegrationPattern = IntegrationPattern.RUN_JOB,
+          Cluster = cluster,
+          TaskDefinition = this.armadillinTaskDefinition,
+          AssignPublicIp = true,
+          LaunchTarget = new EcsFargateLaunchTarget(),
+          ContainerOverrides = new ContainerOverride[] {
+              new ContainerOverride {
+                  ContainerDefinition = this.armadillinContainer,
+                  Environment = new TaskEnvironmentVariable[] {
+                      new TaskEnvironmentVariable{
+                        Name = "ARMADILLIN_WORKER",
+                        Value = "true"
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "DATE_PARTITION",
+                        Value = JsonPath.StringAt("$.date")
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "HERON_SAMPLES_BUCKET",
+                        Value = bucket.BucketName
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "SEQ_DATA_ROOT",
+                        Value = "/mnt/efs0/seqData"
+                      },
+                      new TaskEnvironmentVariable{
+                          Name = "HERON_SEQUENCES_TABLE",
+                          Value = sequencesTable.TableName
+                      }
+                  }
+              }
+          },
+          ResultPath = JsonPath.DISCARD
+      });
+      this.armadillinWorkerTask.AddRetry(this.retryItem);
     }
   }
 }
\ No newline at end of file
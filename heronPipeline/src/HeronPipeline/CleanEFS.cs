@@ -101,6 +101,10 @@ namespace HeronPipeline {
                       new TaskEnvironmentVariable{
                         Name = "SEQ_DATA_ROOT",
                         Value = "/mnt/efs0/seqData"
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "ALIGNMENT_CACHE_MAX_AGE_DAYS",
+                        Value = "30"
                       }
                   }
               }
@@ -12,6 +12,7 @@ using Amazon.CDK.AWS.StepFunctions;
 using Amazon.CDK.AWS.StepFunctions.Tasks;
 using Amazon.CDK.AWS.Lambda;
 using Amazon.CDK.AWS.Lambda.Python;
+using Amazon.CDK.AWS.Lambda.EventSources;
 using Amazon.CDK.AWS.DynamoDB;
 using Amazon.CDK.AWS.SQS;
 using Stack = Amazon.CDK.Stack;
@@ -79,6 +80,26 @@ namespace HeronPipeline
     {
       this.CreateReadSampleBatch();
       this.CreateGetMessageCount();
+      this.CreateMarkPendingWork();
+    }
+    private void CreateMarkPendingWork()
+    {
+      var markPendingWorkFunction = new PythonFunction(this, "markPendingWorkFunction", new PythonFunctionProps{
+          Entry = "src/functions/markPendingWork",
+          Runtime = Runtime.PYTHON_3_7,
+          Index = "app.py",
+          Handler = "lambda_handler",
+          Environment = new Dictionary<string, string> {
+              {"HERON_SEQUENCES_TABLE",sequencesTable.TableName}
+          }
+      });
+      markPendingWorkFunction.AddToRolePolicy(dynamoDBAccessPolicyStatement);
+      markPendingWorkFunction.AddEventSource(new DynamoEventSource(sequencesTable, new DynamoEventSourceProps{
+          StartingPosition = StartingPosition.TRIM_HORIZON,
+          BatchSize = 100,
+          BisectBatchOnError = true,
+          RetryAttempts = 10
+      }));
     }
     private void CreateGetMessageCount()
     {
@@ -92,10 +113,16 @@ namespace HeronPipeline
               // {"EXECUTION_MODE", JsonPath.StringAt("$.executionMode")},
               {"HERON_SEQUENCES_TABLE",sequencesTable.TableName},
               {"HERON_PROCESSING_QUEUE", reprocessingQueue.QueueUrl},
-              {"HERON_DAILY_PROCESSING_QUEUE",dailyProcessingQueue.QueueUrl}
+              {"HERON_DAILY_PROCESSING_QUEUE",dailyProcessingQueue.QueueUrl},
+              {"HERON_SAMPLES_BUCKET", bucket.BucketName},
+              // Must match the addSequencesToQueue task
+              {"WORK_DISTRIBUTION", "MANIFEST"},
+              // launchSampleProcessingMap x startSampleProcessingMap MaxConcurrency
+              {"MAX_CONCURRENCY", "1600"}
           }
       });
       getMessageCountFunction.AddToRolePolicy(sqsAccessPolicyStatement);
+      getMessageCountFunction.AddToRolePolicy(s3AccessPolicyStatement);
 
       this.getMessageCountTask = new LambdaInvoke(this, "getMessageCountTask", new LambdaInvokeProps{
           LambdaFunction = getMessageCountFunction,
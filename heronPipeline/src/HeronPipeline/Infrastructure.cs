@@ -147,7 +147,18 @@ namespace HeronPipeline
       sequencesTable = new Table(this, "heronSequencesTable", new TableProps {
           BillingMode = BillingMode.PAY_PER_REQUEST,
           PartitionKey = new Attribute { Name = "seqHash", Type = AttributeType.STRING},
-          PointInTimeRecovery = true
+          PointInTimeRecovery = true,
+          // markPendingWork keeps pendingWork in step with the changes to each sequence
+          Stream = StreamViewType.NEW_IMAGE
+      });
+
+      // Sparse, only sequences that still need processing carry pendingWork.
+      // Projects every attribute addSequencesToQueue writes into a message
+      sequencesTable.AddGlobalSecondaryIndex(new GlobalSecondaryIndexProps {
+          IndexName = "pendingWorkIndex",
+          PartitionKey = new Attribute { Name = "pendingWork", Type = AttributeType.STRING},
+          ProjectionType = ProjectionType.INCLUDE,
+          NonKeyAttributes = new string[] {"consensusFastaPath", "processingState", "sequencePack"}
       });
 
       mutationsTable = new Table(this, "heronMutationsTable", new TableProps {
@@ -23,6 +23,9 @@ namespace HeronPipeline
   {
     public EcsRunTask pangolinTask;
     public Succeed skipPangolinTask;
+    public EcsRunTask updatePangolinDataTask;
+    public Succeed skipUpdatePangolinDataTask;
+    public EcsRunTask pangolinWorkerTask;
     private Construct scope;
     private string id;
     private Role ecsExecutionRole;
@@ -130,6 +133,82 @@ namespace HeronPipeline
       pangolinTask.AddRetry(retryItem);
 
       skipPangolinTask = new Succeed(this, "skipPangolinTask");
+
+      // Installs pangolin-data on EFS once per execution, the batches read it with --datadir
+      this.updatePangolinDataTask = new EcsRunTask(this, this.id + "_updatePangolinDataTask", new EcsRunTaskProps
+      {
+          IntegrationPattern = IntegrationPattern.RUN_JOB,
+          Cluster = cluster,
+          TaskDefinition = pangolinTaskDefinition,
+          AssignPublicIp = true,
+          LaunchTarget = new EcsFargateLaunchTarget(),
+          ContainerOverrides = new ContainerOverride[] {
+              new ContainerOverride {
+                  ContainerDefinition = pangolinContainer,
+                  Environment = new TaskEnvironmentVariable[] {
+                      new TaskEnvironmentVariable{
+                        Name = "PANGO_SCRIPT",
+                        Value = "updatePangoData.py"
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "DATE_PARTITION",
+                        Value = JsonPath.StringAt("$.date")
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "HERON_SAMPLES_BUCKET",
+                        Value = bucket.BucketName
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "SEQ_DATA_ROOT",
+                        Value = "/mnt/efs0/seqData"
+                      }
+                  }
+              }
+          },
+          ResultPath = JsonPath.DISCARD
+      });
+      updatePangolinDataTask.AddRetry(retryItem);
+
+      skipUpdatePangolinDataTask = new Succeed(this, "skipUpdatePangolinDataTask");
+
+      // Warm worker that works through the day's iterations as prepareSequences readies them
+      this.pangolinWorkerTask = new EcsRunTask(this, this.id + "_pangolinWorkerTask", new EcsRunTaskProps
+      {
+          IntegrationPattern = IntegrationPattern.RUN_JOB,
+          Cluster = cluster,
+          TaskDefinition = pangolinTaskDefinition,
+          AssignPublicIp = true,
+          LaunchTarget = new EcsFargateLaunchTarget(),
+          ContainerOverrides = new ContainerOverride[] {
+              new ContainerOverride {
+                  ContainerDefinition = pangolinContainer,
+                  Environment = new TaskEnvironmentVariable[] {
+                      new TaskEnvironmentVariable{
+                        Name = "PANGO_SCRIPT",
+                        Value = "pangoWorker.py"
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "DATE_PARTITION",
+                        Value = JsonPath.StringAt("$.date")
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "HERON_SAMPLES_BUCKET",
+                        Value = bucket.BucketName
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "SEQ_DATA_ROOT",
+                        Value = "/mnt/efs0/seqData"
+                      },
+                      new TaskEnvironmentVariable{
+                          Name = "HERON_SEQUENCES_TABLE",
+                          Value = sequencesTable.TableName
+                      }
+                  }
+              }
+          },
+          ResultPath = JsonPath.DISCARD
+      });
+      pangolinWorkerTask.AddRetry(retryItem);
     }
   }
 }
\ No newline at end of file
@@ -117,6 +117,39 @@ namespace HeronPipeline
                       new TaskEnvironmentVariable{
                         Name = "HERON_DAILY_PROCESSING_QUEUE",
                         Value = dailyProcessingQueue.QueueUrl
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "SCAN_SEGMENTS",
+                        Value = "8"
+                      },
+                      // Daily runs query the sparse pendingWorkIndex instead of scanning the table,
+                      // once migrateData/backfillPendingWork.py has filled it and written its marker.
+                      // Until then they keep scanning
+                      new TaskEnvironmentVariable{
+                        Name = "USE_PENDING_WORK_INDEX",
+                        Value = "true"
+                      },
+                      // MANIFEST writes the messageLists straight to S3, QUEUE sends every sequence through SQS
+                      new TaskEnvironmentVariable{
+                        Name = "WORK_DISTRIBUTION",
+                        Value = "MANIFEST"
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "HERON_SAMPLES_BUCKET",
+                        Value = bucket.BucketName
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "DATE_PARTITION",
+                        Value = JsonPath.StringAt("$.date")
+                      },
+                      new TaskEnvironmentVariable{
+                        Name = "SAMPLE_BATCH_SIZE",
+                        Value = JsonPath.StringAt("$.sampleBatchSize")
+                      },
+                      // The MANIFEST batch size is planned for this concurrency, as getMessageCount's
+                      new TaskEnvironmentVariable{
+                        Name = "MAX_CONCURRENCY",
+                        Value = "1600"
                       }
                   }
               }
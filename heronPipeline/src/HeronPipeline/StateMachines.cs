@@ -223,6 +223,7 @@ namespace HeronPipeline
       startSampleProcessingMapParameters.Add("runMutations.$", "$.runMutations");
       startSampleProcessingMapParameters.Add("runArmadillin.$", "$.runArmadillin");
       startSampleProcessingMapParameters.Add("goFastaThreads.$", "$.goFastaThreads");
+      startSampleProcessingMapParameters.Add("mapItem.$", "$$.Map.Item.Value");
 
       var startSampleProcessingMap = new Map(this, "startSampleProcessingMap", new MapProps {
         InputPath = "$",
@@ -243,7 +244,8 @@ namespace HeronPipeline
           {"runGenotyping", JsonPath.StringAt("$.runGenotyping")},
           {"runMutations", JsonPath.StringAt("$.runMutations")},
           {"runArmadillin", JsonPath.StringAt("$.runArmadillin")},
-          {"goFastaThreads", JsonPath.StringAt("$.goFastaThreads")}
+          {"goFastaThreads", JsonPath.StringAt("$.goFastaThreads")},
+          {"mapItem", JsonPath.StringAt("$.mapItem")}
       };
 
       var stateMachineInput2 = TaskInput.FromObject(stateMachineInputObject2);
@@ -274,10 +276,12 @@ namespace HeronPipeline
       launchSampleProcessingMapParameters.Add("recipeFilePath.$", "$.recipeFilePath");
       launchSampleProcessingMapParameters.Add("mapIterations.$", "$$.Map.Item.Value.process");
       launchSampleProcessingMapParameters.Add("executionMode.$", "$.executionMode");
-      launchSampleProcessingMapParameters.Add("runPangolin.$", "$.runPangolin");
+      // False when warm pangolin workers are assigning the lineages instead
+      launchSampleProcessingMapParameters.Add("runPangolin.$", "$.messageCount.runPangolin");
       launchSampleProcessingMapParameters.Add("runGenotyping.$", "$.runGenotyping");
       launchSampleProcessingMapParameters.Add("runMutations.$", "$.runMutations");
-      launchSampleProcessingMapParameters.Add("runArmadillin.$", "$.runArmadillin");
+      // False when warm armadillin workers are assigning the lineages instead
+      launchSampleProcessingMapParameters.Add("runArmadillin.$", "$.messageCount.runArmadillin");
       launchSampleProcessingMapParameters.Add("goFastaThreads.$", "$.goFastaThreads");
 
       var launchSampleProcessingMap = new Map(this, "launchSampleProcessingMap", new MapProps {
@@ -377,10 +381,54 @@ namespace HeronPipeline
 
       launchSampleProcessingMap.Iterator(Chain.Start(startNestedStateMachine));            
 
+      // Warm pangolin workers run alongside the iterations, each working through the
+      // iterations as prepareSequences readies them. None are launched unless the
+      // pipeline input sets pangolinWorkers
+      var pangolinWorkerMapParameters = new Dictionary<string, object>();
+      pangolinWorkerMapParameters.Add("date.$", "$.date");
+
+      var pangolinWorkerMap = new Map(this, "pangolinWorkerMap", new MapProps {
+        InputPath = "$",
+        ItemsPath = "$.messageCount.pangolinWorkers",
+        ResultPath = JsonPath.DISCARD,
+        Parameters = pangolinWorkerMapParameters
+      });
+      pangolinWorkerMap.Iterator(Chain.Start(pangolinModel.pangolinWorkerTask));
+
+      // Warm armadillin workers, launched the same way when the pipeline input
+      // sets armadillinWorkers
+      var armadillinWorkerMapParameters = new Dictionary<string, object>();
+      armadillinWorkerMapParameters.Add("date.$", "$.date");
+
+      var armadillinWorkerMap = new Map(this, "armadillinWorkerMap", new MapProps {
+        InputPath = "$",
+        ItemsPath = "$.messageCount.armadillinWorkers",
+        ResultPath = JsonPath.DISCARD,
+        Parameters = armadillinWorkerMapParameters
+      });
+      armadillinWorkerMap.Iterator(Chain.Start(armadillinModel.armadillinWorkerTask));
+
+      var sampleProcessingParallel = new Parallel(this, "sampleProcessingParallel", new ParallelProps{
+        ResultPath = JsonPath.DISCARD
+      });
+      sampleProcessingParallel.Branch(new Chain[] { Chain.Start(launchSampleProcessingMap), Chain.Start(pangolinWorkerMap), Chain.Start(armadillinWorkerMap) });
+
+      // pangolin-data is installed on EFS while the sequences are being queued
+      var shouldUpdatePangolinData = new Choice(this, "shouldUpdatePangolinData", new ChoiceProps{
+        Comment = "Install pangolin-data once for the run if Pangolin will run"
+      });
+      shouldUpdatePangolinData.When(Condition.BooleanEquals(JsonPath.StringAt("$.runPangolin"), true), pangolinModel.updatePangolinDataTask);
+      shouldUpdatePangolinData.When(Condition.BooleanEquals(JsonPath.StringAt("$.runPangolin"), false), pangolinModel.skipUpdatePangolinDataTask);
+
+      var prepareRunParallel = new Parallel(this, "prepareRunParallel", new ParallelProps{
+        ResultPath = JsonPath.DISCARD
+      });
+      prepareRunParallel.Branch(new Chain[] { Chain.Start(prepareSequences.addSequencesToQueueTask), Chain.Start(shouldUpdatePangolinData) });
+
       var processMessagesChain = Chain
-        .Start(prepareSequences.addSequencesToQueueTask)
+        .Start(prepareRunParallel)
         .Next(helperFunctions.getMessageCountTask)
-        .Next(launchSampleProcessingMap)
+        .Next(sampleProcessingParallel)
         .Next(tableExportChainParallel)
         .Next(exportResults.exportResultsTask)
         .Next(cleanEfs.cleanEfsTask)
@@ -15,6 +15,9 @@ from urllib.parse import urlparse
 from datafunk.sam_2_fasta import *
 from Bio import SeqIO
 import pysam
+import referenceIndex
+import cigarToFasta
+import alignedSequence
 
 
 config = Config(
@@ -41,6 +44,7 @@ def handler(event, context):
     referenceFastaPrefix = os.getenv('REF_FASTA_KEY')
     trimStart = os.getenv('TRIM_START')
     trimEnd = os.getenv('TRIM_END')
+    sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
 
     s3 = boto3.resource('s3', region_name='eu-west-1')
     bucket = s3.Bucket(bucketName)
@@ -56,6 +60,13 @@ def handler(event, context):
     except:
       return {'fileNotFound': True}
 
+    # Use the prebuilt reference index, shared on EFS when mounted otherwise through S3
+    threads = os.cpu_count() or 1
+    if sampleDataRoot is not None and os.path.isdir(sampleDataRoot):
+      referenceIndexLocalFilename = referenceIndex.getSharedIndex(referenceFastaLocalFilename, sampleDataRoot, "./minimap2", "asm5", threads)
+    else:
+      referenceIndexLocalFilename = referenceIndex.getS3Index(referenceFastaLocalFilename, bucket, "/tmp", "./minimap2", "asm5", threads)
+
     with open(sampleLocalFilename, 'r') as file:
       data = file.read()
 
@@ -74,8 +85,8 @@ def handler(event, context):
       # -a:  output in sam
       # -x asm5:  asm-to-ref mapping, for ~0.1% sequence divergence
     subprocess.run(
-        "./minimap2 -t minimap2_threads -a -x asm5 {} {} > {}".format(
-            referenceFastaLocalFilename, consensusLocalFilename, mappedSamFastaLocalFilename
+        "./minimap2 -t {} -a -x asm5 {} {} > {}".format(
+            threads, referenceIndexLocalFilename, consensusLocalFilename, mappedSamFastaLocalFilename
         ),
         check=True,
         shell=True
@@ -87,19 +98,29 @@ def handler(event, context):
     samfile = pysam.AlignmentFile(mappedSamFastaLocalFilename, 'r')
     reference = SeqIO.read(referenceFastaLocalFilename, 'fasta')
     
-    # Run sam_2_fasta from datafunk
-    sam_2_fasta(samfile = samfile,
-                reference = reference,
-                output = alignedLocalFilename,
-                prefix_ref = False,
-                log_inserts = False,
-                log_all_inserts = False,
-                log_dels = False,
-                log_all_dels = False,
-                trim = True,
-                pad = True,
-                trimstart = int(trimStart),
-                trimend = int(trimEnd))
+    if os.getenv("SAM_TO_FASTA", "datafunk") == "cigarToFasta":
+      # Convert to the padded, trimmed alignment, the output of datafunk's sam_2_fasta.
+      # datafunk stays the default until test_matches_datafunk has passed
+      # against the committed datafunk fixture
+      cigarToFasta.samFileToFasta(samfile = samfile,
+                  referenceLength = len(reference.seq),
+                  trimStart = int(trimStart),
+                  trimEnd = int(trimEnd),
+                  output = alignedLocalFilename)
+    else:
+      # Run sam_2_fasta from datafunk
+      sam_2_fasta(samfile = samfile,
+                  reference = reference,
+                  output = alignedLocalFilename,
+                  prefix_ref = False,
+                  log_inserts = False,
+                  log_all_inserts = False,
+                  log_dels = False,
+                  log_all_dels = False,
+                  trim = True,
+                  pad = True,
+                  trimstart = int(trimStart),
+                  trimend = int(trimEnd))
     
     ##############################################
     # Step 1. Write updated result into S3
@@ -107,7 +128,8 @@ def handler(event, context):
     with open(alignedLocalFilename) as file:
       alignedFasta = file.read()
     
-    sample['aligned'] = alignedFasta
+    sample['alignedKey'] = alignedSequence.writeAligned(s3, bucketName, consensusFastaHash, alignedFasta)
+    sample.pop('aligned', None)
 
     s3.Object(bucketName, consensusFastaKey).put(Body=json.dumps(sample))
 
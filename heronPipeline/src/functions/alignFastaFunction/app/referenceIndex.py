@@ -0,0 +1,143 @@
+"""
+Build the minimap2 index for the pipeline reference once and share it.
+
+The index is named after the sha256 of the reference fasta, the minimap2
+preset and the minimap2 version, so a changed reference or aligner never
+picks up a stale index. It can live on the shared EFS mount or in S3.
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import tempfile
+import subprocess
+from botocore.exceptions import ClientError
+
+INDEX_FOLDER = "referenceIndex"
+# A build lock older than this is assumed to belong to a task that died
+STALE_LOCK_SECONDS = 1800
+
+
+def referenceHash(referenceFasta):
+  """sha256 of the reference fasta contents"""
+  sha = hashlib.sha256()
+  with open(referenceFasta, 'rb') as file:
+    for block in iter(lambda: file.read(1 << 20), b''):
+      sha.update(block)
+  return sha.hexdigest()
+
+
+def minimapVersion(minimapPath):
+  """Version string reported by the minimap2 binary, or the mappy module when minimapPath is "mappy"
+
+  mappy writes the index format of the minimap2 it was built from, which
+  needn't match the binary's, so the two never share an index.
+  """
+  if minimapPath == "mappy":
+    import mappy
+    return f"mappy-{mappy.__version__}"
+  try:
+    proc = subprocess.run([minimapPath, "--version"], capture_output=True, text=True)
+    version = proc.stdout.strip()
+  except OSError:
+    version = ""
+  return version if version != "" else "unknown"
+
+
+def indexFilename(referenceFasta, preset, version):
+  return f"{referenceHash(referenceFasta)}_{preset}_{version}.mmi"
+
+
+def buildIndex(minimapPath, referenceFasta, preset, outputPath, threads=1):
+  """Build a minimap2 index for referenceFasta at outputPath"""
+  if minimapPath == "mappy":
+    import mappy
+    aligner = mappy.Aligner(referenceFasta, preset=preset, n_threads=threads, fn_idx_out=outputPath)
+    if not aligner:
+      raise Exception(f"Failed to build index for: {referenceFasta}")
+    return
+  subprocess.run(
+    [minimapPath, "-x", preset, "-t", str(threads), "-d", outputPath, referenceFasta],
+    check=True,
+    stdout=subprocess.DEVNULL
+  )
+
+
+def getSharedIndex(referenceFasta, sharedRoot, minimapPath="./minimap2", preset="asm5", threads=1, timeout=900):
+  """Return the path of the prebuilt index in a directory shared between tasks (EFS)
+
+  The first task to take the lock builds the index into a temporary file and
+  renames it into place, rename being atomic every other task either sees the
+  complete index or waits for it. If the index can't be obtained within the
+  timeout a private copy is built in the temp directory so the task can still run.
+  """
+  indexDir = f"{sharedRoot}/{INDEX_FOLDER}"
+  os.makedirs(indexDir, exist_ok=True)
+  indexPath = f"{indexDir}/{indexFilename(referenceFasta, preset, minimapVersion(minimapPath))}"
+  lockPath = f"{indexPath}.lock"
+  deadline = time.time() + timeout
+
+  while not os.path.isfile(indexPath):
+    try:
+      lockFd = os.open(lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+      # Another task is building the index, wait for it unless its lock has gone stale
+      try:
+        if time.time() - os.path.getmtime(lockPath) > STALE_LOCK_SECONDS:
+          print(f"Removing stale index lock: {lockPath}")
+          os.remove(lockPath)
+          continue
+      except OSError:
+        continue
+
+      if time.time() > deadline:
+        print(f"Timed out waiting for shared index: {indexPath}")
+        localPath = f"{tempfile.gettempdir()}/{os.path.basename(indexPath)}"
+        if not os.path.isfile(localPath):
+          buildIndex(minimapPath, referenceFasta, preset, localPath, threads)
+        return localPath
+      time.sleep(2)
+      continue
+
+    tmpPath = f"{indexPath}.{uuid.uuid4()}.tmp"
+    try:
+      os.write(lockFd, str(os.getpid()).encode())
+      os.close(lockFd)
+      if not os.path.isfile(indexPath):
+        print(f"Building shared index: {indexPath}")
+        buildIndex(minimapPath, referenceFasta, preset, tmpPath, threads)
+        os.rename(tmpPath, indexPath)
+    finally:
+      if os.path.isfile(tmpPath):
+        os.remove(tmpPath)
+      try:
+        os.remove(lockPath)
+      except OSError:
+        pass
+
+  return indexPath
+
+
+def getS3Index(referenceFasta, bucket, localDir=None, minimapPath="./minimap2", preset="asm5", threads=1):
+  """Return the local path of the prebuilt index, fetched from or published to S3
+
+  Used where no shared file system is mounted. Concurrent first builds all
+  upload the same bytes to the same key, so no locking is needed.
+  """
+  filename = indexFilename(referenceFasta, preset, minimapVersion(minimapPath))
+  indexPath = f"{localDir or tempfile.gettempdir()}/{filename}"
+  indexKey = f"{INDEX_FOLDER}/{filename}"
+
+  if os.path.isfile(indexPath):
+    return indexPath
+
+  tmpPath = f"{indexPath}.{uuid.uuid4()}.tmp"
+  try:
+    bucket.download_file(indexKey, tmpPath)
+  except ClientError:
+    print(f"Building index: {indexKey}")
+    buildIndex(minimapPath, referenceFasta, preset, tmpPath, threads)
+    bucket.upload_file(tmpPath, indexKey)
+  os.rename(tmpPath, indexPath)
+  return indexPath
@@ -0,0 +1,64 @@
+"""
+Benchmark cigarToFasta against datafunk sam_2_fasta on a batch of random
+SARS-CoV-2 length alignments.
+
+  python benchmark_cigar_to_fasta.py [queries]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from test_cigar_to_fasta import randomSam
+import cigarToFasta
+
+REFERENCE_LENGTH = 29903
+TRIM_START = 265
+TRIM_END = 29674
+
+
+def timeIt(label, queries, function):
+  start = time.perf_counter()
+  function()
+  elapsed = time.perf_counter() - start
+  print(f"{label}: {elapsed:.3f}s, {1000 * elapsed / queries:.3f}ms per query")
+  return elapsed
+
+
+if __name__ == '__main__':
+  queries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  lines = randomSam(REFERENCE_LENGTH, queries)
+
+  timeIt("cigarToFasta (SAM lines)", queries, lambda: cigarToFasta.samToFasta(
+    cigarToFasta.alignmentsFromSamLines(lines), REFERENCE_LENGTH, TRIM_START, TRIM_END))
+
+  try:
+    import pysam
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+    from datafunk.sam_2_fasta import sam_2_fasta
+  except ImportError:
+    print("pysam/datafunk not installed, skipping the comparison")
+    sys.exit(0)
+
+  with tempfile.TemporaryDirectory() as tmpDir:
+    samPath = os.path.join(tmpDir, "batch.sam")
+    with open(samPath, 'w') as file:
+      file.writelines(lines)
+    reference = SeqRecord(Seq("A" * REFERENCE_LENGTH), id="ref")
+
+    def runNumpy():
+      with pysam.AlignmentFile(samPath, 'r') as samfile:
+        cigarToFasta.samFileToFasta(samfile, REFERENCE_LENGTH, TRIM_START, TRIM_END, os.path.join(tmpDir, "numpy.fa"))
+
+    def runDatafunk():
+      with pysam.AlignmentFile(samPath, 'r') as samfile:
+        sam_2_fasta(samfile=samfile, reference=reference, output=os.path.join(tmpDir, "datafunk.fa"),
+                    prefix_ref=False, log_inserts=False, log_all_inserts=False,
+                    log_dels=False, log_all_dels=False,
+                    trim=True, pad=True, trimstart=TRIM_START, trimend=TRIM_END)
+
+    numpyTime = timeIt("cigarToFasta (pysam)", queries, runNumpy)
+    datafunkTime = timeIt("datafunk sam_2_fasta", queries, runDatafunk)
+    print(f"Speedup: {datafunkTime / numpyTime:.1f}x")
@@ -0,0 +1,38 @@
+"""
+Write the datafunk sam_2_fasta output for the regression SAM, the fixture
+test_cigar_to_fasta.py compares cigarToFasta against.
+
+Run this where datafunk is installed, e.g. this function's image, and commit
+the fasta it writes:
+
+  python make_datafunk_fixture.py
+"""
+
+import os
+
+import pysam
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+from datafunk.sam_2_fasta import sam_2_fasta
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+REGRESSION_SAM = os.path.join(CURR_DIR, "assets", "regression.sam")
+REGRESSION_FASTA = os.path.join(CURR_DIR, "assets", "regression.datafunk.fa")
+REFERENCE_LENGTH = 29903
+TRIM_START = 265
+TRIM_END = 29674
+
+
+def writeFixture(output):
+  """Run datafunk sam_2_fasta over the regression SAM, as alignFastaFunction calls it"""
+  reference = SeqRecord(Seq("A" * REFERENCE_LENGTH), id="ref")
+  with pysam.AlignmentFile(REGRESSION_SAM, 'r') as samfile:
+    sam_2_fasta(samfile=samfile, reference=reference, output=output,
+                prefix_ref=False, log_inserts=False, log_all_inserts=False,
+                log_dels=False, log_all_dels=False,
+                trim=True, pad=True, trimstart=TRIM_START, trimend=TRIM_END)
+
+
+if __name__ == '__main__':
+  writeFixture(REGRESSION_FASTA)
+  print(f"Wrote {REGRESSION_FASTA}")
@@ -0,0 +1,157 @@
+"""
+Unit test cigarToFasta.py
+"""
+
+
+import unittest
+import sys
+import os
+import random
+import tempfile
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(CURR_DIR, "app"))
+sys.path.insert(1, CURR_DIR)
+
+import cigarToFasta
+
+
+REFERENCE_LENGTH = 20
+REGRESSION_SAM = os.path.join(CURR_DIR, "assets", "regression.sam")
+REGRESSION_FASTA = os.path.join(CURR_DIR, "assets", "regression.datafunk.fa")
+
+SAM_HEADER = f"@SQ\tSN:ref\tLN:{REFERENCE_LENGTH}\n"
+
+
+def samRecord(name, flag, pos, cigar, seq):
+    return "\t".join([name, str(flag), "ref", str(pos), "60", cigar, "*", "0", "0", seq, "*"]) + "\n"
+
+
+def randomSam(referenceLength, queries, seed=1):
+    """A SAM of random alignments covering every CIGAR operation minimap2 writes"""
+    rng = random.Random(seed)
+    lines = [f"@SQ\tSN:ref\tLN:{referenceLength}\n"]
+    for i in range(queries):
+        start = rng.randint(0, 50)
+        refPos = start
+        cigar = []
+        seq = []
+        leftClip = rng.randint(0, 20)
+        if leftClip > 0:
+            cigar.append(f"{leftClip}S")
+            seq.append("A" * leftClip)
+        while refPos < referenceLength - 200:
+            length = rng.randint(1, 150)
+            cigar.append(f"{length}M")
+            seq.append("".join(rng.choice("ACGTN") for _ in range(length)))
+            refPos += length
+            op = rng.choice("DIM")
+            length = rng.randint(1, 10)
+            cigar.append(f"{length}{op}")
+            if op != "D":
+                seq.append("".join(rng.choice("ACGT") for _ in range(length)))
+            if op != "I":
+                refPos += length
+        lines.append(samRecord(f"query{i}", 0, start + 1, "".join(cigar), "".join(seq)))
+    return lines
+
+
+class TestCigarToFasta(unittest.TestCase):
+
+
+
+    def convert(self, records, trimStart=0, trimEnd=REFERENCE_LENGTH):
+        alignments = cigarToFasta.alignmentsFromSamLines([SAM_HEADER] + records)
+        return cigarToFasta.samToFasta(alignments, REFERENCE_LENGTH, trimStart, trimEnd)
+
+
+    def test_match_deletion_insertion_clip(self):
+        """
+        Soft clipped and inserted bases are excised, deletions are gapped and
+        uncovered reference positions become N.
+        """
+        fasta = self.convert([samRecord("q", 0, 4, "2S4M2D2M3I2M", "GGACGTCCTTTTT")])
+        self.assertEqual(fasta, ">q\nNNNACGT--CCTTNNNNNNN\n")
+
+
+    def test_trim_masks_ends(self):
+        """
+        Positions outside [trimStart, trimEnd) are masked with N.
+        """
+        fasta = self.convert([samRecord("q", 0, 1, "20M", "ACGTACGTACGTACGTACGT")], 2, 18)
+        self.assertEqual(fasta, ">q\nNNGTACGTACGTACGTACNN\n")
+
+
+    def test_supplementary_merge(self):
+        """
+        A supplementary alignment fills positions the primary doesn't cover, a
+        gap gives way to a base and conflicting bases become N.
+        """
+        fasta = self.convert([
+            samRecord("q", 0, 1, "4M2D4M", "AAAACCCC"),
+            samRecord("q", 2048, 5, "6M", "GGTTCC")
+        ])
+        self.assertEqual(fasta, ">q\nAAAAGGNNCCNNNNNNNNNN\n")
+
+
+    def test_unmapped_and_secondary(self):
+        """
+        Secondary alignments are ignored and an unmapped query is all N.
+        """
+        fasta = self.convert([
+            samRecord("q1", 0, 1, "4M", "ACGT"),
+            samRecord("q1", 256, 9, "4M", "TTTT"),
+            samRecord("q2", 4, 0, "*", "ACGT")
+        ])
+        self.assertEqual(fasta, ">q1\nACGTNNNNNNNNNNNNNNNN\n>q2\nNNNNNNNNNNNNNNNNNNNN\n")
+
+
+    def test_pysam_matches_sam_lines(self):
+        """
+        Alignments read with pysam give the same fasta as raw SAM lines.
+        """
+        try:
+            import pysam
+        except ImportError:
+            self.skipTest("pysam not installed")
+        lines = randomSam(29903, 20)
+        with tempfile.NamedTemporaryFile('w', suffix=".sam", delete=False) as file:
+            file.writelines(lines)
+        expected = cigarToFasta.samToFasta(cigarToFasta.alignmentsFromSamLines(lines), 29903, 265, 29674)
+        with pysam.AlignmentFile(file.name, 'r') as samfile:
+            actual = cigarToFasta.samToFasta(cigarToFasta.alignmentsFromPysam(samfile), 29903, 265, 29674)
+        os.remove(file.name)
+        self.assertEqual(actual, expected)
+
+
+    def test_matches_datafunk(self):
+        """
+        Output is byte identical to datafunk sam_2_fasta on the regression
+        SAM: indels, soft and hard clips, Ns, reverse strand, supplementary
+        and secondary alignments and an unmapped query. The datafunk output
+        is the fixture written by make_datafunk_fixture.py once it is
+        committed, and until then datafunk is run here where it is installed,
+        as in this function's image.
+        """
+        with open(REGRESSION_SAM) as file:
+            lines = file.readlines()
+        actual = cigarToFasta.samToFasta(cigarToFasta.alignmentsFromSamLines(lines), 29903, 265, 29674)
+        if os.path.isfile(REGRESSION_FASTA):
+            with open(REGRESSION_FASTA) as file:
+                self.assertEqual(actual, file.read())
+            return
+        try:
+            import make_datafunk_fixture
+        except ImportError:
+            self.skipTest("No datafunk fixture and datafunk not installed, app.py keeps using datafunk")
+        with tempfile.TemporaryDirectory() as tmpDir:
+            expectedPath = os.path.join(tmpDir, "regression.datafunk.fa")
+            make_datafunk_fixture.writeFixture(expectedPath)
+            with open(expectedPath) as file:
+                self.assertEqual(actual, file.read())
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@ import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import alignedSequence
 
 
 config = Config(
@@ -49,7 +50,7 @@ def lambda_handler(event, context):
   #Get the aligned fasta from the fasta file and overwrite the file
   with open(localFastaFilename, "r") as fasta:
     seqData = json.load(fasta)
-    alignedFasta = seqData['aligned']
+    alignedFasta = alignedSequence.readAligned(s3, heronBucketName, seqData)
 
   with open(localFastaFilename, "w") as fasta:
     fasta.write(alignedFasta)
@@ -7,6 +7,11 @@ from boto3.dynamodb.conditions import Key, Attr
 import json
 import math
 
+import fanOutPlanner
+
+# Written by addSequencesToQueue in MANIFEST mode
+MANIFEST_INDEX_KEY = "messageLists/{date}/manifests.json"
+QUEUE_DEPTH_MARGIN = 0.02
 
 
 def lambda_handler(event, context):
@@ -35,23 +40,63 @@ def lambda_handler(event, context):
       queueName = reprocessingQueueName
 
 
-    # Create the queue object
+    if os.getenv("WORK_DISTRIBUTION", "QUEUE") == "MANIFEST":
+      # MANIFEST mode, what the stack deploys. The sequences have already been
+      # written to messageList manifests, each nested map iteration processes
+      # one manifest by its index
+      bucketName = os.getenv("HERON_SAMPLES_BUCKET")
+      s3 = boto3.resource('s3', region_name='eu-west-1')
+      manifestIndexKey = MANIFEST_INDEX_KEY.format(date=event['date'])
+      manifestIndex = json.loads(s3.Object(bucketName, manifestIndexKey).get()['Body'].read())
+      manageProcessSequencesBatchMapConfig = fanOutPlanner.mapConfig(len(manifestIndex['manifests']))
+      for outer in manageProcessSequencesBatchMapConfig:
+        for item in outer['process']:
+          item['manifest'] = outer['id'] * fanOutPlanner.NESTED_MAP_SIZE + item['id']
+      # With warm pangolin workers working through the manifests the
+      # iterations don't run pangolin themselves
+      pangolinWorkers = int(event.get('pangolinWorkers', 0)) if event['runPangolin'] else 0
+      # and likewise with warm armadillin workers
+      armadillinWorkers = int(event.get('armadillinWorkers', 0)) if event['runArmadillin'] else 0
+      return {
+        'manageProcessSequencesBatchMapConfig': manageProcessSequencesBatchMapConfig,
+        'messageCount': str(manifestIndex['messageCount']),
+        'queueName': queueName,
+        'pangolinWorkers': list(range(pangolinWorkers)),
+        'runPangolin': event['runPangolin'] and pangolinWorkers == 0,
+        'armadillinWorkers': list(range(armadillinWorkers)),
+        'runArmadillin': event['runArmadillin'] and armadillinWorkers == 0
+      }
+
+    # QUEUE mode, the fallback for running addSequencesToQueue with
+    # WORK_DISTRIBUTION=QUEUE, the stack deploys MANIFEST. The sequences are
+    # on the queue and each iteration receives its own batch from it
     sqs = boto3.resource('sqs')
     queue = sqs.Queue(queueName)
     queue.load()
 
-    # sampleBatchSize = 2000
+    # Size the fan-out to the backlog, the queue depth is approximate so
+    # plan for a little more than it reports rather than leave messages behind
     attributes = queue.attributes
     sequenceCount = int(attributes['ApproximateNumberOfMessages'])
-    sequencesPerMapIteration = 40*sampleBatchSize
-    mapIterationsRequired = math.ceil(sequenceCount / sequencesPerMapIteration)
-    nestedProcessConfig = [{'id': f} for f in range(40)]
-    manageProcessSequencesBatchMapConfig = [{'id': f, 'process': nestedProcessConfig} for f in range(mapIterationsRequired)]
+    stageSeconds = fanOutPlanner.stageSecondsFromEnvironment(os.getenv("STAGE_SECONDS"))
+    maxConcurrency = int(os.getenv("MAX_CONCURRENCY", str(fanOutPlanner.NESTED_MAP_SIZE * fanOutPlanner.NESTED_MAP_SIZE)))
+    fanOutPlan = fanOutPlanner.plan(
+      math.ceil(sequenceCount * (1 + QUEUE_DEPTH_MARGIN)),
+      stageSeconds,
+      maxConcurrency,
+      maxBatchSize=sampleBatchSize
+    )
+    print(f"Fan-out plan for {sequenceCount} messages: {fanOutPlan}")
+    manageProcessSequencesBatchMapConfig = fanOutPlanner.mapConfig(fanOutPlan['iterations'], fanOutPlan['batchSize'])
 
     return {
       'manageProcessSequencesBatchMapConfig': manageProcessSequencesBatchMapConfig,
       'messageCount': attributes['ApproximateNumberOfMessages'],
-      'queueName': queueName
+      'queueName': queueName,
+      'pangolinWorkers': [],
+      'runPangolin': event['runPangolin'],
+      'armadillinWorkers': [],
+      'runArmadillin': event['runArmadillin']
     }
 
 
@@ -0,0 +1,100 @@
+"""
+Plan the fan-out of the sample processing Map states.
+
+Every nested iteration processes one batch of samples through the per-batch
+stages, so an iteration takes roughly
+
+  taskOverheadSeconds + batchSize * perSampleSeconds
+
+where perSampleSeconds is the sum of the sequential stages plus the slowest
+of the stages that run in parallel (pangolin, genotyping and mutations). With
+at most maxConcurrency iterations running at once, k iterations finish in
+ceil(k / maxConcurrency) waves. The planner picks the number of iterations,
+and so the batch size, that minimises that wall-clock time, preferring fewer
+iterations on a tie, and sizes the batches evenly so no iteration is empty.
+"""
+
+import json
+import math
+
+NESTED_MAP_SIZE = 40
+
+# Per-sample seconds for each stage, used until measured values are supplied
+DEFAULT_STAGE_SECONDS = {
+  'prepareConsensusSequences': 0.05,
+  'goFastaAlignment': 0.15,
+  'prepareSequences': 0.05,
+  'pangolin': 0.4,
+  'genotypeVariants': 0.1,
+  'mutations': 0.3
+}
+PARALLEL_STAGES = ['pangolin', 'genotypeVariants', 'mutations']
+# Fargate task start up, image pull and per-task downloads
+DEFAULT_TASK_OVERHEAD_SECONDS = 90
+
+
+def perSampleSeconds(stageSeconds, parallelStages=PARALLEL_STAGES):
+  """Critical path seconds per sample through the stages of one iteration"""
+  sequential = sum([v for k, v in stageSeconds.items() if k not in parallelStages])
+  parallel = [v for k, v in stageSeconds.items() if k in parallelStages]
+  return sequential + (max(parallel) if len(parallel) > 0 else 0)
+
+
+def iterationSeconds(batchSize, sampleSeconds, taskOverheadSeconds):
+  return taskOverheadSeconds + batchSize * sampleSeconds
+
+
+def wallClockSeconds(iterations, batchSize, sampleSeconds, taskOverheadSeconds, maxConcurrency):
+  waves = math.ceil(iterations / maxConcurrency)
+  return waves * iterationSeconds(batchSize, sampleSeconds, taskOverheadSeconds)
+
+
+def plan(queueDepth, stageSeconds=None, maxConcurrency=NESTED_MAP_SIZE * NESTED_MAP_SIZE,
+         taskOverheadSeconds=DEFAULT_TASK_OVERHEAD_SECONDS, minBatchSize=100, maxBatchSize=2000):
+  """Choose the iteration count and batch size for queueDepth samples
+
+  Within a wave count the most iterations give the smallest batches, so only
+  one candidate per wave count needs to be evaluated. minBatchSize keeps the
+  task overhead from dominating small batches.
+  Returns a dict with iterations, batchSize and estimatedSeconds
+  """
+  if queueDepth <= 0:
+    return {'iterations': 0, 'batchSize': 0, 'estimatedSeconds': 0}
+  sampleSeconds = perSampleSeconds(stageSeconds if stageSeconds is not None else DEFAULT_STAGE_SECONDS)
+
+  # Fewer iterations would need batches over maxBatchSize, more would need them under minBatchSize
+  fewest = math.ceil(queueDepth / maxBatchSize)
+  most = max(fewest, queueDepth // max(minBatchSize, 1), 1)
+
+  best = None
+  for waves in range(math.ceil(fewest / maxConcurrency), math.ceil(most / maxConcurrency) + 1):
+    iterations = max(1, min(waves * maxConcurrency, most))
+    batchSize = math.ceil(queueDepth / iterations)
+    # Even batches, the last is short but never empty
+    iterations = math.ceil(queueDepth / batchSize)
+    seconds = wallClockSeconds(iterations, batchSize, sampleSeconds, taskOverheadSeconds, maxConcurrency)
+    if best is None or seconds < best['estimatedSeconds']:
+      best = {'iterations': iterations, 'batchSize': batchSize, 'estimatedSeconds': seconds}
+  return best
+
+
+def mapConfig(iterations, batchSize=None, nestedMapSize=NESTED_MAP_SIZE):
+  """The nested Map configuration for getMessageCount, iterations spread over outer items of nestedMapSize"""
+  config = list()
+  for outer in range(math.ceil(iterations / nestedMapSize)):
+    process = list()
+    for i in range(outer * nestedMapSize, min(iterations, (outer + 1) * nestedMapSize)):
+      item = {'id': i - outer * nestedMapSize}
+      if batchSize is not None:
+        item['sampleBatchSize'] = str(batchSize)
+      process.append(item)
+    config.append({'id': outer, 'process': process})
+  return config
+
+
+def stageSecondsFromEnvironment(value):
+  """Stage seconds from a JSON object, stages it doesn't name keep their defaults"""
+  stageSeconds = dict(DEFAULT_STAGE_SECONDS)
+  if value:
+    stageSeconds.update({k: float(v) for k, v in json.loads(value).items()})
+  return stageSeconds
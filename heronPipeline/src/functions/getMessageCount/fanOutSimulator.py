@@ -0,0 +1,79 @@
+"""
+Simulate a fan-out plan offline.
+
+Iterations are started in order on at most maxConcurrency slots, each one
+taking the next batchSize samples from the backlog the way
+readSampleBatchFromQueue drains the queue, and running for the task overhead
+plus its samples' processing time with some random jitter. Reports the
+wall-clock time, how many iterations found nothing to do and slot use.
+
+  python fanOutSimulator.py <queueDepth> [--max-concurrency N] [--sample-batch-size N]
+
+compares the planner's plan with the fixed 40 x 40*sampleBatchSize fan-out.
+"""
+
+import math
+import heapq
+import random
+import argparse
+
+import fanOutPlanner
+
+
+def simulate(iterations, batchSize, queueDepth, sampleSeconds, taskOverheadSeconds, maxConcurrency, jitter=0.1, seed=0):
+  rng = random.Random(seed)
+  remaining = queueDepth
+  slots = [0.0] * min(maxConcurrency, max(iterations, 1))
+  heapq.heapify(slots)
+  busySeconds = 0.0
+  emptyIterations = 0
+  makespan = 0.0
+  for i in range(iterations):
+    start = heapq.heappop(slots)
+    samples = min(batchSize, remaining)
+    remaining -= samples
+    if samples == 0:
+      emptyIterations += 1
+    duration = (taskOverheadSeconds + samples * sampleSeconds) * rng.uniform(1 - jitter, 1 + jitter)
+    busySeconds += duration
+    makespan = max(makespan, start + duration)
+    heapq.heappush(slots, start + duration)
+  return {
+    'iterations': iterations,
+    'batchSize': batchSize,
+    'wallClockSeconds': makespan,
+    'emptyIterations': emptyIterations,
+    'unprocessedSamples': remaining,
+    'slotUtilisation': busySeconds / (makespan * len(slots)) if makespan > 0 else 0.0
+  }
+
+
+def legacyPlan(queueDepth, sampleBatchSize, nestedMapSize=fanOutPlanner.NESTED_MAP_SIZE):
+  """The fan-out getMessageCount used before the planner, 40 nested iterations per 40*sampleBatchSize samples"""
+  outer = math.ceil(queueDepth / (nestedMapSize * sampleBatchSize))
+  return {'iterations': outer * nestedMapSize, 'batchSize': sampleBatchSize}
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Simulate the sample processing fan-out")
+  parser.add_argument('queueDepth', type=int)
+  parser.add_argument('--max-concurrency', type=int, default=fanOutPlanner.NESTED_MAP_SIZE * fanOutPlanner.NESTED_MAP_SIZE)
+  parser.add_argument('--sample-batch-size', type=int, default=2000)
+  parser.add_argument('--task-overhead', type=float, default=fanOutPlanner.DEFAULT_TASK_OVERHEAD_SECONDS)
+  parser.add_argument('--stage-seconds', default=None, help="JSON object of per-sample seconds per stage")
+  parser.add_argument('--jitter', type=float, default=0.1)
+  args = parser.parse_args()
+
+  stageSeconds = fanOutPlanner.stageSecondsFromEnvironment(args.stage_seconds)
+  sampleSeconds = fanOutPlanner.perSampleSeconds(stageSeconds)
+  plans = {
+    'planner': fanOutPlanner.plan(args.queueDepth, stageSeconds, args.max_concurrency, args.task_overhead, maxBatchSize=args.sample_batch_size),
+    'legacy': legacyPlan(args.queueDepth, args.sample_batch_size)
+  }
+  for name, plan in plans.items():
+    result = simulate(plan['iterations'], plan['batchSize'], args.queueDepth, sampleSeconds, args.task_overhead, args.max_concurrency, args.jitter)
+    print(f"{name}: {result}")
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,79 @@
+"""
+Unit test fanOutPlanner.py against fanOutSimulator.py
+"""
+
+
+import unittest
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import fanOutPlanner
+import fanOutSimulator
+
+
+SAMPLE_SECONDS = fanOutPlanner.perSampleSeconds(fanOutPlanner.DEFAULT_STAGE_SECONDS)
+OVERHEAD = fanOutPlanner.DEFAULT_TASK_OVERHEAD_SECONDS
+
+
+class TestFanOutPlanner(unittest.TestCase):
+
+
+
+    def simulate(self, plan, queueDepth, maxConcurrency):
+        return fanOutSimulator.simulate(plan['iterations'], plan['batchSize'], queueDepth,
+                                        SAMPLE_SECONDS, OVERHEAD, maxConcurrency, jitter=0)
+
+
+    def test_every_sample_processed_without_empty_iterations(self):
+        """
+        For backlogs from one sample to millions, the plan processes every
+        sample, no iteration is empty and batches stay within the limits.
+        """
+        for queueDepth in [1, 99, 100, 101, 3999, 64000, 1000000, 7000000]:
+            plan = fanOutPlanner.plan(queueDepth, maxConcurrency=1600, maxBatchSize=2000)
+            result = self.simulate(plan, queueDepth, 1600)
+            self.assertEqual(result['unprocessedSamples'], 0, queueDepth)
+            self.assertEqual(result['emptyIterations'], 0, queueDepth)
+            self.assertLessEqual(plan['batchSize'], 2000)
+
+
+    def test_estimate_matches_simulation(self):
+        """
+        Without jitter the simulated wall-clock time never exceeds the
+        planner's estimate.
+        """
+        for queueDepth in [500, 64000, 1000000]:
+            plan = fanOutPlanner.plan(queueDepth, maxConcurrency=200)
+            result = self.simulate(plan, queueDepth, 200)
+            self.assertLessEqual(result['wallClockSeconds'], plan['estimatedSeconds'] + 1e-6)
+
+
+    def test_faster_than_fixed_fan_out(self):
+        """
+        The plan is never slower than the fixed 40 x 40*sampleBatchSize fan-out.
+        """
+        for queueDepth in [5000, 200000, 1000000]:
+            plan = fanOutPlanner.plan(queueDepth, maxConcurrency=1600, maxBatchSize=2000)
+            planned = self.simulate(plan, queueDepth, 1600)
+            legacy = fanOutSimulator.legacyPlan(queueDepth, 2000)
+            fixed = self.simulate(legacy, queueDepth, 1600)
+            self.assertLessEqual(planned['wallClockSeconds'], fixed['wallClockSeconds'])
+
+
+    def test_map_config_layout(self):
+        """
+        Iterations are spread over outer items of 40 carrying the batch size.
+        """
+        config = fanOutPlanner.mapConfig(85, 120)
+        self.assertEqual([len(f['process']) for f in config], [40, 40, 5])
+        self.assertEqual(config[2]['process'][4], {'id': 4, 'sampleBatchSize': '120'})
+        self.assertEqual(fanOutPlanner.mapConfig(0), [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
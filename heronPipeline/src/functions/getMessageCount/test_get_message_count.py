@@ -0,0 +1,128 @@
+"""
+Unit test app.py in both work distribution modes
+"""
+
+
+import unittest
+from unittest import mock
+import sys
+import os
+import io
+import json
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import app
+import fanOutPlanner
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def Object(self, bucketName, key):
+        body = self.objects[key]
+        return mock.Mock(get=lambda: {'Body': io.BytesIO(body.encode())})
+
+
+class FakeSqs:
+    def __init__(self, depth):
+        self.depth = depth
+
+    def Queue(self, queueName):
+        return mock.Mock(attributes={'ApproximateNumberOfMessages': str(self.depth)})
+
+
+def event(runPangolin=True, pangolinWorkers=0, runArmadillin=True, armadillinWorkers=0):
+    return {
+        'sampleBatchSize': '2000',
+        'executionMode': 'DAILY',
+        'date': '2022-05-01',
+        'runPangolin': runPangolin,
+        'pangolinWorkers': pangolinWorkers,
+        'runArmadillin': runArmadillin,
+        'armadillinWorkers': armadillinWorkers
+    }
+
+
+class TestGetMessageCount(unittest.TestCase):
+
+
+
+    def run_handler(self, workDistribution, resource, handlerEvent):
+        environment = {'WORK_DISTRIBUTION': workDistribution, 'HERON_SAMPLES_BUCKET': 'bucket',
+                       'HERON_DAILY_PROCESSING_QUEUE': 'daily', 'HERON_PROCESSING_QUEUE': 'reprocess'}
+        with mock.patch.dict(os.environ, environment), mock.patch.object(app.boto3, 'resource', lambda *a, **k: resource):
+            return app.lambda_handler(handlerEvent, None)
+
+
+    def test_manifest_mode_maps_every_manifest(self):
+        """
+        MANIFEST mode gives every manifest of the index one iteration, in order.
+        """
+        manifests = [{'messageListS3Key': f"messageList{i}.json", 'iterationUUID': str(i), 'messageCount': 100} for i in range(85)]
+        index = json.dumps({'messageCount': 8500, 'manifests': manifests})
+        s3 = FakeS3({app.MANIFEST_INDEX_KEY.format(date='2022-05-01'): index})
+        result = self.run_handler('MANIFEST', s3, event())
+
+        config = result['manageProcessSequencesBatchMapConfig']
+        self.assertEqual([len(f['process']) for f in config], [40, 40, 5])
+        self.assertEqual([f['manifest'] for outer in config for f in outer['process']], list(range(85)))
+        self.assertEqual(result['messageCount'], '8500')
+        self.assertEqual(result['queueName'], 'daily')
+        self.assertEqual(result['pangolinWorkers'], [])
+        self.assertTrue(result['runPangolin'])
+        self.assertEqual(result['armadillinWorkers'], [])
+        self.assertTrue(result['runArmadillin'])
+
+
+    def test_manifest_mode_with_pangolin_workers(self):
+        """
+        With pangolin workers the iterations don't run pangolin themselves.
+        """
+        index = json.dumps({'messageCount': 0, 'manifests': []})
+        s3 = FakeS3({app.MANIFEST_INDEX_KEY.format(date='2022-05-01'): index})
+        result = self.run_handler('MANIFEST', s3, event(pangolinWorkers=3))
+        self.assertEqual(result['pangolinWorkers'], [0, 1, 2])
+        self.assertFalse(result['runPangolin'])
+        self.assertTrue(result['runArmadillin'])
+
+
+    def test_manifest_mode_with_armadillin_workers(self):
+        """
+        With armadillin workers the iterations don't run armadillin themselves,
+        and none are launched when armadillin isn't run.
+        """
+        index = json.dumps({'messageCount': 0, 'manifests': []})
+        s3 = FakeS3({app.MANIFEST_INDEX_KEY.format(date='2022-05-01'): index})
+        result = self.run_handler('MANIFEST', s3, event(armadillinWorkers=2))
+        self.assertEqual(result['armadillinWorkers'], [0, 1])
+        self.assertFalse(result['runArmadillin'])
+        self.assertTrue(result['runPangolin'])
+        result = self.run_handler('MANIFEST', s3, event(runArmadillin=False, armadillinWorkers=2))
+        self.assertEqual(result['armadillinWorkers'], [])
+        self.assertFalse(result['runArmadillin'])
+
+
+    def test_queue_mode_plans_from_queue_depth(self):
+        """
+        QUEUE mode plans enough iterations of batches within the sample batch
+        size to drain a little more than the reported queue depth.
+        """
+        result = self.run_handler('QUEUE', FakeSqs(64000), event())
+
+        process = [f for outer in result['manageProcessSequencesBatchMapConfig'] for f in outer['process']]
+        batchSizes = [int(f['sampleBatchSize']) for f in process]
+        self.assertGreaterEqual(sum(batchSizes), 64000 * (1 + app.QUEUE_DEPTH_MARGIN))
+        self.assertLessEqual(max(batchSizes), 2000)
+        self.assertTrue(all([len(f['process']) <= fanOutPlanner.NESTED_MAP_SIZE for f in result['manageProcessSequencesBatchMapConfig']]))
+        self.assertEqual(result['messageCount'], '64000')
+        self.assertEqual(result['pangolinWorkers'], [])
+        self.assertEqual(result['armadillinWorkers'], [])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import boto3
+from botocore.config import Config
+from boto3.dynamodb.types import TypeDeserializer
+
+import pendingWork
+
+config = Config(
+   retries = {
+      'max_attempts': 10,
+      'mode': 'standard'
+   }
+)
+
+deserializer = TypeDeserializer()
+
+
+def lambda_handler(event, context):
+    """Lambda function which keeps the sparse pendingWork attribute in step with the sequences table stream
+
+    Parameters
+    ----------
+    event: dict, required
+        DynamoDB stream records with the NEW_IMAGE of each changed sequence
+
+    context: object, required
+        Lambda Context runtime methods and attributes
+
+    Returns
+    ------
+        dict: the number of sequences marked and cleared
+    """
+
+    heronSequencesTableName = os.getenv("HERON_SEQUENCES_TABLE")
+    dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
+    sequencesTable = dynamodb.Table(heronSequencesTableName)
+
+    marked = 0
+    cleared = 0
+    for record in event['Records']:
+      if record['eventName'] == 'REMOVE':
+        continue
+      image = {k: deserializer.deserialize(v) for k, v in record['dynamodb']['NewImage'].items()}
+      seqHash = image['seqHash']
+      isPending = pendingWork.PENDING_WORK_ATTRIBUTE in image
+
+      # The updates below change the item again, their own stream records
+      # find nothing left to do so this can't loop
+      if pendingWork.needsWork(image) and not isPending:
+        marked += pendingWork.markPending(sequencesTable, seqHash)
+      elif not pendingWork.needsWork(image) and isPending:
+        cleared += pendingWork.clearPending(sequencesTable, seqHash)
+
+    print(f"Marked {marked}, cleared {cleared} of {len(event['Records'])} records")
+    return {'marked': marked, 'cleared': cleared}
@@ -0,0 +1,83 @@
+"""
+Keep a sparse pendingWork attribute on the sequences table.
+
+A sequence needs work while it is still a consensus or is missing its
+pangolin or genotype call. Only those items carry pendingWork, so the
+pendingWorkIndex GSI keyed on it holds just the outstanding sequences and
+the daily run can query it instead of scanning the whole table.
+
+The attribute's value is one of PENDING_WORK_SHARDS shard numbers derived
+from the seqHash, spreading the index over several partitions that are
+queried in parallel. It is set and removed with conditional updates that
+check the item as it is now, so they are safe to apply from stale or
+repeated change records.
+
+The markPendingWork stream function only sees items that change after it is
+deployed, so the index is incomplete until migrateData/backfillPendingWork.py
+has marked the existing sequences. The backfill writes BACKFILL_MARKER_KEY to
+the pipeline bucket when it finishes, and the daily run scans the table
+instead of querying the index until that marker exists.
+"""
+
+import hashlib
+from botocore.exceptions import ClientError
+
+PENDING_WORK_ATTRIBUTE = "pendingWork"
+PENDING_WORK_INDEX = "pendingWorkIndex"
+PENDING_WORK_SHARDS = 16
+BACKFILL_MARKER_KEY = "pendingWork/backfilled.json"
+
+NEEDS_WORK_CONDITION = "processingState = :consensus OR attribute_not_exists(pangoCallDate) OR attribute_not_exists(genotypeCallDate)"
+
+
+def shard(seqHash):
+  return str(int(hashlib.md5(seqHash.encode()).hexdigest(), 16) % PENDING_WORK_SHARDS)
+
+
+def needsWork(item):
+  """Whether a sequences table item still needs processing, as the daily filter used to decide"""
+  return item.get('processingState') == "consensus" or 'pangoCallDate' not in item or 'genotypeCallDate' not in item
+
+
+def backfilled(s3, bucketName):
+  """Whether backfillPendingWork.py has finished, so the index holds every sequence that needs work"""
+  try:
+    s3.Object(bucketName, BACKFILL_MARKER_KEY).load()
+    return True
+  except ClientError as e:
+    if e.response['Error']['Code'] in ("404", "NoSuchKey", "NotFound"):
+      return False
+    raise
+
+
+def conditionalUpdate(sequencesTable, **kwargs):
+  """Apply an update, returns False when its condition no longer holds"""
+  try:
+    sequencesTable.update_item(**kwargs)
+    return True
+  except ClientError as e:
+    if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+      return False
+    raise
+
+
+def markPending(sequencesTable, seqHash):
+  """Add the sequence to the index if it needs work and isn't there already"""
+  return conditionalUpdate(
+    sequencesTable,
+    Key={'seqHash': seqHash},
+    UpdateExpression=f"set {PENDING_WORK_ATTRIBUTE}=:shard",
+    ConditionExpression=f"attribute_exists(seqHash) AND attribute_not_exists({PENDING_WORK_ATTRIBUTE}) AND ({NEEDS_WORK_CONDITION})",
+    ExpressionAttributeValues={':shard': shard(seqHash), ':consensus': "consensus"}
+  )
+
+
+def clearPending(sequencesTable, seqHash):
+  """Remove the sequence from the index once all of its calls are done"""
+  return conditionalUpdate(
+    sequencesTable,
+    Key={'seqHash': seqHash},
+    UpdateExpression=f"remove {PENDING_WORK_ATTRIBUTE}",
+    ConditionExpression=f"attribute_exists({PENDING_WORK_ATTRIBUTE}) AND NOT ({NEEDS_WORK_CONDITION})",
+    ExpressionAttributeValues={':consensus': "consensus"}
+  )
@@ -16,6 +16,7 @@ import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import alignedSequence
 
 config = Config(
    retries = {
@@ -76,7 +77,7 @@ def lambda_handler(event, context):
 
         with open(localFilename, "r") as faFile:
           seqData = json.load(faFile)
-        alignedSeq = seqData["aligned"]
+        alignedSeq = alignedSequence.readAligned(s3, bucketName, seqData)
         alignedSeqId = alignedSeq.splitlines()[0]
         seqObject = {'seqId': alignedSeqId, 'seqHash': seqHash}
         seqList.append(seqObject)
@@ -7,6 +7,14 @@ import boto3
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
 import json
+import time
+from parallelReceiver import receiveMessages, JsonListUpload
+import tracing
+
+# Written by addSequencesToQueue in MANIFEST mode
+MANIFEST_INDEX_KEY = "messageLists/{date}/manifests.json"
+RECEIVERS = 8
+UPLOAD_MARGIN_SECONDS = 60
 
 config = Config(
    retries = {
@@ -35,53 +43,60 @@ def lambda_handler(event, context):
     # Create config for this execution
     #++++++++++++++++++++++++++++++++++++++++++++
     queueName = event['queueName']
-    sqs = boto3.resource('sqs', config=config)
-    queue = sqs.Queue(queueName)
 
     bucketName = event['bucketName']
     s3 = boto3.resource('s3', region_name='eu-west-1')
     bucket = s3.Bucket(bucketName)
 
     dateString = event['date'] #os.getenv("DATE_PARTITION")
-    sampleBatchSize = int(event['sampleBatchSize'])
 
 
     #++++++++++++++++++++++++++++++++++++++++++++
-    # Create config for this execution
+    # In MANIFEST mode the batch has already been
+    # written to S3, look it up in the manifest index
     #++++++++++++++++++++++++++++++++++++++++++++
-    stop = False
-    messageList = list()
-    messageReceiptHandles = list()
-    while(stop == False):
-      messages = queue.receive_messages(MaxNumberOfMessages=10, WaitTimeSeconds=2)
-      messageList = messageList + [json.loads(f.body) for f in messages]
-      messageReceiptHandles = messageReceiptHandles + [f.receipt_handle for f in messages]
-      
-      if len(messages) == 0:
-        stop = True
-      if len(messageList) >= sampleBatchSize:
-        stop = True
-      
-      entries = [{
-            'Id': str(ind),
-            'ReceiptHandle': msg.receipt_handle
-        } for ind, msg in enumerate(messages)]
-
-      if len(entries) > 0:
-        queue.delete_messages(Entries=entries)
-
-    messageCount = len(messageList)
+    mapItem = event.get('mapItem') or dict()
+    # The fan-out planner sizes each nested iteration's batch
+    sampleBatchSize = int(mapItem.get('sampleBatchSize', event['sampleBatchSize']))
+    if 'manifest' in mapItem:
+      manifestIndexKey = MANIFEST_INDEX_KEY.format(date=dateString)
+      manifestIndex = json.loads(s3.Object(bucketName, manifestIndexKey).get()['Body'].read())
+      manifest = manifestIndex['manifests'][int(mapItem['manifest'])]
+      span = tracing.Span("readSampleBatchFromQueue", manifest['iterationUUID'], dateString, bucketName)
+      span.sampleCount = manifest['messageCount']
+      span.finish(mode="MANIFEST")
+      return {
+        'messageCount': manifest['messageCount'],
+        'messageListS3Key': manifest['messageListS3Key'],
+        'queueName': queueName,
+        'iterationUUID': manifest['iterationUUID']
+      }
 
+    #++++++++++++++++++++++++++++++++++++++++++++
+    # Receive the batch with concurrent receivers,
+    # streaming the messageList to S3 as it fills
+    #++++++++++++++++++++++++++++++++++++++++++++
     iterationUUID = str(uuid4())
+    span = tracing.Span("readSampleBatchFromQueue", iterationUUID, dateString, bucketName)
     messageListFileName = f"messageList{iterationUUID}.json"
     messageListS3Key = f"messageLists/{dateString}/{messageListFileName}"
-    # Save messageList to s3 as a json file
-    # with open(f"tmp/{messageListFileName}", "w") as write_file:
-    #   json.dump(messageList, write_file)
-
 
-    # Upload the file to S3
-    s3.Object(bucketName, messageListS3Key).put(Body=json.dumps(messageList))
+    # Leave time to finish the upload before Lambda times out
+    deadline = None
+    if context is not None:
+      deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - UPLOAD_MARGIN_SECONDS
+
+    sqsClient = boto3.client('sqs', config=config)
+    messageListUpload = JsonListUpload(boto3.client('s3', region_name='eu-west-1'), bucketName, messageListS3Key)
+    try:
+      receiveMessages(sqsClient, queueName, sampleBatchSize, messageListUpload.append, receivers=RECEIVERS, deadline=deadline)
+      messageCount = messageListUpload.close()
+    except Exception:
+      # Don't leave the parts of a failed upload stored
+      messageListUpload.abort()
+      raise
+    span.sampleCount = messageCount
+    span.finish(mode="QUEUE")
 
 
     messages = {'messageCount': messageCount, 'messageListS3Key': messageListS3Key, 'queueName': queueName, 'iterationUUID': iterationUUID}
@@ -0,0 +1,157 @@
+"""
+Fill a sample batch from SQS with several long-poll receivers at once.
+
+Each receiver claims up to 10 of the remaining slots in the batch before it
+polls, so together they never take more than the batch size from the queue.
+Messages are handed on as they arrive, to be streamed to S3 by
+JsonListUpload, and are deleted in parallel batches straight away because
+the queue's visibility timeout is shorter than a full batch can take.
+"""
+
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SQS_MAX_BATCH = 10
+DELETE_ATTEMPTS = 5
+
+
+def deleteMessages(sqsClient, queueUrl, entries):
+  """Delete one batch of messages, retrying the entries that fail"""
+  for attempt in range(DELETE_ATTEMPTS):
+    response = sqsClient.delete_message_batch(QueueUrl=queueUrl, Entries=entries)
+    failedIds = set([f['Id'] for f in response.get('Failed', [])])
+    entries = [f for f in entries if f['Id'] in failedIds]
+    if len(entries) == 0:
+      return
+    time.sleep(0.1 * (2 ** attempt))
+  print(f"Failed to delete {len(entries)} messages")
+
+
+def receiveMessages(sqsClient, queueUrl, target, onMessages, receivers=8, waitSeconds=2, deadline=None):
+  """Receive up to target messages, passing each list of decoded bodies to onMessages
+
+  Stops when the batch is full, when a receiver finds the queue empty or at
+  the deadline (a time.time() value). Returns the number of messages received.
+  """
+  lock = threading.Lock()
+  state = {'claimed': 0, 'received': 0}
+  drained = threading.Event()
+  deleteExecutor = ThreadPoolExecutor(max_workers=receivers)
+  deleteFutures = list()
+
+  def receiver():
+    while not drained.is_set() and (deadline is None or time.time() < deadline):
+      with lock:
+        claim = min(SQS_MAX_BATCH, target - state['claimed'])
+        state['claimed'] += max(claim, 0)
+      if claim <= 0:
+        return
+
+      response = sqsClient.receive_message(QueueUrl=queueUrl, MaxNumberOfMessages=claim, WaitTimeSeconds=waitSeconds)
+      messages = response.get('Messages', [])
+      with lock:
+        state['claimed'] -= claim - len(messages)
+        state['received'] += len(messages)
+      if len(messages) == 0:
+        drained.set()
+        return
+
+      onMessages([json.loads(f['Body']) for f in messages])
+      entries = [{'Id': str(i), 'ReceiptHandle': f['ReceiptHandle']} for i, f in enumerate(messages)]
+      future = deleteExecutor.submit(deleteMessages, sqsClient, queueUrl, entries)
+      with lock:
+        deleteFutures.append(future)
+
+  with ThreadPoolExecutor(max_workers=receivers) as executor:
+    for future in [executor.submit(receiver) for f in range(receivers)]:
+      future.result()
+
+  for future in deleteFutures:
+    future.result()
+  deleteExecutor.shutdown()
+  return state['received']
+
+
+class JsonListUpload:
+  """Stream a JSON list to an S3 object as items are appended
+
+  Items are serialised into a buffer that is uploaded as a multipart part
+  each time it fills, a list that never fills a part is written with a
+  single put when the upload is closed. If a part or the completion fails
+  the multipart upload is aborted, so its parts aren't left stored and
+  billed, and the error is raised.
+  """
+  PART_SIZE = 8 * 1024 * 1024
+
+  def __init__(self, s3Client, bucketName, key):
+    self.s3Client = s3Client
+    self.bucketName = bucketName
+    self.key = key
+    self.lock = threading.Lock()
+    self.buffer = bytearray(b"[")
+    self.count = 0
+    self.uploadId = None
+    self.parts = list()
+    self.aborted = False
+
+  def append(self, items):
+    with self.lock:
+      for item in items:
+        if self.count > 0:
+          self.buffer += b", "
+        self.buffer += json.dumps(item).encode()
+        self.count += 1
+      if len(self.buffer) >= self.PART_SIZE:
+        self.uploadPart()
+
+  def uploadPart(self):
+    if self.aborted:
+      raise RuntimeError(f"Upload of {self.key} was aborted")
+    try:
+      if self.uploadId is None:
+        self.uploadId = self.s3Client.create_multipart_upload(Bucket=self.bucketName, Key=self.key)['UploadId']
+      partNumber = len(self.parts) + 1
+      response = self.s3Client.upload_part(
+        Bucket=self.bucketName, Key=self.key, UploadId=self.uploadId,
+        PartNumber=partNumber, Body=bytes(self.buffer)
+      )
+    except Exception:
+      self.abortUpload()
+      raise
+    self.parts.append({'ETag': response['ETag'], 'PartNumber': partNumber})
+    self.buffer = bytearray()
+
+  def close(self):
+    """Finish the object, returns the number of items written"""
+    with self.lock:
+      self.buffer += b"]"
+      if self.uploadId is None:
+        self.s3Client.put_object(Bucket=self.bucketName, Key=self.key, Body=bytes(self.buffer))
+      else:
+        self.uploadPart()
+        try:
+          self.s3Client.complete_multipart_upload(
+            Bucket=self.bucketName, Key=self.key, UploadId=self.uploadId,
+            MultipartUpload={'Parts': self.parts}
+          )
+        except Exception:
+          self.abortUpload()
+          raise
+      return self.count
+
+  def abort(self):
+    """Abandon the object, for callers that fail before closing it"""
+    with self.lock:
+      self.abortUpload()
+
+  def abortUpload(self):
+    self.aborted = True
+    if self.uploadId is None:
+      return
+    try:
+      self.s3Client.abort_multipart_upload(Bucket=self.bucketName, Key=self.key, UploadId=self.uploadId)
+    except Exception as e:
+      print(f"Failed to abort the upload of {self.key}: {e}")
+    self.uploadId = None
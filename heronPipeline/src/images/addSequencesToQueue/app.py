@@ -1,8 +1,6 @@
 from datetime import datetime
 from random import randint
 from uuid import uuid4
-import numpy as np
-import pandas as pd
 import math
 import os
 import uuid
@@ -12,6 +10,11 @@ from boto3.dynamodb.conditions import Key, Attr
 from decimal import Decimal
 import json
 import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from batchSender import BatchSender, SQS_MAX_BATCH
+import pendingWork
+import fanOutPlanner
 
 config = Config(
    retries = {
@@ -20,12 +23,149 @@ config = Config(
    }
 )
 
+# The only attributes the processing stages read from a message
+MESSAGE_ATTRIBUTES = ['consensusFastaPath', 'processingState', 'seqHash', 'sequencePack']
+# Written in MANIFEST mode, lists the messageList manifests for getMessageCount to map over
+MANIFEST_INDEX_KEY = "messageLists/{date}/manifests.json"
+
 class DecimalEncoder(json.JSONEncoder):
   def default(self, obj):
     if isinstance(obj, Decimal):
       return float(obj)
     return json.JSONEncoder.default(self, obj)
 
+def messageBody(item):
+  return {f: item.get(f) for f in MESSAGE_ATTRIBUTES}
+
+class QueueWriter:
+  """Pass items to the shared BatchSender in batches of 10"""
+  def __init__(self, sender):
+    self.sender = sender
+    self.batch = list()
+
+  def add(self, item):
+    self.batch.append(messageBody(item))
+    if len(self.batch) == SQS_MAX_BATCH:
+      self.flush()
+
+  def flush(self):
+    if len(self.batch) > 0:
+      self.sender.submit(self.batch)
+      self.batch = list()
+
+class SpoolWriter:
+  """Spool items to a local file of JSON lines, one per table segment
+
+  The items are only cut into manifests once every segment has been read and
+  the total is known, so the batch size can be planned from it.
+  """
+  def __init__(self, session, spoolDir):
+    self.file = tempfile.NamedTemporaryFile('w', dir=spoolDir, suffix=".jsonl", delete=False)
+    self.filename = self.file.name
+    self.messageCount = 0
+
+  def add(self, item):
+    self.file.write(json.dumps(messageBody(item), cls=DecimalEncoder) + "\n")
+    self.messageCount += 1
+
+  def flush(self):
+    self.file.close()
+
+  def messages(self):
+    with open(self.filename) as file:
+      for line in file:
+        yield json.loads(line)
+
+class ManifestWriter:
+  """Write messages to S3 as messageList manifests of batchSize messages,
+  the same files readSampleBatchFromQueue would have built from the queue.
+  The manifests are uploaded concurrently on the executor"""
+  def __init__(self, s3, bucketName, dateString, batchSize, executor):
+    self.s3 = s3
+    self.bucketName = bucketName
+    self.dateString = dateString
+    self.batchSize = batchSize
+    self.executor = executor
+    self.batch = list()
+    self.manifests = list()
+    self.uploads = list()
+    self.messageCount = 0
+
+  def add(self, message):
+    self.batch.append(message)
+    if len(self.batch) == self.batchSize:
+      self.flush()
+
+  def flush(self):
+    if len(self.batch) == 0:
+      return
+    iterationUUID = str(uuid.uuid4())
+    messageListS3Key = f"messageLists/{self.dateString}/messageList{iterationUUID}.json"
+    body = json.dumps(self.batch)
+    self.uploads.append(self.executor.submit(lambda: self.s3.Object(self.bucketName, messageListS3Key).put(Body=body)))
+    self.manifests.append({'messageListS3Key': messageListS3Key, 'iterationUUID': iterationUUID, 'messageCount': len(self.batch)})
+    self.messageCount += len(self.batch)
+    self.batch = list()
+
+  def close(self):
+    """Write the last, short, manifest and wait for every upload"""
+    self.flush()
+    for upload in self.uploads:
+      upload.result()
+
+def scanSegment(tableName, scanKwargs, segment, totalSegments, createWriter, flush=True):
+  """Scan one segment of the sequences table, passing every item it returns to a writer
+
+  Returns the writer, its last partial batch is left unwritten when flush is False
+  """
+  # boto3 resources aren't thread safe, each segment creates its own
+  session = boto3.session.Session()
+  sequencesTable = session.resource('dynamodb', region_name="eu-west-1", config=config).Table(tableName)
+  writer = createWriter(session)
+
+  scanKwargs = dict(scanKwargs, Segment=segment, TotalSegments=totalSegments)
+  while True:
+    response = sequencesTable.scan(**scanKwargs)
+    for item in response['Items']:
+      writer.add(item)
+
+    startKey = response.get('LastEvaluatedKey', None)
+    if startKey is None:
+      break
+    scanKwargs['ExclusiveStartKey'] = startKey
+
+  if flush:
+    writer.flush()
+  return writer
+
+def querySegment(tableName, queryKwargs, segment, totalSegments, createWriter, flush=True):
+  """Query one shard of the sparse pendingWorkIndex, passing every item it returns to a writer
+
+  Takes the same arguments as scanSegment, segment is the shard number
+  """
+  session = boto3.session.Session()
+  sequencesTable = session.resource('dynamodb', region_name="eu-west-1", config=config).Table(tableName)
+  writer = createWriter(session)
+
+  queryKwargs = dict(
+    queryKwargs,
+    IndexName=pendingWork.PENDING_WORK_INDEX,
+    KeyConditionExpression=Key(pendingWork.PENDING_WORK_ATTRIBUTE).eq(str(segment))
+  )
+  while True:
+    response = sequencesTable.query(**queryKwargs)
+    for item in response['Items']:
+      writer.add(item)
+
+    startKey = response.get('LastEvaluatedKey', None)
+    if startKey is None:
+      break
+    queryKwargs['ExclusiveStartKey'] = startKey
+
+  if flush:
+    writer.flush()
+  return writer
+
 def main():
 
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
@@ -35,114 +175,104 @@ def main():
   reprocessingQueueName = os.getenv("HERON_PROCESSING_QUEUE")
   dailyProcessingQueueName = os.getenv("HERON_DAILY_PROCESSING_QUEUE")
   executionMode = os.getenv("EXECUTION_MODE")
+  scanSegments = int(os.getenv("SCAN_SEGMENTS", "8"))
+  sendConcurrency = int(os.getenv("SEND_CONCURRENCY", "16"))
+  workDistribution = os.getenv("WORK_DISTRIBUTION", "QUEUE")
+  bucketName = os.getenv("HERON_SAMPLES_BUCKET")
+  dateString = os.getenv("DATE_PARTITION")
+  sampleBatchSize = int(os.getenv("SAMPLE_BATCH_SIZE", "2000"))
+  usePendingWorkIndex = os.getenv("USE_PENDING_WORK_INDEX", "false").lower() == "true"
+  # Plans the MANIFEST batch size, see getMessageCount
+  stageSeconds = fanOutPlanner.stageSecondsFromEnvironment(os.getenv("STAGE_SECONDS"))
+  maxConcurrency = int(os.getenv("MAX_CONCURRENCY", str(fanOutPlanner.NESTED_MAP_SIZE * fanOutPlanner.NESTED_MAP_SIZE)))
 
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
   # Create AWS resource clients
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
   sqs = boto3.resource('sqs')
-  dynamodbClient = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
-  sequencesTable = dynamodbClient.Table(heronSequencesTableName)
 
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
   # Determine the mode for this execution
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
   scan_kwargs = dict()
+  readSegment = scanSegment
+  projection = MESSAGE_ATTRIBUTES
 
   # Select the queue, default to daily
   queueName = dailyProcessingQueueName
   if executionMode == "REPROCESS":
     queueName = reprocessingQueueName
+  elif usePendingWorkIndex and not pendingWork.backfilled(boto3.resource('s3', region_name='eu-west-1'), bucketName):
+    print(f"No {pendingWork.BACKFILL_MARKER_KEY} yet, scanning until backfillPendingWork.py has filled the pendingWorkIndex")
+    scan_kwargs['FilterExpression'] = Attr("processingState").eq("consensus") | Attr("pangoCallDate").not_exists() | Attr("genotypeCallDate").not_exists()
+  elif usePendingWorkIndex:
+    # Only sequences that need work are in the sparse index, query its shards instead of scanning
+    readSegment = querySegment
+    scanSegments = pendingWork.PENDING_WORK_SHARDS
   else:
     scan_kwargs['FilterExpression'] = Attr("processingState").eq("consensus") | Attr("pangoCallDate").not_exists() | Attr("genotypeCallDate").not_exists()
   
-  # Create the queue object
-  queue = sqs.Queue(queueName)
+  scan_kwargs['ProjectionExpression'] = ", ".join(projection)
+
+  if workDistribution == "MANIFEST":
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Read the table in parallel segments, spooling the
+    # messages to local files, then cut them into
+    # messageList manifests of the batch size the fan-out
+    # planner picks for the whole backlog
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    spoolDir = tempfile.mkdtemp(prefix="manifestSpool_")
+    createWriter = lambda session: SpoolWriter(session, spoolDir)
+    with ThreadPoolExecutor(max_workers=scanSegments) as executor:
+      writers = list(executor.map(
+        lambda segment: readSegment(heronSequencesTableName, scan_kwargs, segment, scanSegments, createWriter),
+        range(scanSegments)
+      ))
+    totalMessages = sum([f.messageCount for f in writers])
+
+    fanOutPlan = fanOutPlanner.plan(totalMessages, stageSeconds, maxConcurrency, maxBatchSize=sampleBatchSize)
+    print(f"Fan-out plan for {totalMessages} messages: {fanOutPlan}")
+
+    s3 = boto3.resource('s3', region_name='eu-west-1')
+    with ThreadPoolExecutor(max_workers=sendConcurrency) as executor:
+      manifestWriter = ManifestWriter(s3, bucketName, dateString, max(1, fanOutPlan['batchSize']), executor)
+      for writer in writers:
+        for message in writer.messages():
+          manifestWriter.add(message)
+        os.remove(writer.filename)
+      manifestWriter.close()
+    os.rmdir(spoolDir)
+
+    manifests = manifestWriter.manifests
+    messageCount = manifestWriter.messageCount
+    manifestIndex = {'messageCount': messageCount, 'manifests': manifests}
+    s3.Object(bucketName, MANIFEST_INDEX_KEY.format(date=dateString)).put(Body=json.dumps(manifestIndex))
+    print(f"Manifest Count: {len(manifests)}")
+  else:
+    # Create the queue object
+    queue = sqs.Queue(queueName)
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Purge the queue so we start from a clean state
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    queue.purge()
+    time.sleep(60)
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Read the table in parallel segments, each segment
+    # streaming its items straight into send batches that
+    # are kept in flight concurrently
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    sender = BatchSender(boto3.client('sqs', config=config), queueName, maxInFlight=sendConcurrency, encoder=DecimalEncoder)
+    createWriter = lambda session: QueueWriter(sender)
+    with ThreadPoolExecutor(max_workers=scanSegments) as executor:
+      writers = list(executor.map(
+        lambda segment: readSegment(heronSequencesTableName, scan_kwargs, segment, scanSegments, createWriter),
+        range(scanSegments)
+      ))
+    messageCount = sender.close()
+    sender.report()
 
-  #+++++++++++++++++++++++++++++++++++++++++++++++++++++
-  # Purge the queue so we start from a clean state
-  #+++++++++++++++++++++++++++++++++++++++++++++++++++++
-  queue.purge()
-  time.sleep(60)
-  
-  #+++++++++++++++++++++++++++++++++++++++++++++++++++++
-  # Start the scan and continue until all items have been 
-  # read from the table
-  #+++++++++++++++++++++++++++++++++++++++++++++++++++++
-  # response = sequencesTable.scan(**scan_kwargs)
-  # startKey = response.get('LastEvaluatedKey', None)
-  # samples = response['Items']
-  # scan_kwargs['ExclusiveStartKey'] = startKey
-  
-  batchCount = 0
-  startKey = "N/A"
-  messageCount = 0
-  while startKey is not None:
-    response = sequencesTable.scan(**scan_kwargs)
-    if len(response['Items']) > 0:
-      startKey = response.get('LastEvaluatedKey', None)
-      scan_kwargs['ExclusiveStartKey'] = startKey
-      numItems = len(response['Items'])
-      numBatches = math.ceil(numItems / 10)
-      itemsDf = pd.DataFrame(response['Items'])
-    
-      itemsDf = pd.DataFrame({
-       'consensusFastaPath': itemsDf['consensusFastaPath'],
-        'processingState': itemsDf['processingState'],
-        'seqHash': itemsDf['seqHash']
-      })
-      
-      ret = np.array_split(itemsDf,numBatches)
-      for i,items in enumerate(ret):
-        entries = list()
-        for index, row in items.iterrows():
-          groupId = str(uuid.uuid4()) #Each batch of 10 messages gets a new group ID, this will provide for higher numbers of concurrent consumers
-          messageGroupId = groupId
-          entry = {
-            'Id': str(index),
-            'MessageBody': json.dumps(row.to_dict(), cls=DecimalEncoder),
-            'MessageGroupId': messageGroupId
-          }
-          entries.append(entry)
-        
-        ret = queue.send_messages(Entries=entries)
-
-        successfullMessages = ret['Successful']
-        messageCount += len(successfullMessages)
-        if 'Failed' in ret:
-          failedMessages = ret['Failed']
-          failedMessageCount = len(failedMessages)
-        else:
-          failedMessageCount = 0
-
-        while failedMessageCount > 0:
-          # Try the failed messages again
-          entries = list()
-          for failedMessage in failedMessages:
-            messageGroupId = f"group_{math.ceil(messageCount / 1000)-1}"
-            itemsDfId = int(failedMessage['Id'])
-            row = items[itemsDfId:itemsDfId+1]
-            entry = {
-              'Id': str(itemsDfId),
-              'MessageBody': json.dumps(row.to_dict(), cls=DecimalEncoder),
-              'MessageGroupId': messageGroupId
-            }
-            entries.append(entry)
-            ret = queue.send_messages(Entries=entries)
-            successfullMessages = ret['Successful']
-            messageCount += len(successfullMessages)
-            if 'Failed' in ret:
-              failedMessages = ret['Failed']
-              failedMessageCount = len(failedMessages)
-              print(f"Failed Message Count {failedMessageCount}")
-            else:
-              failedMessageCount = 0
-    else:
-      startKey = response.get('LastEvaluatedKey', None)
-      scan_kwargs['ExclusiveStartKey'] = startKey
-      
-    # if messageCount > 1000:
-    #     break
-    
   print(f"Message Count: {messageCount}")
   # Generate config for nested StepFunction map state
   mapStateSize = math.ceil(messageCount/1000)
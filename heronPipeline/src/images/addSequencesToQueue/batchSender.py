@@ -0,0 +1,102 @@
+"""
+Enqueue messages on SQS with many SendMessageBatch calls in flight.
+
+Batches of up to 10 messages are sent from a thread pool, at most
+maxInFlight at a time so the scan producing them can't run ahead without
+bound. Only the entries SQS reports as failed are resent, with exponential
+backoff and jitter, and they keep the message group of their batch.
+"""
+
+import json
+import time
+import uuid
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SQS_MAX_BATCH = 10
+
+
+class BatchSender:
+  """Send message bodies to one queue in concurrent batches of 10"""
+
+  def __init__(self, sqsClient, queueUrl, maxInFlight=16, maxAttempts=8, baseDelay=0.1, maxDelay=20, encoder=None):
+    self.sqsClient = sqsClient
+    self.queueUrl = queueUrl
+    self.maxAttempts = maxAttempts
+    self.baseDelay = baseDelay
+    self.maxDelay = maxDelay
+    self.encoder = encoder
+    self.executor = ThreadPoolExecutor(max_workers=maxInFlight)
+    self.inFlight = threading.BoundedSemaphore(maxInFlight)
+    self.lock = threading.Lock()
+    self.sent = 0
+    self.failed = 0
+    self.retried = 0
+    self.startTime = time.time()
+
+  def submit(self, bodies):
+    """Queue up to 10 message bodies as one batch, blocks while maxInFlight batches are being sent"""
+    if len(bodies) == 0:
+      return
+    if len(bodies) > SQS_MAX_BATCH:
+      raise ValueError(f"At most {SQS_MAX_BATCH} messages per batch")
+    # Each batch of 10 messages gets a new group ID, this will provide for higher numbers of concurrent consumers
+    groupId = str(uuid.uuid4())
+    entries = [
+      {
+        'Id': str(i),
+        'MessageBody': json.dumps(body, cls=self.encoder),
+        'MessageGroupId': groupId
+      }
+      for i, body in enumerate(bodies)
+    ]
+    self.inFlight.acquire()
+    try:
+      future = self.executor.submit(self.send, entries)
+    except:
+      self.inFlight.release()
+      raise
+    future.add_done_callback(lambda f: self.inFlight.release())
+
+  def send(self, entries):
+    """Send one batch, resending only the failed entries until they succeed or attempts run out"""
+    for attempt in range(self.maxAttempts):
+      if attempt > 0:
+        delay = min(self.maxDelay, self.baseDelay * (2 ** attempt))
+        time.sleep(random.uniform(0, delay))
+      try:
+        response = self.sqsClient.send_message_batch(QueueUrl=self.queueUrl, Entries=entries)
+      except Exception as e:
+        print(f"SendMessageBatch failed: {e}")
+        continue
+
+      successful = len(response.get('Successful', []))
+      failed = response.get('Failed', [])
+      # Sender faults (e.g. an invalid message) fail again however often they are sent
+      permanent = [f for f in failed if f.get('SenderFault', False)]
+      retryIds = set([f['Id'] for f in failed if not f.get('SenderFault', False)])
+      for f in permanent:
+        print(f"Message rejected: {f.get('Code')} {f.get('Message')}")
+      with self.lock:
+        self.sent += successful
+        self.failed += len(permanent)
+        if len(retryIds) > 0:
+          self.retried += len(retryIds)
+
+      entries = [f for f in entries if f['Id'] in retryIds]
+      if len(entries) == 0:
+        return
+
+    with self.lock:
+      self.failed += len(entries)
+    print(f"Gave up on {len(entries)} messages after {self.maxAttempts} attempts")
+
+  def close(self):
+    """Wait for every batch to be sent, returns the number of messages sent"""
+    self.executor.shutdown(wait=True)
+    return self.sent
+
+  def report(self):
+    elapsed = max(time.time() - self.startTime, 1e-6)
+    print(f"Sent {self.sent} messages in {elapsed:.1f}s ({self.sent / elapsed:.0f} messages/s), {self.retried} retried, {self.failed} failed")
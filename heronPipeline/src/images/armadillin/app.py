@@ -11,6 +11,8 @@ from decimal import Decimal
 # from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import sequenceDedup
+import resultWriter
 
 config = Config(
    retries = {
@@ -37,6 +39,7 @@ s3 = boto3.resource('s3', region_name='eu-west-1')
 bucket = s3.Bucket(bucketName)
 dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
 sequencesTable = dynamodb.Table(heronSequencesTableName)
+writer = resultWriter.ResultWriter(boto3.client('dynamodb', region_name="eu-west-1", config=resultWriter.CONFIG))
 
 ##############################################
 ###### Create the input file paths ###########
@@ -51,6 +54,7 @@ keyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
 # Step 2. Prepare Inout data to compressed file
 ##############################################
 keyFileDf = pd.read_json(keyFile, orient="records")
+duplicates = sequenceDedup.loadDuplicates(sequenceDedup.duplicatesFile(sampleDataRootSeqBatchesDir, iterationUUID))
 print(f"Processing seqBatchFile: {seqFile}")
 updateCount = 0
 if (os.path.isfile(seqFile) == True) & (os.path.isfile(armadillinOutputFilename) == True):
@@ -75,24 +79,18 @@ if (os.path.isfile(seqFile) == True) & (os.path.isfile(armadillinOutputFilename)
       seqHash = row["seqHash"]
       lineage = row["lineage"]
       seqId = row['seqId']
-      # Create query for dynamoDB
-      sequencesTable = dynamodb.Table(heronSequencesTableName)
-      response = sequencesTable.query(KeyConditionExpression=Key('seqHash').eq(seqHash))
-      if 'Items' in response:
-         if len(response['Items']) == 1:
-            item = response['Items'][0]
-            print(f"Updating: {seqHash}")
-            ret = sequencesTable.update_item(
-               Key={'seqHash': seqHash},
-               UpdateExpression="set armadillinLineage=:l, armadillinCallDate=:d",
-               ExpressionAttributeValues={
-               ':l': lineage,
-               ':d': callDate
-               }
-            )
-            updateCount += 1
+      # Sequences identical to this one get the same lineage, only items that exist are updated
+      for targetHash in sequenceDedup.targets(duplicates, seqHash):
+         writer.update(
+            heronSequencesTableName,
+            {'seqHash': targetHash},
+            {'armadillinLineage': lineage, 'armadillinCallDate': callDate},
+            mustExist=True
+         )
 
+   updateCount = writer.flush()['items']
    print(f"Updated {updateCount} out of {len(resultsJoinedDf)}")
+   writer.raiseOnFailures()
 
 
 # Exit
\ No newline at end of file
@@ -2,6 +2,10 @@
 
 
 
+# ARMADILLIN_WORKER=true keeps this container working through the day's iterations
+if [ "$ARMADILLIN_WORKER" = "true" ]; then
+  exec python3 worker.py
+fi
 SEQ_BATCH_FILE=$SEQ_DATA_ROOT/$DATE_PARTITION/seqBatchFiles/sequences_$ITERATION_UUID.fasta
 gzip -c $SEQ_BATCH_FILE > /tmp/seqFile.gz
 armadillin --update
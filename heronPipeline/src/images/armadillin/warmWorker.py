@@ -0,0 +1,127 @@
+"""
+Keep one lineage assignment container working through many iterations.
+
+Run as one Fargate task per iteration, pangolin and armadillin pay the task
+start up, the image pull and their own set up for every batch. In worker
+mode a container instead works through the day's iterations until none are
+left:
+
+  - the iterations are the manifests addSequencesToQueue listed in
+    messageLists/{date}/manifests.json
+  - an iteration is ready once prepareSequences has written
+    sequences_{iterationUUID}.ready next to its batch files on EFS
+  - a worker claims a ready iteration by creating
+    {SEQ_DATA_ROOT}/{date}/lineageWork/{name}/{iterationUUID}.claim
+    exclusively, as referenceIndex does for its build lock, and marks it
+    .done or .failed once processed
+
+Workers stop when every iteration is finished, or when none has become
+ready or finished for idleSeconds, which covers iterations whose earlier
+stages failed. The idle time is counted from the first iteration a worker
+sees ready, so workers launched alongside the iterations wait out the first
+iterations' alignment, up to startupSeconds.
+"""
+
+import os
+import json
+import time
+
+MANIFEST_INDEX_KEY = "messageLists/{date}/manifests.json"
+WORK_FOLDER = "lineageWork"
+# A claim older than this is assumed to belong to a worker that died
+STALE_CLAIM_SECONDS = 7200
+
+
+def readyFile(sampleDataRootSeqBatchesDir, iterationUUID):
+  return f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.ready"
+
+
+def readIterations(s3, bucketName, dateString):
+  """iterationUUIDs of the day's messageList manifests"""
+  manifestIndexKey = MANIFEST_INDEX_KEY.format(date=dateString)
+  manifestIndex = json.loads(s3.Object(bucketName, manifestIndexKey).get()['Body'].read())
+  return [f['iterationUUID'] for f in manifestIndex['manifests']]
+
+
+def isFinished(workDir, iterationUUID):
+  return os.path.isfile(f"{workDir}/{iterationUUID}.done") or os.path.isfile(f"{workDir}/{iterationUUID}.failed")
+
+
+def claim(workDir, iterationUUID):
+  """True if this worker now holds the iteration"""
+  claimPath = f"{workDir}/{iterationUUID}.claim"
+  try:
+    claimFd = os.open(claimPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+  except FileExistsError:
+    try:
+      if time.time() - os.path.getmtime(claimPath) > STALE_CLAIM_SECONDS:
+        print(f"Removing stale claim: {claimPath}")
+        os.remove(claimPath)
+    except OSError:
+      pass
+    return False
+  os.write(claimFd, str(os.getpid()).encode())
+  os.close(claimFd)
+  return True
+
+
+def finish(workDir, iterationUUID, status, seconds):
+  with open(f"{workDir}/{iterationUUID}.{status}", "w") as statusFile:
+    json.dump({'seconds': seconds}, statusFile)
+
+
+def run(name, iterations, workRoot, isReady, process, idleSeconds=900, pollSeconds=30, startupSeconds=7200):
+  """Claim and process ready iterations until all are finished
+
+  isReady(iterationUUID) says whether an iteration's input is in place and
+  process(iterationUUID) processes it, an exception marks it failed.
+  Returns the number of iterations this worker processed.
+  """
+  workDir = f"{workRoot}/{name}"
+  os.makedirs(workDir, exist_ok=True)
+  pending = list(iterations)
+  processed = 0
+  startTime = time.time()
+  # None until an iteration is ready or finished
+  lastProgress = None
+  while len(pending) > 0:
+    claimed = None
+    for iterationUUID in list(pending):
+      if isFinished(workDir, iterationUUID):
+        pending.remove(iterationUUID)
+        lastProgress = time.time()
+      elif isReady(iterationUUID):
+        if lastProgress is None:
+          lastProgress = time.time()
+        if claim(workDir, iterationUUID):
+          claimed = iterationUUID
+          break
+
+    if claimed is None:
+      if lastProgress is None and time.time() - startTime > startupSeconds:
+        print(f"No iteration ready after {startupSeconds}s, leaving {len(pending)} iterations")
+        break
+      if lastProgress is not None and time.time() - lastProgress > idleSeconds:
+        print(f"No progress for {idleSeconds}s, leaving {len(pending)} iterations")
+        break
+      time.sleep(pollSeconds)
+      continue
+
+    iterationStart = time.time()
+    status = "done"
+    try:
+      process(claimed)
+    except SystemExit as e:
+      if e.code not in (None, 0):
+        print(f"Iteration {claimed} exited with {e.code}")
+        status = "failed"
+    except Exception as e:
+      print(f"Iteration {claimed} failed: {e}")
+      status = "failed"
+    seconds = time.time() - iterationStart
+    finish(workDir, claimed, status, seconds)
+    print(f"Iteration {claimed} {status} in {seconds:.1f}s")
+    pending.remove(claimed)
+    processed += 1
+    lastProgress = time.time()
+  return processed
@@ -0,0 +1,55 @@
+import os
+import gzip
+import runpy
+import shutil
+import subprocess
+import boto3
+import warmWorker
+
+##############################################
+# Step 1. Get Env Vars
+##############################################
+dateString = os.getenv('DATE_PARTITION')
+bucketName = os.getenv('HERON_SAMPLES_BUCKET')
+sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
+# Stop once nothing has become ready or finished for this long
+idleSeconds = int(os.getenv('WORKER_IDLE_SECONDS', '900'))
+# How long to wait for the first iteration to become ready
+startupSeconds = int(os.getenv('WORKER_STARTUP_SECONDS', '7200'))
+
+sampleDataRootSeqBatchesDir = f"{sampleDataRoot}/{dateString}/seqBatchFiles"
+appScript = os.path.join(os.path.dirname(os.path.realpath(__file__)), "app.py")
+
+s3 = boto3.resource('s3', region_name='eu-west-1')
+iterations = warmWorker.readIterations(s3, bucketName, dateString)
+print(f"Armadillin worker for {len(iterations)} iterations")
+
+##############################################
+# Step 2. Fetch the model once for every iteration
+#         this worker processes
+##############################################
+subprocess.run(["armadillin", "--update"], check=True)
+
+##############################################
+# Step 3. Run each iteration as entrypoint.sh does,
+#         app.py runs in this process
+##############################################
+def processIteration(iterationUUID):
+  seqBatchFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.fasta"
+  with open(seqBatchFile, "rb") as fastaFile, gzip.open("/tmp/seqFile.gz", "wb") as gzipFile:
+    shutil.copyfileobj(fastaFile, gzipFile)
+  with open("/tmp/results.tsv", "w") as resultsFile:
+    subprocess.run(["armadillin", "--seqs_are_aligned", "/tmp/seqFile.gz"], stdout=resultsFile, check=True)
+  os.environ['ITERATION_UUID'] = iterationUUID
+  runpy.run_path(appScript, run_name="__main__")
+
+processed = warmWorker.run(
+  "armadillin",
+  iterations,
+  f"{sampleDataRoot}/{dateString}/{warmWorker.WORK_FOLDER}",
+  lambda iterationUUID: os.path.isfile(warmWorker.readyFile(sampleDataRootSeqBatchesDir, iterationUUID)),
+  processIteration,
+  idleSeconds=idleSeconds,
+  startupSeconds=startupSeconds
+)
+print(f"Armadillin worker processed {processed} iterations")
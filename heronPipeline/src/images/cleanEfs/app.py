@@ -16,6 +16,7 @@ import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import alignmentCache
 
 config = Config(
    retries = {
@@ -31,6 +32,8 @@ config = Config(
 dateString = os.getenv('DATE_PARTITION')
 # The root of the EFS attached to the container
 sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
+# Alignment cache entries not used for this many days are removed
+alignmentCacheMaxAgeDays = float(os.getenv('ALIGNMENT_CACHE_MAX_AGE_DAYS', '30'))
 
 # Remove all files under this path for each run of the state machine
 efsFolder = f"{sampleDataRoot}/{dateString}"
@@ -44,4 +47,8 @@ try:
 except:
   pass
 
-
+##############################################
+# Prune the alignment cache, it lives outside the date folders
+##############################################
+removed = alignmentCache.prune(sampleDataRoot, alignmentCacheMaxAgeDays * 24 * 3600)
+print(f"Removed {removed} alignment cache entries unused for {alignmentCacheMaxAgeDays} days")
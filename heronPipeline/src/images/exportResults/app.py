@@ -5,6 +5,7 @@ import numpy as np
 import pandas as pd
 import math
 import os
+import tempfile
 import uuid
 import boto3
 from botocore.config import Config
@@ -12,6 +13,7 @@ from boto3.dynamodb.conditions import Key, Attr
 from decimal import Decimal
 import json
 import platform
+import parquetOutput
 
 config = Config(
    retries = {
@@ -20,6 +22,8 @@ config = Config(
    }
 )
 
+RESULTS_DATASET_PREFIX = "results/parquet"
+
 def get_mutation(row):
   if row["proteinMutationRef"] != row["proteinMutationAlt"]:
     return f"{row['proteinMutationGene']}:{row['proteinMutationRef']}{int(row['proteinMutationPos'])}{row['proteinMutationAlt']}"
@@ -36,6 +40,7 @@ def main():
   heronBucketName = os.getenv("HERON_SAMPLES_BUCKET")
   dateString = os.getenv("DATE_PARTITION")
   executionId = os.getenv("EXECUTION_ID")
+  tmpDir = tempfile.gettempdir()
   
   print(f"Branch Zero: {branchZero}")
   print(f"Branch One: {branchOne}")
@@ -50,9 +55,9 @@ def main():
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
   # Download the results files
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
-  mutationsFilename = "/tmp/mutationsExported.csv"
-  samplesFilename = "/tmp/samplesExported.csv"
-  sequencesFilesname = "/tmp/sequencesExported.csv"
+  mutationsFilename = f"{tmpDir}/mutationsExported.csv"
+  samplesFilename = f"{tmpDir}/samplesExported.csv"
+  sequencesFilesname = f"{tmpDir}/sequencesExported.csv"
   
   bucket.download_file(branchZero, mutationsFilename)
   bucket.download_file(branchOne, sequencesFilesname)
@@ -97,8 +102,23 @@ def main():
   #+++++++++++++++++++++++++++++++++++++++++++++++++++++
   fileName = f"{executionId}.csv"
   
-  joinedDf.to_csv(f"/tmp/{fileName}", index=False)
-  bucket.upload_file(f"/tmp/{fileName}", f"results/{dateString}/{fileName}")
+  joinedDf.to_csv(f"{tmpDir}/{fileName}", index=False)
+  bucket.upload_file(f"{tmpDir}/{fileName}", f"results/{dateString}/{fileName}")
+
+  # The same results as a Parquet dataset shared by every run, partitioned by
+  # run date and lineage so a read of one day or lineage only touches its files.
+  # Like the CSV, each run's date partition is a complete snapshot of the
+  # results rather than the day's new calls, so read one date, usually the
+  # latest, not the whole dataset. A second run on the same date replaces
+  # that date's snapshot
+  if parquetOutput.enabled():
+    parquetDir = tempfile.mkdtemp(prefix="results_", dir=tmpDir)
+    table = parquetOutput.fromPandas(joinedDf)
+    table = parquetOutput.withLineage(parquetOutput.withConstant(table, parquetOutput.DATE_COLUMN, dateString), "pangoLineage")
+    parquetOutput.write(table, parquetDir, "results")
+    bucket.objects.filter(Prefix=f"{RESULTS_DATASET_PREFIX}/{parquetOutput.DATE_COLUMN}={dateString}/").delete()
+    parquetFiles = parquetOutput.upload(bucket, parquetDir, RESULTS_DATASET_PREFIX)
+    print(f"Uploaded {parquetFiles} Parquet files to {RESULTS_DATASET_PREFIX}")
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,98 @@
+"""
+Aligned sequences stored as their own compact S3 objects.
+
+The padded alignment of a sample is written to alignedSequences/<seqHash>.fa.pack
+and the sample JSON only carries a pointer to it (alignedKey), so the
+consensus JSON is no longer rewritten with the aligned text and stages that
+only need the alignment don't download the consensus.
+
+An object is a small header followed by the sequence:
+
+  magic "HAS" | encoding (uint8) | sequence length (uint32) | name length (uint16) | name
+
+With ENCODING_PACKED the sequence is packed two IUPAC symbols (including '-')
+per byte, anything outside that alphabet or not a single record fasta falls
+back to ENCODING_ZLIB of the whole fasta text, so decoding always returns the
+original text byte for byte.
+"""
+
+import zlib
+import struct
+import numpy as np
+
+ALIGNED_FOLDER = "alignedSequences"
+MAGIC = b"HAS"
+HEADER = struct.Struct(">3sBIH")
+ENCODING_PACKED = 1
+ENCODING_ZLIB = 2
+
+ALPHABET = b"-ACGTRYSWKMBDHVN"
+SYMBOLS = np.frombuffer(ALPHABET, dtype=np.uint8)
+INVALID = 255
+CODES = np.full(256, INVALID, dtype=np.uint8)
+CODES[SYMBOLS] = np.arange(len(ALPHABET), dtype=np.uint8)
+
+
+def alignedKey(seqHash):
+  return f"{ALIGNED_FOLDER}/{seqHash}.fa.pack"
+
+
+def splitRecord(alignedFasta):
+  """(name, sequence) when alignedFasta is a single ">name\\nsequence\\n" record, otherwise None"""
+  lines = alignedFasta.split("\n")
+  if len(lines) != 3 or lines[2] != "" or not lines[0].startswith(">"):
+    return None
+  return lines[0][1:], lines[1]
+
+
+def encode(alignedFasta):
+  record = splitRecord(alignedFasta)
+  if record is not None:
+    name, sequence = record
+    codes = CODES[np.frombuffer(sequence.encode(), dtype=np.uint8)]
+    if len(codes) == len(sequence) and not (codes == INVALID).any():
+      if len(codes) % 2 == 1:
+        codes = np.concatenate([codes, np.zeros(1, dtype=np.uint8)])
+      packed = (codes[0::2] << 4) | codes[1::2]
+      nameBytes = name.encode()
+      return HEADER.pack(MAGIC, ENCODING_PACKED, len(sequence), len(nameBytes)) + nameBytes + packed.tobytes()
+
+  data = alignedFasta.encode()
+  return HEADER.pack(MAGIC, ENCODING_ZLIB, len(data), 0) + zlib.compress(data)
+
+
+def decode(data):
+  magic, encoding, length, nameLength = HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise ValueError("Not an aligned sequence object")
+  offset = HEADER.size
+  name = data[offset:offset + nameLength].decode()
+  offset += nameLength
+
+  if encoding == ENCODING_ZLIB:
+    return zlib.decompress(data[offset:]).decode()
+
+  packed = np.frombuffer(data, dtype=np.uint8, offset=offset)
+  codes = np.empty(2 * len(packed), dtype=np.uint8)
+  codes[0::2] = packed >> 4
+  codes[1::2] = packed & 0x0f
+  sequence = SYMBOLS[codes[:length]].tobytes().decode()
+  return f">{name}\n{sequence}\n"
+
+
+def writeAligned(s3, bucketName, seqHash, alignedFasta):
+  """Upload the aligned sequence and return the key for the sample JSON's alignedKey"""
+  key = alignedKey(seqHash)
+  s3.Object(bucketName, key).put(Body=encode(alignedFasta))
+  return key
+
+
+def readAligned(s3, bucketName, sample):
+  """Aligned fasta text of a sample JSON, following its alignedKey
+
+  Samples aligned before the compact objects existed still carry the text
+  in their aligned field, None is returned if the sample has no alignment.
+  """
+  if 'alignedKey' in sample:
+    return decode(s3.Object(bucketName, sample['alignedKey']).get()['Body'].read())
+  return sample.get('aligned')
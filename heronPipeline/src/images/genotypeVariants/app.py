@@ -1,5 +1,6 @@
 from csv import reader
 import os
+import tempfile
 from argparse import ArgumentParser
 from yaml import full_load as load_yaml
 from datetime import datetime, time
@@ -13,6 +14,11 @@ import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import alignedSequence
+import sequencePack
+import sequenceDedup
+import tracing
+import resultWriter
 
 
 config = Config(
@@ -33,6 +39,7 @@ iterationUUID = os.getenv('ITERATION_UUID')
 bucketName = os.getenv('HERON_SAMPLES_BUCKET')
 heronSequencesTableName = os.getenv("HERON_SEQUENCES_TABLE")
 genotypeRecipeS3Key = os.getenv('RECIPE_FILE_PATH')
+tmpDir = tempfile.gettempdir()
 
 
 
@@ -43,6 +50,7 @@ s3 = boto3.resource('s3', region_name='eu-west-1')
 bucket = s3.Bucket(bucketName)
 dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
 sequencesTable = dynamodb.Table(heronSequencesTableName)
+writer = resultWriter.ResultWriter(boto3.client('dynamodb', region_name="eu-west-1", config=resultWriter.CONFIG))
 
 ##############################################
 ###### Create the input file paths ###########
@@ -52,9 +60,9 @@ seqFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.fasta"
 seqConsensusFile = f"{sampleDataRootSeqBatchesDir}/sequences_consensus{iterationUUID}.fasta"
 keyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
 messageListS3Key = f"messageLists/{dateString}/messageList{iterationUUID}.json"
-messageListLocalFilename = "/tmp/messageList.json"
+messageListLocalFilename = f"{tmpDir}/messageList.json"
 # localRecipeFilename = f"/tmp/{str(uuid.uuid4())}.recipe"
-localRecipeFilename = f"/tmp/phe-recipes.yml"
+localRecipeFilename = f"{tmpDir}/phe-recipes.yml"
 
 WUHAN_REFERENCE_LENGTH = 29903
 
@@ -326,16 +334,18 @@ def find_all_matching_recipes(recipes: dict, sequence: str) -> Tuple[str, str, s
 
 
 callDate = int(datetime.now().timestamp())
+span = tracing.Span("genotypeVariants", iterationUUID)
 
 # Download the message file that contains the references to all the sequences that we need to process
 bucket.download_file(messageListS3Key, messageListLocalFilename)
+span.read(messageListLocalFilename)
 # Download the recipe file that we need to assign variants from
 # bucket.download_file(genotypeRecipeS3Key, localRecipeFilename)
 
 with open(messageListLocalFilename) as messageListFile:
    messageList = json.load(messageListFile)
 
-files = os.listdir("/tmp")
+files = os.listdir(tmpDir)
 print(f"Files: {files}")
 
 with open(localRecipeFilename) as genotype_recipe_file:
@@ -343,28 +353,41 @@ with open(localRecipeFilename) as genotype_recipe_file:
 
 # assert(False)
 
+# The aligned sequences come from the iteration's sequence pack, samples
+# missing from it fall back to their own JSON
+packed, packedBytes = sequencePack.readBatch(s3, bucketName, dateString, iterationUUID, messageList)
+span.bytesIn += packedBytes
+
+# Sequences identical to another in the batch are genotyped through it
+duplicates = sequenceDedup.loadDuplicates(sequenceDedup.duplicatesFile(sampleDataRootSeqBatchesDir, iterationUUID))
+duplicateHashes = sequenceDedup.duplicateHashes(duplicates)
+
 for message in messageList:
   # Download the fasta file for this message
   print(f'Message: {message["consensusFastaPath"]}')
   # Download the consensus fasta
   consensusFastaKey = message["consensusFastaPath"]
   consensusFastaHash = message['seqHash']
-
-  sequenceLocalFilename = f"/tmp/seq_{consensusFastaHash}_.json"
-
-  try:
-    bucket.download_file(consensusFastaKey, sequenceLocalFilename)
-  except:
-    print(f"File not found: {consensusFastaKey}")
-    sampleLocalFilename = None
-
-  alignedFasta = None
-  with open(sequenceLocalFilename, "r") as fasta:
-    seqData = json.load(fasta)
-    alignedFasta = seqData['aligned']
+  if consensusFastaHash in duplicateHashes:
+    continue
+
+  sequenceLocalFilename = f"{tmpDir}/seq_{consensusFastaHash}_.json"
+
+  alignedFasta = packed[consensusFastaHash][1] if consensusFastaHash in packed else None
+  if alignedFasta is None:
+    try:
+      bucket.download_file(consensusFastaKey, sequenceLocalFilename)
+    except:
+      print(f"File not found: {consensusFastaKey}")
+      sampleLocalFilename = None
+
+    span.read(sequenceLocalFilename)
+    with open(sequenceLocalFilename, "r") as fasta:
+      seqData = json.load(fasta)
+      alignedFasta = alignedSequence.readAligned(s3, bucketName, seqData)
   
   # Download the files as unique local filenames to avoid any clashes with /tmp directory
-  localFastaFilename = f"/tmp/{str(uuid.uuid4())}.fasta"
+  localFastaFilename = f"{tmpDir}/{str(uuid.uuid4())}.fasta"
   with open(localFastaFilename, "w") as fasta:
     fasta.write(alignedFasta)
 
@@ -392,23 +415,21 @@ for message in messageList:
 
   if str(vocProfile) == 'nan':
     vocProfile = "none"
-  # Upsert the record for the sequence
-  response = sequencesTable.query(
-        KeyConditionExpression=Key('seqHash').eq(consensusFastaHash)
+  # Update the record for the sequence, written with the rest of the batch below
+  for targetHash in sequenceDedup.targets(duplicates, consensusFastaHash):
+    writer.update(
+        heronSequencesTableName,
+        {'seqHash': targetHash},
+        {
+          'genotypeVariant': vocProfile,
+          'genotypeVariantConf': confidence,
+          'genotypeCallDate': callDate,
+          'genotypeProfile': vocVui,
+          'matchedGenotypeProfiles': matched_recipe_name_to_conf
+        },
+        mustExist=True
       )
+  span.sampleCount += 1
 
-  if 'Items' in response:
-    if len(response['Items']) == 1:
-      item = response['Items'][0]
-      item['processingState'] = 'aligned'
-      ret = sequencesTable.update_item(
-          Key={'seqHash': consensusFastaHash},
-          UpdateExpression="set genotypeVariant=:v, genotypeVariantConf=:c, genotypeCallDate=:d, genotypeProfile=:p, matchedGenotypeProfiles=:m",
-          ExpressionAttributeValues={
-            ':v': vocProfile,
-            ':c': confidence,
-            ':d': callDate,
-            ':p': vocVui,
-            ':m': matched_recipe_name_to_conf
-          }
-        )
\ No newline at end of file
+span.finish(writes=writer.flush())
+writer.raiseOnFailures()
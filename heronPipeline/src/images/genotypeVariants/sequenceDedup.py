@@ -0,0 +1,80 @@
+"""
+Analyse each distinct sequence of an iteration once and fan its results out.
+
+prepareSequences keys every consensus by a hash of its sequence, the fasta
+header left out, so samples with identical genomes collapse onto the first
+of them, the canonical sequence, whatever their names or seqHashes. Only
+canonical sequences go into the batch fastas and the key file, the rest are
+listed in a duplicates file next to the key file:
+
+  {"<canonical seqHash>": ["<duplicate seqHash>", ...]}
+
+pangolin, armadillin, genotypeVariants and mutations skip the duplicates and
+write each canonical sequence's results to its duplicates as well, so every
+sequence item still gets its own results.
+"""
+
+import os
+import json
+import hashlib
+
+
+def duplicatesFile(sampleDataRootSeqBatchesDir, iterationUUID):
+  return f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.duplicates.json"
+
+
+def sequenceKey(consensus):
+  """Hash of a fasta's sequence, ignoring its header, line breaks and case"""
+  lines = consensus.splitlines()
+  if len(lines) > 0 and lines[0].startswith(">"):
+    lines = lines[1:]
+  return hashlib.sha256("".join([f.strip() for f in lines]).upper().encode()).hexdigest()
+
+
+class Deduplicator:
+  """Track the distinct sequences of a batch"""
+
+  def __init__(self):
+    self.canonical = dict()
+    self.duplicates = dict()
+    self.seen = set()
+
+  def add(self, seqHash, consensus):
+    """True if this is the first time the sequence has been seen in the batch
+
+    A repeated message for the same seqHash is dropped without being listed
+    as a duplicate.
+    """
+    if seqHash in self.seen:
+      return False
+    self.seen.add(seqHash)
+    canonicalHash = self.canonical.setdefault(sequenceKey(consensus), seqHash)
+    if canonicalHash == seqHash:
+      return True
+    self.duplicates.setdefault(canonicalHash, list()).append(seqHash)
+    return False
+
+  def duplicateCount(self):
+    return sum([len(f) for f in self.duplicates.values()])
+
+  def write(self, filename):
+    with open(filename, "w") as duplicatesJson:
+      json.dump(self.duplicates, duplicatesJson)
+
+
+def loadDuplicates(filename):
+  """The duplicates of an iteration, empty when prepareSequences wrote none"""
+  if not os.path.isfile(filename):
+    return dict()
+  with open(filename) as duplicatesJson:
+    return json.load(duplicatesJson)
+
+
+def duplicateHashes(duplicates):
+  """Every seqHash that is analysed through its canonical sequence"""
+  return set([f for values in duplicates.values() for f in values])
+
+
+def targets(duplicates, seqHash):
+  """The seqHashes a canonical sequence's results are written to"""
+  return [seqHash] + duplicates.get(seqHash, list())
@@ -0,0 +1,92 @@
+"""
+Cache of alignment results on the shared EFS mount.
+
+An entry holds the consensus with its padded alignment and SAM text and is
+keyed by the consensus seqHash, the reference hash, the trim parameters and
+the aligner version, so any change to the inputs of the alignment misses the
+cache rather than returning a stale result. A hit carries everything the
+iteration needs, so the sample is looked up before anything is downloaded.
+
+Reading an entry touches it, and prune() removes the entries that haven't
+been used for a given age. Entries of a replaced reference, trim or aligner
+are never read again, so they age out along with the rest.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+
+CACHE_FOLDER = "alignmentCache"
+
+
+class AlignmentCache:
+  """Alignment results keyed by seqHash for one reference/trim/aligner combination"""
+
+  def __init__(self, sharedRoot, referenceHash, trimStart, trimEnd, alignerVersion):
+    configKey = f"{referenceHash}:{trimStart}:{trimEnd}:{alignerVersion}"
+    configHash = hashlib.sha256(configKey.encode()).hexdigest()[:16]
+    self.directory = f"{sharedRoot}/{CACHE_FOLDER}/{configHash}"
+    self.hits = 0
+    self.misses = 0
+
+  def path(self, seqHash):
+    return f"{self.directory}/{seqHash[:2]}/{seqHash}.json"
+
+  def get(self, seqHash):
+    """Return (alignedFasta, samText, consensus) for the seqHash, or None on a miss"""
+    path = self.path(seqHash)
+    try:
+      with open(path) as file:
+        entry = json.load(file)
+      result = entry['aligned'], entry['sam'], entry['consensus']
+    except (OSError, ValueError, KeyError):
+      self.misses += 1
+      return None
+    self.hits += 1
+    try:
+      os.utime(path)
+    except OSError:
+      pass
+    return result
+
+  def put(self, seqHash, alignedFasta, samText, consensus):
+    """Store a result, written to a temporary file and renamed so readers never see a partial entry"""
+    path = self.path(seqHash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = f"{path}.{uuid.uuid4()}.tmp"
+    with open(tmpPath, 'w') as file:
+      json.dump({'aligned': alignedFasta, 'sam': samText, 'consensus': consensus}, file)
+    os.rename(tmpPath, path)
+
+  def stats(self):
+    lookups = self.hits + self.misses
+    hitRate = self.hits / lookups if lookups > 0 else 0.0
+    return {'hits': self.hits, 'misses': self.misses, 'hitRate': hitRate}
+
+
+def prune(sharedRoot, maxAgeSeconds):
+  """Remove the cache entries not used for maxAgeSeconds, and any directories left empty
+
+  Returns the number of entries removed.
+  """
+  root = f"{sharedRoot}/{CACHE_FOLDER}"
+  cutoff = time.time() - maxAgeSeconds
+  removed = 0
+  for directory, directories, filenames in os.walk(root, topdown=False):
+    for filename in filenames:
+      path = os.path.join(directory, filename)
+      try:
+        if os.path.getmtime(path) < cutoff:
+          os.remove(path)
+          removed += 1
+      except OSError:
+        pass
+    if directory != root:
+      try:
+        # Only succeeds once the directory is empty
+        os.rmdir(directory)
+      except OSError:
+        pass
+  return removed
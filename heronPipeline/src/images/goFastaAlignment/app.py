@@ -1,4 +1,5 @@
 import os
+import tempfile
 import subprocess
 import sys
 import shutil
@@ -16,6 +17,13 @@ import difflib
 # from datafunk.sam_2_fasta import *
 from Bio import SeqIO
 import pysam
+import referenceIndex
+from alignmentCache import AlignmentCache
+import samArchive
+import alignedSequence
+import sequencePack
+import tracing
+import resultWriter
 
 config = Config(
    retries = {
@@ -23,7 +31,131 @@ config = Config(
       'mode': 'standard'
    }
 )
-    
+
+def availableCores():
+   """Number of cores this container may actually use, honouring the cgroup CPU quota"""
+   try:
+      cores = len(os.sched_getaffinity(0))
+   except AttributeError:
+      cores = os.cpu_count() or 1
+
+   quota = None
+   try:
+      # cgroup v2
+      with open("/sys/fs/cgroup/cpu.max") as file:
+         limit, period = file.read().split()
+         if limit != "max":
+            quota = int(limit) / int(period)
+   except (OSError, ValueError):
+      try:
+         # cgroup v1
+         with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+            limit = int(file.read())
+         with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+            period = int(file.read())
+         if limit > 0:
+            quota = limit / period
+      except (OSError, ValueError):
+         pass
+
+   if quota is not None:
+      cores = min(cores, max(1, int(quota)))
+   return max(1, cores)
+
+def splitFasta(fastaText):
+   """Split a single record fasta string into its header name and sequence"""
+   lines = fastaText.splitlines()
+   name = lines[0][1:].split()[0] if len(lines[0]) > 1 else ""
+   sequence = "".join([f.strip() for f in lines[1:]])
+   return name, sequence
+
+def readMultiFasta(fastaFilename):
+   """Read a multi fasta file into a dict of name -> sequence"""
+   records = dict()
+   name = None
+   with open(fastaFilename) as file:
+      for line in file:
+         line = line.rstrip()
+         if line.startswith(">"):
+            name = line[1:].split()[0]
+            records[name] = []
+         elif name is not None:
+            records[name].append(line)
+   return {k: "".join(v) for k, v in records.items()}
+
+def readSamByQuery(samFilename):
+   """Read a SAM file and return its header lines and the records grouped by query name"""
+   headerLines = []
+   records = dict()
+   with open(samFilename) as file:
+      for line in file:
+         if line.startswith("@"):
+            headerLines.append(line)
+         else:
+            queryName = line.split("\t", 1)[0]
+            records.setdefault(queryName, []).append(line)
+   return headerLines, records
+
+def alignBatch(batch, threads):
+   """Align every sample of the batch with a single minimap2 and gofasta call
+
+   Reads are named by seqHash in the batch fasta so that duplicate sample names
+   can't collide, the original names are restored when the results are split
+   back out per sample.
+
+   Returns a dict of seqHash -> (alignedFasta, samText)
+   """
+   with open(consensusLocalFilename, 'w') as file:
+      for seqHash, entry in batch.items():
+         file.write(f">{seqHash}\n{entry['sequence']}\n")
+
+   ##############################################
+   # Step 1.
+   ##############################################
+    # Run minimap
+      # -a:  output in sam
+      # -x asm5:  asm-to-ref mapping, for ~0.1% sequence divergence
+   subprocess.run(
+      "./minimap2 -t {} -a -x asm5 {} {} > {}".format(
+         threads, referenceIndexLocalFilename, consensusLocalFilename, mappedSamFastaLocalFilename
+      ),
+      check=True,
+      shell=True
+   )
+
+   ##############################################
+   # Step 2.
+   ##############################################
+   # Run gofasta
+   # gofasta sam toMultiAlign -t ${task.cpus} \
+   #    --samfile ${sam} \
+   #    --reference ${reference_fasta} \
+   #    --pad \
+   #    -o alignment.fasta
+   goFastaCommand = f"/root/go/bin/gofasta sam toMultiAlign -t {threads} --samfile {mappedSamFastaLocalFilename} --trim --pad --trimstart {trimStart} --trimend {trimEnd} -o {alignedLocalFilename}"
+   subprocess.run(
+      goFastaCommand,
+      check=True,
+      shell=True
+   )
+
+   ##############################################
+   # Step 3. Split the results back out per sample
+   ##############################################
+   alignedSequences = readMultiFasta(alignedLocalFilename)
+   samHeaderLines, samRecords = readSamByQuery(mappedSamFastaLocalFilename)
+   samHeader = "".join(samHeaderLines)
+
+   results = dict()
+   for seqHash, entry in batch.items():
+      if seqHash not in alignedSequences:
+         continue
+      name = entry['name']
+      alignedFasta = f">{name}\n{alignedSequences[seqHash]}\n"
+      samText = samHeader + "".join([name + f[len(seqHash):] for f in samRecords.get(seqHash, [])])
+      results[seqHash] = (alignedFasta, samText)
+   return results
+
 ##############################################
 # Step 1. Create resources
 ##############################################
@@ -40,155 +172,228 @@ trimStart = int(os.getenv('TRIM_START'))
 trimEnd = int(os.getenv('TRIM_END'))
 iterationUUID = os.getenv('ITERATION_UUID')
 sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
+tmpDir = tempfile.gettempdir()
+# Number of samples aligned per minimap2 call, 0 aligns the whole message list at once
+alignmentBatchSize = int(os.getenv('ALIGNMENT_BATCH_SIZE', '0'))
+# minimap2 runs the minimap2 and gofasta binaries once per batch, mappy aligns in-process
+alignerName = os.getenv('ALIGNER', 'minimap2')
 
 # batchUUID = os.path.splitext(os.path.basename(seqConsensusFile))[0].replace("sequences_", "")
 
 sampleDataRootSeqBatchesDir = f"{sampleDataRoot}/{dateString}/seqBatchFiles"
 
-seqConsensusFile = f"/tmp/sequences_consensus_{iterationUUID}.fasta"
+seqConsensusFile = f"{tmpDir}/sequences_consensus_{iterationUUID}.fasta"
 efsOutputConsensusFastaFile = f"{sampleDataRootSeqBatchesDir}/sequences_consensus{iterationUUID}.fasta"
 outputPlacementKeyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
 
 
 print(f"Processing seqBatchFile: {seqConsensusFile}")
+span = tracing.Span("goFastaAlignment", iterationUUID)
 # Create the AWS resources: S3Bucket, dynamoDB Table, etc...
 s3 = boto3.resource('s3', region_name='eu-west-1')
 bucket = s3.Bucket(bucketName)
 dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
 sequencesTable = dynamodb.Table(heronSequencesTableName)
+writer = resultWriter.ResultWriter(boto3.client('dynamodb', region_name="eu-west-1", config=resultWriter.CONFIG))
 
-sampleLocalFilename = "/tmp/sample.fasta"
-consensusLocalFilename = "/tmp/consensus.fa"
-referenceFastaLocalFilename = "/tmp/ref.fa"
-mappedSamFastaLocalFilename = "/tmp/sample.mapped.sam"
-alignedLocalFilename = "/tmp/aligned.fa"
+sampleLocalFilename = f"{tmpDir}/sample.fasta"
+consensusLocalFilename = f"{tmpDir}/consensus.fa"
+referenceFastaLocalFilename = f"{tmpDir}/ref.fa"
+mappedSamFastaLocalFilename = f"{tmpDir}/sample.mapped.sam"
+alignedLocalFilename = f"{tmpDir}/aligned.fa"
 
-messageListLocalFilename = "/tmp/messageList.json"
+messageListLocalFilename = f"{tmpDir}/messageList.json"
 
+threads = availableCores()
+print(f"Aligning with {threads} threads")
 
 bucket.download_file(referenceFastaPrefix, referenceFastaLocalFilename)
 bucket.download_file(messageListS3Key, messageListLocalFilename)
+span.read(messageListLocalFilename)
+
+# Load the prebuilt reference index from EFS, building it if this is the first task to need it
+if alignerName == "mappy":
+   from mappyAligner import MappyAligner
+   referenceIndexLocalFilename = referenceIndex.getSharedIndex(referenceFastaLocalFilename, sampleDataRoot, "mappy", "asm5", threads)
+   inProcessAligner = MappyAligner(referenceIndexLocalFilename, threads)
+else:
+   referenceIndexLocalFilename = referenceIndex.getSharedIndex(referenceFastaLocalFilename, sampleDataRoot, "./minimap2", "asm5", threads)
+print(f"Using {alignerName} with reference index: {referenceIndexLocalFilename}")
+
+# Results are reused while the consensus, reference, trim and aligner are unchanged
+alignerVersion = referenceIndex.minimapVersion("mappy" if alignerName == "mappy" else "./minimap2")
+if alignerName != "mappy":
+   alignerVersion = f"{alignerVersion}+gofasta"
+cache = AlignmentCache(sampleDataRoot, referenceIndex.referenceHash(referenceFastaLocalFilename), trimStart, trimEnd, alignerVersion)
 
 with open(messageListLocalFilename) as messageListFile:
    messageList = json.load(messageListFile)
 
-# Iterate over each item in the message list and align the sample
+def setAlignedPointer(consensusFastaKey, seqHash, sample):
+   """Point the sample JSON at its aligned object, it is only rewritten when the pointer is missing
+
+   Samples read from a pack have no JSON here, theirs was already pointed at
+   the aligned object when they were packed.
+   """
+   key = alignedSequence.alignedKey(seqHash)
+   if sample is None or (sample.get('alignedKey') == key and 'aligned' not in sample):
+      return
+   sample['alignedKey'] = key
+   sample.pop('aligned', None)
+   s3.Object(bucketName, consensusFastaKey).put(Body=json.dumps(sample))
+
+def setAligned(seqHash, packPointer):
+   """Update the record in dynamoDB, pointing it at its record in the iteration's pack
+
+   The updates are written together when the writer is flushed.
+   """
+   writer.update(
+      heronSequencesTableName,
+      {'seqHash': seqHash},
+      {'processingState': 'aligned', 'sequencePack': packPointer},
+      mustExist=True
+   )
+
+##############################################
+# Step 2. Look every sample up in the alignment cache, a hit carries its
+#         consensus so nothing is downloaded for it
+##############################################
+cachedResults = dict()
+looked = set()
 for message in messageList:
+   consensusFastaHash = message['seqHash']
+   if consensusFastaHash in looked:
+      continue
+   looked.add(consensusFastaHash)
+
+   cached = cache.get(consensusFastaHash)
+   if cached is not None:
+      cachedResults[consensusFastaHash] = {
+         'consensus': cached[2],
+         'aligned': cached[0],
+         'sam': cached[1]
+      }
+uncachedMessages = [f for f in messageList if f['seqHash'] not in cachedResults]
+
+##############################################
+# Step 3. Read the consensus of every other message, from the sequence packs
+#         where the sequence has been packed, otherwise its sample JSON
+##############################################
+if len(uncachedMessages) > 0:
+   packed, packedBytes = sequencePack.readBatch(s3, bucketName, dateString, iterationUUID, uncachedMessages)
+else:
+   packed, packedBytes = dict(), 0
+span.bytesIn += packedBytes
+print(f"Read {len(packed)} sequences from sequence packs")
+
+samples = dict()
+for message in uncachedMessages:
    print(f'Message: {message["consensusFastaPath"]}')
    # Download the consensus fasta
    consensusFastaKey = message["consensusFastaPath"]
    consensusFastaHash = message['seqHash']
 
-   try:
-      bucket.download_file(consensusFastaKey, sampleLocalFilename)
-   except:
-      print(f"File not found: {consensusFastaKey}")
-      sampleLocalFilename = None
+   if consensusFastaHash in samples:
+      continue
 
-   with open(sampleLocalFilename, 'r') as file:
-      data = file.read()
+   if consensusFastaHash in packed:
+      sample = None
+      consensus = packed[consensusFastaHash][0]
+   else:
+      try:
+         bucket.download_file(consensusFastaKey, sampleLocalFilename)
+      except:
+         print(f"File not found: {consensusFastaKey}")
+         continue
 
-   sample = json.loads(data)
+      span.read(sampleLocalFilename)
+      with open(sampleLocalFilename, 'r') as file:
+         data = file.read()
 
-   consensusFasta = sample['consensus']
-   # pAlignedFasta = sample['aligned']
+      sample = json.loads(data)
+      consensus = sample['consensus']
 
-   with open(consensusLocalFilename, 'w') as file:
-      file.write(consensusFasta)
-   
-   ##############################################
-   # Step 1. 
-   ##############################################
-    # Run minimap 
-      # -a:  output in sam
-      # -x asm5:  asm-to-ref mapping, for ~0.1% sequence divergence
-   subprocess.run(
-      "./minimap2 -t minimap2_threads -a -x asm5 {} {} > {}".format(
-         referenceFastaLocalFilename, consensusLocalFilename, mappedSamFastaLocalFilename
-      ),
-      check=True,
-      shell=True
-   )
+   name, sequence = splitFasta(consensus)
+   samples[consensusFastaHash] = {
+      'key': consensusFastaKey,
+      'sample': sample,
+      'consensus': consensus,
+      'name': name,
+      'sequence': sequence
+   }
 
-   try:
-      bucket.upload_file(mappedSamFastaLocalFilename, f"samFiles/{os.path.basename(consensusFastaKey)}.sam")
-   except:
-      print("Can't upload SAM file")
-   ##############################################
-   # Step 2. 
-   ##############################################
-   samfile = pysam.AlignmentFile(mappedSamFastaLocalFilename, 'r')
-   reference = SeqIO.read(referenceFastaLocalFilename, 'fasta')
-   
-   # Run gofasta
-   # gofasta sam toMultiAlign -t ${task.cpus} \
-   #    --samfile ${sam} \
-   #    --reference ${reference_fasta} \
-   #    --pad \
-   #    -o alignment.fasta
-   goFastaCommand = f"/root/go/bin/gofasta sam toMultiAlign --samfile {mappedSamFastaLocalFilename} --trim --pad --trimstart {trimStart} --trimend {trimEnd} -o {alignedLocalFilename}"
-   subprocess.run(
-      goFastaCommand,
-      check=True,
-      shell=True
-   )
+print(f"Aligning {len(samples)} samples, {len(cachedResults)} found in the alignment cache")
+span.sampleCount = len(samples) + len(cachedResults)
+
+##############################################
+# Step 4. Align the samples in batches
+##############################################
+samWriter = samArchive.SamArchiveWriter()
+packWriter = sequencePack.PackWriter()
+seqHashes = list(samples.keys())
+batchSize = alignmentBatchSize if alignmentBatchSize > 0 else max(1, len(seqHashes))
+for batchStart in range(0, len(seqHashes), batchSize):
+   batch = {f: samples[f] for f in seqHashes[batchStart:batchStart + batchSize]}
+   if alignerName == "mappy":
+      results = inProcessAligner.alignAll({f: (batch[f]['name'], batch[f]['sequence']) for f in batch}, trimStart, trimEnd)
+   else:
+      results = alignBatch(batch, threads)
 
-   # Run sam_2_fasta from datafunk
-  #  sam_2_fasta(samfile = samfile,
-  #               reference = reference,
-  #               output = alignedLocalFilename,
-  #               prefix_ref = False,
-  #               log_inserts = False,
-  #               log_all_inserts = False,
-  #               log_dels = False,
-  #               log_all_dels = False,
-  #               trim = True,
-  #               pad = True,
-  #               trimstart = int(trimStart),
-  #               trimend = int(trimEnd))
-    
-  #  ##############################################
-  #  # Step 1. Write updated result into S3
-  #  ##############################################
-   with open(alignedLocalFilename) as file:
-      alignedFasta = file.read()
-   
-
-   # print(f"Previous Aligned Fasta: {pAlignedFasta[0:50]}")
-   # print(f"Current Aligned Fasta: {alignedFasta[0:50]}")
-   # if pAlignedFasta == alignedFasta:
-   #    print("Both aligned fasta files are the same")
-   # else:
-   #    print("The aligned fasta files are different")
-
-   # output_list = [li for li in difflib.ndiff(pAlignedFasta, alignedFasta) if li[0] != ' ']
-   # print(f"Differences: {output_list}")
-
-   sample['aligned'] = alignedFasta
+   # Either aligner leaves out the samples that didn't align
+   for consensusFastaHash in batch:
+      if consensusFastaHash not in results:
+         print(f"No alignment produced for: {consensusFastaHash}")
 
-   s3.Object(bucketName, consensusFastaKey).put(Body=json.dumps(sample))
+   for consensusFastaHash, (alignedFasta, samText) in results.items():
+      consensusFastaKey = batch[consensusFastaHash]['key']
+      sample = batch[consensusFastaHash]['sample']
+
+      samWriter.add(consensusFastaHash, samText)
+
+     #  ##############################################
+     #  # Step 1. Write updated result into S3
+     #  ##############################################
+      alignedSequence.writeAligned(s3, bucketName, consensusFastaHash, alignedFasta)
+      span.bytesOut += len(alignedFasta)
+      setAlignedPointer(consensusFastaKey, consensusFastaHash, sample)
+      cache.put(consensusFastaHash, alignedFasta, samText, batch[consensusFastaHash]['consensus'])
+      packWriter.add(consensusFastaHash, batch[consensusFastaHash]['consensus'], alignedFasta)
+
+##############################################
+# Step 5. Reuse cached alignments, their aligned objects were written and
+#         their sample JSON pointed at them when they were cached
+##############################################
+for consensusFastaHash, result in cachedResults.items():
+   samWriter.add(consensusFastaHash, result['sam'])
+   packWriter.add(consensusFastaHash, result['consensus'], result['aligned'])
 
-  #  ##############################################
-  #  # Step 1. Update the record in dynamoDB
-  #  ##############################################
-   dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
-   heronSequencesTableName = os.getenv("HERON_SEQUENCES_TABLE")
-   sequencesTable = dynamodb.Table(heronSequencesTableName)
-   response = sequencesTable.query(
-         KeyConditionExpression=Key('seqHash').eq(consensusFastaHash)
-      )
-
-   if 'Items' in response:
-      if len(response['Items']) == 1:
-         item = response['Items'][0]
-         item['processingState'] = 'aligned'
-         ret = sequencesTable.update_item(
-            Key={'seqHash': consensusFastaHash},
-            UpdateExpression="set processingState=:s",
-            ExpressionAttributeValues={
-               ':s': 'aligned'
-            }
-         )
+##############################################
+# Step 6. Upload the iteration's SAM archive and its index
+##############################################
+if len(samWriter) > 0:
+   samArchiveKey, samIndexKey = samArchive.archiveKeys(dateString, iterationUUID)
+   samWriter.upload(s3, bucketName, samArchiveKey, samIndexKey)
+   span.bytesOut += len(samWriter.data)
+   print(f"Uploaded {len(samWriter)} SAM records to {samArchiveKey}")
 
+##############################################
+# Step 7. Upload the iteration's sequence pack, the later stages read the
+#         consensus and aligned sequences from it, then mark the sequences
+#         aligned with a pointer to their record
+##############################################
+if len(packWriter) > 0:
+   packKey, packIndexKey = sequencePack.packKeys(dateString, iterationUUID)
+   packWriter.upload(s3, bucketName, packKey, packIndexKey)
+   span.bytesOut += len(packWriter.data)
+   print(f"Uploaded {len(packWriter)} sequence records to {packKey}")
+   for consensusFastaHash, packPointer in packWriter.pointers(packKey).items():
+      setAligned(consensusFastaHash, packPointer)
+   writeStats = writer.flush()
+else:
+   writeStats = None
 
+stats = cache.stats()
+print(f"Alignment cache hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hitRate']:.2f}")
+span.finish(cacheHits=stats['hits'], cacheMisses=stats['misses'], writes=writeStats)
+writer.raiseOnFailures()
 
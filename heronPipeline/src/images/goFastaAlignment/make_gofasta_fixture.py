@@ -0,0 +1,55 @@
+"""
+Write the minimap2 and gofasta output for the mappy test queries, the fixture
+test_mappy_aligner.py compares mappyAligner against.
+
+Run this where both are installed, e.g. this image, and commit the fasta it
+writes:
+
+  python make_gofasta_fixture.py
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+REFERENCE_FASTA = os.path.join(CURR_DIR, "assets", "reference.fa")
+QUERIES_FASTA = os.path.join(CURR_DIR, "assets", "queries.fa")
+GOFASTA_FASTA = os.path.join(CURR_DIR, "assets", "queries.gofasta.fa")
+TRIM_START = 50
+TRIM_END = 5950
+
+
+def findBinary(name, paths):
+  for path in paths:
+    if os.path.isfile(path) and os.access(path, os.X_OK):
+      return path
+  return shutil.which(name)
+
+
+def findBinaries():
+  """minimap2 and gofasta where the image installs them, None where either is missing"""
+  minimap2 = findBinary("minimap2", [os.path.join(CURR_DIR, "minimap2"), "./minimap2"])
+  gofasta = findBinary("gofasta", [os.path.join(CURR_DIR, "gofasta"), "/root/go/bin/gofasta"])
+  if minimap2 is None or gofasta is None:
+    return None
+  return minimap2, gofasta
+
+
+def writeFixture(minimap2, gofasta, output):
+  """Align the queries as app.py does, minimap2 -a -x asm5 | gofasta sam toMultiAlign --trim --pad"""
+  with tempfile.TemporaryDirectory() as tmpDir:
+    samPath = os.path.join(tmpDir, "queries.sam")
+    with open(samPath, "w") as samFile:
+      subprocess.run([minimap2, "-a", "-x", "asm5", REFERENCE_FASTA, QUERIES_FASTA], stdout=samFile, check=True)
+    subprocess.run([gofasta, "sam", "toMultiAlign", "--samfile", samPath, "--trim", "--pad",
+                    "--trimstart", str(TRIM_START), "--trimend", str(TRIM_END), "-o", output], check=True)
+
+
+if __name__ == '__main__':
+  binaries = findBinaries()
+  if binaries is None:
+    raise SystemExit("minimap2 and gofasta must both be installed")
+  writeFixture(*binaries, GOFASTA_FASTA)
+  print(f"Wrote {GOFASTA_FASTA}")
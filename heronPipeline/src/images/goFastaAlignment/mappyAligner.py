@@ -0,0 +1,109 @@
+"""
+In-process alignment of consensus sequences with the minimap2 python binding.
+
+One index is shared by a pool of threads, mappy releases the GIL while
+mapping so the threads align in parallel. Each query produces the SAM text
+minimap2 -a would have written for it and its padded sequence, converted
+with cigarToFasta as the SAM would be, without any process spawn or
+temporary file. A query with no alignment produces nothing, as in the
+minimap2 and gofasta path.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import mappy
+import cigarToFasta
+
+COMPLEMENT = str.maketrans("ACGTURYSWKMBDHVNacgturyswkmbdhvn", "TGCAAYRSWMKVHDBNtgcaayrswmkvhdbn")
+FLAG_REVERSE = 16
+FLAG_SUPPLEMENTARY = 2048
+
+
+def reverseComplement(sequence):
+  return sequence.translate(COMPLEMENT)[::-1]
+
+
+class MappyAligner:
+  """Align many queries against one reference with a shared mappy index"""
+
+  def __init__(self, index, threads, preset="asm5"):
+    self.aligner = mappy.Aligner(fn_idx_in=index, preset=preset)
+    if not self.aligner:
+      raise Exception(f"Failed to load index: {index}")
+    self.threads = threads
+    self.version = mappy.__version__
+    self.local = threading.local()
+    self.referenceLengths = {f: len(self.aligner.seq(f)) for f in self.aligner.seq_names}
+
+  def samHeader(self):
+    header = "".join([f"@SQ\tSN:{name}\tLN:{length}\n" for name, length in self.referenceLengths.items()])
+    return header + f"@PG\tID:minimap2\tPN:mappy\tVN:{self.version}\n"
+
+  def map(self, sequence):
+    """Primary and supplementary hits for the sequence, primary first"""
+    if not hasattr(self.local, 'buffer'):
+      self.local.buffer = mappy.ThreadBuffer()
+    # Secondary alignments are dropped, as gofasta does when reading the SAM
+    return [f for f in self.aligner.map(sequence, buf=self.local.buffer) if f.is_primary]
+
+  def align(self, name, sequence, trimStart, trimEnd):
+    """Align one query
+
+    Returns (alignedFasta, samRecords) where samRecords is the query's SAM
+    lines without the header, or None when the query doesn't align
+    """
+    hits = self.map(sequence)
+    if len(hits) == 0:
+      return None
+    queryLength = len(sequence)
+    reverse = None
+
+    samLines = []
+    alignments = []
+    for i, hit in enumerate(hits):
+      primary = i == 0
+      referenceLength = self.referenceLengths[hit.ctg]
+      if hit.strand == 1:
+        query = sequence
+        leftClip, rightClip = hit.q_st, queryLength - hit.q_en
+      else:
+        if reverse is None:
+          reverse = reverseComplement(sequence)
+        query = reverse
+        leftClip, rightClip = queryLength - hit.q_en, hit.q_st
+
+      alignedQuery = query[leftClip:queryLength - rightClip]
+      # mappy's cigar is [length, op] pairs, cigarToFasta takes (op, length) as pysam does
+      alignments.append((hit.r_st, [(op, length) for length, op in hit.cigar], alignedQuery))
+
+      # minimap2 soft clips the primary record and hard clips supplementary records
+      clipOp = "S" if primary else "H"
+      cigar = (f"{leftClip}{clipOp}" if leftClip > 0 else "") + hit.cigar_str + (f"{rightClip}{clipOp}" if rightClip > 0 else "")
+      flag = (0 if primary else FLAG_SUPPLEMENTARY) | (FLAG_REVERSE if hit.strand == -1 else 0)
+      samLines.append("\t".join([
+        name, str(flag), hit.ctg, str(hit.r_st + 1), str(hit.mapq), cigar, "*", "0", "0",
+        query if primary else alignedQuery, "*",
+        f"NM:i:{hit.NM}", f"tp:A:{'P' if primary else 'S'}"
+      ]) + "\n")
+
+    padded = cigarToFasta.paddedSequence(alignments, referenceLength, trimStart, trimEnd)
+    return f">{name}\n{padded}\n", samLines
+
+  def alignAll(self, queries, trimStart, trimEnd):
+    """Align a dict of key -> (name, sequence) on the thread pool
+
+    Returns a dict of key -> (alignedFasta, samText), queries that don't
+    align are left out
+    """
+    header = self.samHeader()
+
+    def alignOne(item):
+      key, (name, sequence) = item
+      result = self.align(name, sequence, trimStart, trimEnd)
+      if result is None:
+        return key, None
+      alignedFasta, samLines = result
+      return key, (alignedFasta, header + "".join(samLines))
+
+    with ThreadPoolExecutor(max_workers=self.threads) as executor:
+      return {key: result for key, result in executor.map(alignOne, queries.items()) if result is not None}
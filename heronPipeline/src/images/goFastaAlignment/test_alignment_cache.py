@@ -0,0 +1,64 @@
+"""
+Unit test alignmentCache.py
+"""
+
+
+import unittest
+import sys
+import os
+import time
+import tempfile
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import alignmentCache
+
+
+class TestAlignmentCache(unittest.TestCase):
+
+
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.root = self.tmpDir.name
+
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+
+    def test_hit_carries_consensus(self):
+        """
+        A hit returns the alignment, SAM and consensus, a changed trim misses.
+        """
+        cache = alignmentCache.AlignmentCache(self.root, "ref", 265, 29674, "v1")
+        self.assertIsNone(cache.get("abcd"))
+        cache.put("abcd", ">s\nACGT\n", "@SQ\n", ">s\nACGT\n")
+        self.assertEqual(cache.get("abcd"), (">s\nACGT\n", "@SQ\n", ">s\nACGT\n"))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertIsNone(alignmentCache.AlignmentCache(self.root, "ref", 265, 29600, "v1").get("abcd"))
+
+
+    def test_prune_removes_unused_entries(self):
+        """
+        Entries unused for the max age are removed with their empty directories,
+        reading an entry keeps it.
+        """
+        cache = alignmentCache.AlignmentCache(self.root, "ref", 265, 29674, "v1")
+        cache.put("aaaa", "a", "s", "c")
+        cache.put("bbbb", "b", "s", "c")
+        old = time.time() - 3600
+        for seqHash in ["aaaa", "bbbb"]:
+            os.utime(cache.path(seqHash), (old, old))
+        cache.get("bbbb")
+
+        self.assertEqual(alignmentCache.prune(self.root, 600), 1)
+        self.assertFalse(os.path.exists(os.path.dirname(cache.path("aaaa"))))
+        self.assertIsNotNone(cache.get("bbbb"))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
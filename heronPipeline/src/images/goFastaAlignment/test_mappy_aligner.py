@@ -0,0 +1,117 @@
+"""
+Unit test mappyAligner.py against the minimap2 and gofasta path it stands in for
+"""
+
+
+import unittest
+import sys
+import os
+import tempfile
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import cigarToFasta
+import make_gofasta_fixture
+from make_gofasta_fixture import REFERENCE_FASTA, QUERIES_FASTA, GOFASTA_FASTA, TRIM_START, TRIM_END
+
+
+def readFasta(filename):
+    records = dict()
+    name = None
+    with open(filename) as file:
+        for line in file:
+            line = line.rstrip()
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                records[name] = []
+            elif name is not None:
+                records[name].append(line)
+    return {k: "".join(v) for k, v in records.items()}
+
+
+class TestMappyAligner(unittest.TestCase):
+
+
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            import mappyAligner
+        except ImportError:
+            raise unittest.SkipTest("mappy not installed")
+        cls.queries = readFasta(QUERIES_FASTA)
+        cls.referenceLength = len(readFasta(REFERENCE_FASTA)["reference"])
+        aligner = mappyAligner.MappyAligner(REFERENCE_FASTA, 2)
+        cls.results = aligner.alignAll({f: (f, s) for f, s in cls.queries.items()}, TRIM_START, TRIM_END)
+
+
+    def padded(self, name):
+        return self.results[name][0].splitlines()[1]
+
+
+    def test_unmapped_query_left_out(self):
+        """
+        A query that doesn't align produces no result, as in the minimap2 path.
+        """
+        self.assertNotIn("unmapped", self.results)
+        self.assertEqual(set(self.results), set(self.queries) - {"unmapped"})
+
+
+    def test_sam_converts_to_padded_sequence(self):
+        """
+        Converting each query's SAM records gives back its padded sequence.
+        """
+        for name, (alignedFasta, samText) in self.results.items():
+            fasta = cigarToFasta.samToFasta(
+                cigarToFasta.alignmentsFromSamLines(samText.splitlines(True)),
+                self.referenceLength, TRIM_START, TRIM_END)
+            self.assertEqual(fasta, alignedFasta, name)
+
+
+    def test_reverse_strand_matches_forward(self):
+        """
+        A reverse complemented query gives the same padded sequence.
+        """
+        self.assertEqual(self.padded("reverseStrand"), self.padded("substitutionsIndels"))
+
+
+    def test_chimeric_query_has_supplementary(self):
+        """
+        Both parts of a chimeric query are laid over the reference.
+        """
+        samLines = [f for f in self.results["chimeric"][1].splitlines() if not f.startswith("@")]
+        self.assertEqual(len(samLines), 2)
+        self.assertEqual(int(samLines[1].split("\t")[1]) & 2048, 2048)
+        reference = readFasta(REFERENCE_FASTA)["reference"]
+        self.assertEqual(self.padded("chimeric")[3200:3500], reference[3200:3500])
+        self.assertEqual(self.padded("chimeric")[200:500], reference[200:500])
+
+
+    def test_matches_minimap2_gofasta(self):
+        """
+        The padded sequences are identical to minimap2 -a | gofasta sam
+        toMultiAlign --trim --pad, and the same queries are left out. The
+        expected output is the fixture written by make_gofasta_fixture.py
+        once it is committed, until then both are run here where they are
+        installed, as in the image.
+        """
+        if os.path.isfile(GOFASTA_FASTA):
+            expected = readFasta(GOFASTA_FASTA)
+        else:
+            binaries = make_gofasta_fixture.findBinaries()
+            if binaries is None:
+                self.skipTest("No gofasta fixture and minimap2 and gofasta not installed, write it with make_gofasta_fixture.py in the image")
+            with tempfile.TemporaryDirectory() as tmpDir:
+                alignedPath = os.path.join(tmpDir, "aligned.fa")
+                make_gofasta_fixture.writeFixture(*binaries, alignedPath)
+                expected = readFasta(alignedPath)
+        self.assertEqual(set(self.results), set(expected))
+        for name in expected:
+            self.assertEqual(self.padded(name), expected[name], name)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Record a timing span for each stage's work on an iteration.
+
+A span holds the stage, the iterationUUID, the number of samples handled,
+the bytes read and written and the start and end times. Finished spans are
+printed, so they reach CloudWatch too, and written as JSON lines to the
+sink named by TRACE_SINK:
+
+  s3      traces/{date}/{iterationUUID}/ in HERON_SAMPLES_BUCKET, the default
+  a path  {path}/{date}/{iterationUUID}/, e.g. on the EFS mount
+  none    printed only
+
+Every span gets its own object, so the tasks of the parallel branches never
+append to one file. localRunner/traceTimeline.py collects them into
+per-iteration timelines. Tracing never fails a stage, a span that can't be
+written is only reported.
+"""
+
+import os
+import json
+import time
+import uuid
+
+TRACE_PREFIX = "traces"
+
+
+def traceKey(dateString, iterationUUID, stage):
+  return f"{TRACE_PREFIX}/{dateString}/{iterationUUID}/{stage}_{uuid.uuid4()}.jsonl"
+
+
+class Span:
+  """Time one stage's work on an iteration, started when created"""
+
+  def __init__(self, stage, iterationUUID, dateString=None, bucketName=None):
+    self.stage = stage
+    self.iterationUUID = iterationUUID
+    self.dateString = dateString if dateString is not None else os.getenv('DATE_PARTITION')
+    self.bucketName = bucketName if bucketName is not None else os.getenv('HERON_SAMPLES_BUCKET')
+    self.startTime = time.time()
+    self.sampleCount = 0
+    self.bytesIn = 0
+    self.bytesOut = 0
+
+  def read(self, path):
+    """Count a local file's size as bytes in"""
+    if os.path.isfile(path):
+      self.bytesIn += os.path.getsize(path)
+
+  def wrote(self, path):
+    """Count a local file's size as bytes out"""
+    if os.path.isfile(path):
+      self.bytesOut += os.path.getsize(path)
+
+  def finish(self, **attributes):
+    """End the span and write it to the sink, returns the record"""
+    endTime = time.time()
+    record = dict(
+      stage=self.stage,
+      iterationUUID=self.iterationUUID,
+      sampleCount=self.sampleCount,
+      bytesIn=self.bytesIn,
+      bytesOut=self.bytesOut,
+      startTime=self.startTime,
+      endTime=endTime,
+      durationSeconds=endTime - self.startTime,
+      **attributes
+    )
+    line = json.dumps(record)
+    print(f"TRACE {line}")
+    try:
+      writeSpan(line, self.dateString, self.iterationUUID, self.stage, self.bucketName)
+    except Exception as e:
+      print(f"Could not write trace span: {e}")
+    return record
+
+
+def writeSpan(line, dateString, iterationUUID, stage, bucketName):
+  sink = os.getenv('TRACE_SINK', "s3")
+  if sink == "none":
+    return
+  key = traceKey(dateString, iterationUUID, stage)
+  if sink == "s3":
+    import boto3
+    if bucketName is None:
+      return
+    boto3.client('s3', region_name='eu-west-1').put_object(Bucket=bucketName, Key=key, Body=f"{line}\n".encode())
+  else:
+    path = os.path.join(sink, os.path.relpath(key, TRACE_PREFIX))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as traceFile:
+      traceFile.write(f"{line}\n")
@@ -1,8 +1,7 @@
 import os
 import json
-import gzip
 import shutil
-import pandas as pd
+import functools
 from sys import exit, stderr
 from datetime import datetime
 import boto3
@@ -12,112 +11,122 @@ from boto3.dynamodb.conditions import Key
 import platform
 from collections import defaultdict
 import csv
+import numpy as np
+import exportReader
+import exportSchema
+import parquetOutput
+
+
+# The attributes a sequence's mutation strings are made from
+SCHEMA = exportSchema.Schema([
+  exportSchema.column('seqHash', exportSchema.STRING),
+  exportSchema.column('genomeMutationRef', exportSchema.STRING),
+  exportSchema.column('genomeMutationPos', exportSchema.INT),
+  exportSchema.column('genomeMutationAlt', exportSchema.STRING),
+  exportSchema.column('proteinMutationGene', exportSchema.STRING),
+  exportSchema.column('proteinMutationRef', exportSchema.STRING),
+  exportSchema.column('proteinMutationPos', exportSchema.INT),
+  exportSchema.column('proteinMutationAlt', exportSchema.STRING)
+])
+
+def get_mutations(df):
+    """The mutation string of every row of a decoded data file
+
+    Deletions and insertions are named by their genome change, other
+    mutations by their protein change unless they are synonymous.
+    """
+    text = lambda name: df[name].astype(object).fillna("N/A").astype(str)
+    genomeRef = text('genomeMutationRef')
+    genomeAlt = text('genomeMutationAlt')
+    proteinRef = text('proteinMutationRef')
+    proteinAlt = text('proteinMutationAlt')
+    genome = genomeRef + df['genomeMutationPos'].astype(str) + genomeAlt
+    protein = text('proteinMutationGene') + ":" + proteinRef + df['proteinMutationPos'].astype(str) + proteinAlt
+    return np.select(
+        [genomeAlt.str.contains("del", regex=False), genomeAlt.str.contains("ins", regex=False), proteinRef != proteinAlt],
+        ["del:" + genome, "insert:" + genome, protein],
+        "synSNP:" + genome
+    )
+
+# The (seqHash, mutation) pairs are split into this many buckets by seqHash,
+# so only one bucket's sequences are grouped in memory at once
+MUTATION_BUCKETS = int(os.getenv("MUTATION_BUCKETS", "16"))
+
+def writePairs(heronBucketName, partDir, dataFileKey):
+  """Decode one data file into per bucket files of seqHash, mutation pairs, runs in a worker process"""
+  decoder = SCHEMA.decoder()
+  for dynamoItem in exportReader.readItems(heronBucketName, dataFileKey):
+    decoder.append(dynamoItem)
+  df = decoder.toDataFrame()
+  seqHashes = df['seqHash'].astype(object).fillna("N/A")
+
+  pairFilenames = [exportReader.partFilename(partDir, dataFileKey, f"_{f}.tsv") for f in range(MUTATION_BUCKETS)]
+  pairFiles = [open(f, "w") for f in pairFilenames]
+  try:
+    for seqHash, mutation in zip(seqHashes, get_mutations(df)):
+      pairFiles[exportReader.bucketOf(seqHash, MUTATION_BUCKETS)].write(f"{seqHash}\t{mutation}\n")
+  finally:
+    for pairFile in pairFiles:
+      pairFile.close()
+  return pairFilenames
+
+def groupBucket(partDir, bucketPairFilenames):
+  """Join the mutations of every sequence in one bucket into a CSV part, runs in a worker process"""
+  bucketNumber, pairFilenames = bucketPairFilenames
+  allMutations = defaultdict(set)
+  for pairFilename in pairFilenames:
+    with open(pairFilename) as pairFile:
+      for line in pairFile:
+        seqHash, mutation = line.rstrip("\n").split("\t", 1)
+        allMutations[seqHash].add(mutation)
+    os.remove(pairFilename)
 
+  allMutations = {k:"|".join(list(v)) for k,v in allMutations.items()}
 
-def get_mutation(row):
-    if "del" in row["genomeMutationAlt"]:
-        return f"del:{row['genomeMutationRef']}{int(row['genomeMutationPos'])}{row['genomeMutationAlt']}"
-    elif "ins" in row["genomeMutationAlt"]:
-        return f"insert:{row['genomeMutationRef']}{int(row['genomeMutationPos'])}{row['genomeMutationAlt']}"
-    elif row["proteinMutationRef"] != row["proteinMutationAlt"]:
-        return f"{row['proteinMutationGene']}:{row['proteinMutationRef']}{int(row['proteinMutationPos'])}{row['proteinMutationAlt']}"
-    else:
-        return f"synSNP:{row['genomeMutationRef']}{int(row['genomeMutationPos'])}{row['genomeMutationAlt']}"
-
-def extractValue(dict, param, key):
-  if param in dict.keys():
-    paramDict = dict[param]
-    if key in paramDict.keys():
-      return paramDict[key]
-    else:
-      return "N/A"
-  else:
-    return "N/A"
-
-def createDict(dynamoItem):
-  try:
-    dynamoItem = json.loads(dynamoItem)
-  except:
-    print(f"Error loading: {dynamoItem}")
-    return False, 'seqHash', 'mutation'
-    
-  dynamoItem = dynamoItem['Item']
-  
-  newDict = {
-        'mutationId': extractValue(dynamoItem, 'mutationId', 'S'),
-        'proteinMutationAlt': extractValue(dynamoItem, 'proteinMutationAlt', 'S'),
-        'proteinMutationGene': extractValue(dynamoItem, 'proteinMutationGene', 'S'),
-        'genomeMutationRef': extractValue(dynamoItem, 'genomeMutationRef', 'S'),
-        'genomeMutationPos': extractValue(dynamoItem, 'genomeMutationPos', 'N'),
-        'proteinMutationRef' : extractValue(dynamoItem, 'proteinMutationRef','S'),
-        'proteinMutationPos': extractValue(dynamoItem, 'proteinMutationPos', 'N'),
-        'seqHash' : extractValue(dynamoItem, 'seqHash', 'S'),
-        'genomeMutationAlt': extractValue(dynamoItem, 'genomeMutationAlt', 'S')
-  }
-
-  mutation = get_mutation(newDict)
-  return True, newDict['seqHash'], mutation
+  partFilename = os.path.join(partDir, f"mutations_{bucketNumber}.csv")
+  with open(partFilename, 'w') as f:
+    writer = csv.writer(f)
+    writer.writerow(['seqHash', 'mutations'])
+    for seq in allMutations.keys():
+      writer.writerow([seq, allMutations[seq][:-1]])
+
+  if parquetOutput.enabled():
+    # The same rows as Parquet, the mutations have no date or lineage to partition by
+    table = parquetOutput.pa.table({
+      'seqHash': parquetOutput.pa.array(list(allMutations.keys()), type=parquetOutput.pa.string()),
+      'mutations': parquetOutput.pa.array([f[:-1] for f in allMutations.values()], type=parquetOutput.pa.string())
+    })
+    parquetOutput.writePart(table, os.path.join(partDir, "parquetParts"), f"mutations_{bucketNumber}")
+  return partFilename
 
 def main():
   exportArn = os.getenv("EXPORT_ARN")
   s3Prefix = os.getenv("S3_PREFIX")
   heronBucketName = os.getenv("HERON_BUCKET")
-  exportFolder = os.path.basename(exportArn)
 
-  exportManifestS3Key = f"{s3Prefix}/AWSDynamoDB/{exportFolder}/manifest-files.json"
-  exportManifestLocalPath = "/tmp/manifest.json"
+  exportManifestS3Key, concatenatedFileS3Key = exportReader.exportKeys(s3Prefix, exportArn)
   concatenatedLocalFilePath = "/tmp/concatenated.csv"
-  concatenatedFileS3Key = f"{s3Prefix}/AWSDynamoDB/{exportFolder}/exported.csv"
   
   print(f"exportManifestS3Key: {exportManifestS3Key}")
   print(f"concatenatedFileS3Key: {concatenatedFileS3Key}")
 
-
-  #download manifest file
-  s3 = boto3.resource('s3', region_name='eu-west-1')
-  bucket = s3.Bucket(heronBucketName)
-
-  bucket.download_file(exportManifestS3Key, exportManifestLocalPath)
-
-  with open(exportManifestLocalPath) as file:
-    manifestFiles = file.readlines()
-
-  runNumber = 0
-  allMutations = defaultdict(set)
-  for manifestLine in manifestFiles:
-    manifestItem = json.loads(manifestLine)
-    dataFileKey = manifestItem['dataFileS3Key']
-
-    # Download and unzip file
-    localDataFilePathZipped = f"/tmp/{os.path.basename(dataFileKey)}"
-    localDataFilePathUnZipped, ex = os.path.splitext(localDataFilePathZipped)
-    
-    bucket.download_file(dataFileKey, localDataFilePathZipped)
-    with gzip.open(localDataFilePathZipped, 'rb') as f_in:
-      with open(localDataFilePathUnZipped, 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-
-    print(f"Processing {localDataFilePathUnZipped}")
-    with open(localDataFilePathUnZipped) as f:
-      dynamoLines = f.readlines()
-
-    frames = [createDict(f) for f in dynamoLines if f != '\n']
-    for frame in frames:
-      if frame[0] == True:
-        allMutations[frame[1]].add(frame[2])
-    
-    runNumber += 1
-    
-  allMutations = {k:"|".join(list(v)) for k,v in allMutations.items()}
-
-  allSeq = list(allMutations.keys())
-  with open(concatenatedLocalFilePath, 'w') as f:
-    writer = csv.writer(f)
-    writer.writerow(['seqHash', 'mutations'])
-    for seq in allSeq:
-      writer.writerow([seq, allMutations[seq][:-1]])
-  
-  bucket.upload_file(concatenatedLocalFilePath, concatenatedFileS3Key)
+  # Each data file is streamed from S3 into bucketed pair files in a worker process
+  dataFileKeys = exportReader.readManifest(heronBucketName, exportManifestS3Key)
+  partDir = exportReader.makePartDir()
+  pairFilenames = exportReader.processFiles(functools.partial(writePairs, heronBucketName, partDir), dataFileKeys)
+
+  # Then each bucket's sequences are grouped on their own
+  buckets = [(f, [pairs[f] for pairs in pairFilenames]) for f in range(MUTATION_BUCKETS)]
+  partFilenames = exportReader.processFiles(functools.partial(groupBucket, partDir), buckets)
+
+  exportReader.concatenate(partFilenames, concatenatedLocalFilePath)
+  exportReader.getBucket(heronBucketName).upload_file(concatenatedLocalFilePath, concatenatedFileS3Key)
+  if parquetOutput.enabled():
+    # The workers' parts streamed into a single Parquet file
+    parquetOutput.combine(os.path.join(partDir, "parquetParts"), os.path.join(partDir, "parquet"), "exported")
+    parquetFiles = parquetOutput.upload(exportReader.getBucket(heronBucketName), os.path.join(partDir, "parquet"), parquetOutput.datasetPrefix(concatenatedFileS3Key))
+    print(f"Uploaded {parquetFiles} Parquet files to {parquetOutput.datasetPrefix(concatenatedFileS3Key)}")
+  shutil.rmtree(partDir, ignore_errors=True)
 
 
 if __name__ == '__main__':
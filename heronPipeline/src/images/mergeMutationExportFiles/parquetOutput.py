@@ -0,0 +1,178 @@
+"""
+Write exported tables as Parquet datasets next to their CSVs.
+
+Reading a whole CSV export back into pandas to look at one lineage, or one
+day's calls, parses every row. The same rows are also written as a Parquet
+dataset, hive partitioned so readers can prune whole directories:
+
+  {prefix}/date=2022-05-01/lineage=BA.2/{basename}-0.parquet
+
+Only the partition columns a table has are used. The rows are sorted by the
+partition columns before they are written, so each partition is one file.
+
+A merge's worker processes each write their rows as an unpartitioned part
+with writePart, split into PART_BUCKETS by day, and combine then writes the
+dataset once over all the parts, a bucket at a time. A day's rows are all in
+one bucket, so no partition is split across files, and only one bucket of
+rows is in memory at once. Strings are dictionary
+encoded, every column chunk carries min/max statistics and row groups are
+ROW_GROUP_SIZE rows, so a reader can skip row groups and read only the
+columns it asks for, e.g.
+
+  pyarrow.dataset.dataset(path, partitioning="hive").to_table(
+    columns=['seqHash', 'pangoLineage'], filter=pyarrow.dataset.field('lineage') == 'BA.2')
+
+PARQUET_OUTPUT=false turns the Parquet output off. It is also skipped when
+pyarrow isn't installed.
+"""
+
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+try:
+  import pyarrow as pa
+  import pyarrow.compute as pc
+  import pyarrow.dataset as ds
+  import pyarrow.parquet as pq
+except ImportError:
+  pa = None
+
+DATE_COLUMN = "date"
+LINEAGE_COLUMN = "lineage"
+ROW_GROUP_SIZE = 128 * 1024
+PART_BUCKETS = 16
+UPLOAD_THREADS = 16
+
+
+def enabled():
+  return pa is not None and os.getenv("PARQUET_OUTPUT", "true") == "true"
+
+
+def datasetPrefix(csvKey):
+  """S3 prefix of the dataset written alongside a CSV, e.g. .../exported.csv -> .../exported.parquet"""
+  return os.path.splitext(csvKey)[0] + ".parquet"
+
+
+def fromPandas(df):
+  """Arrow table of a DataFrame, string columns dictionary encoded"""
+  table = pa.Table.from_pandas(df, preserve_index=False)
+  for i, field in enumerate(table.schema):
+    if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+      table = table.set_column(i, field.name, table.column(i).dictionary_encode())
+  return table
+
+
+def plainColumn(column):
+  """Partition values are written into paths, so they are plain strings"""
+  if pa.types.is_dictionary(column.type):
+    column = column.cast(column.type.value_type)
+  return column.cast(pa.string())
+
+
+def withDay(table, timestampColumn):
+  """Add the date column, the UTC day of an epoch seconds column"""
+  timestamps = table.column(timestampColumn).cast(pa.int64()).cast(pa.timestamp('s', tz="UTC"))
+  return table.append_column(DATE_COLUMN, pc.strftime(timestamps, format="%Y-%m-%d"))
+
+
+def withConstant(table, name, value):
+  return table.append_column(name, pa.array([value] * table.num_rows, type=pa.string()))
+
+
+def withLineage(table, lineageColumn):
+  return table.append_column(LINEAGE_COLUMN, plainColumn(table.column(lineageColumn)))
+
+
+def partitionColumnsOf(schema):
+  return [f for f in [DATE_COLUMN, LINEAGE_COLUMN] if f in schema.names]
+
+
+def withPlainPartitions(table):
+  for name in partitionColumnsOf(table.schema):
+    table = table.set_column(table.column_names.index(name), name, plainColumn(table.column(name)))
+  return table
+
+
+def dayBuckets(table):
+  """PART_BUCKETS bucket of each row, by the crc32 of its day, rows without a day are in bucket 0"""
+  days = table.column(DATE_COLUMN).combine_chunks().dictionary_encode()
+  bucketOfDay = np.array([zlib.crc32(f.encode()) % PART_BUCKETS for f in days.dictionary.to_pylist()] + [0], dtype=np.int64)
+  indices = days.indices.fill_null(len(days.dictionary)).to_numpy(zero_copy_only=False)
+  return bucketOfDay[indices]
+
+
+def writePart(table, partDir, name):
+  """Write a worker's rows as unpartitioned part files for combine, returns their paths"""
+  table = withPlainPartitions(table)
+  if DATE_COLUMN not in table.column_names:
+    os.makedirs(partDir, exist_ok=True)
+    partPath = os.path.join(partDir, f"{name}.parquet")
+    pq.write_table(table, partPath, compression="zstd")
+    return [partPath]
+  buckets = dayBuckets(table)
+  partPaths = list()
+  for bucket in np.unique(buckets):
+    bucketDir = os.path.join(partDir, f"bucket{bucket}")
+    os.makedirs(bucketDir, exist_ok=True)
+    partPath = os.path.join(bucketDir, f"{name}.parquet")
+    pq.write_table(table.filter(pa.array(buckets == bucket)), partPath, compression="zstd")
+    partPaths.append(partPath)
+  return partPaths
+
+
+def combine(partDir, outputDir, basename):
+  """Write every part writePart wrote under partDir into one local dataset directory"""
+  if not os.path.isdir(partDir):
+    return
+  groups = dict()
+  for root, dirs, files in os.walk(partDir):
+    paths = sorted([os.path.join(root, f) for f in files if f.endswith(".parquet")])
+    if len(paths) > 0:
+      groups[os.path.relpath(root, partDir)] = paths
+  for group, paths in sorted(groups.items()):
+    write(ds.dataset(paths, format="parquet"), outputDir, basename if group == "." else f"{basename}-{group}")
+
+
+def write(table, outputDir, basename):
+  """Write a table or dataset into a local dataset directory, partitioned by whichever of date and lineage it has"""
+  partitionColumns = partitionColumnsOf(table.schema)
+  if len(partitionColumns) > 0:
+    # Sorted, each partition's rows arrive together and go into one file. A
+    # dataset without partition columns is streamed into a single file instead
+    if not isinstance(table, pa.Table):
+      table = table.to_table()
+    table = withPlainPartitions(table).sort_by([(f, "ascending") for f in partitionColumns])
+  rows = table.num_rows if isinstance(table, pa.Table) else table.count_rows()
+  fileOptions = ds.ParquetFileFormat().make_write_options(
+    compression="zstd",
+    use_dictionary=True,
+    write_statistics=True
+  )
+  ds.write_dataset(
+    table,
+    outputDir,
+    format="parquet",
+    partitioning=partitionColumns if len(partitionColumns) > 0 else None,
+    partitioning_flavor="hive" if len(partitionColumns) > 0 else None,
+    basename_template=f"{basename}-{{i}}.parquet",
+    existing_data_behavior="overwrite_or_ignore",
+    file_options=fileOptions,
+    max_rows_per_group=ROW_GROUP_SIZE,
+    min_rows_per_group=min(ROW_GROUP_SIZE, max(1, rows)),
+    preserve_order=True
+  )
+
+
+def upload(bucket, outputDir, prefix):
+  """Upload every file of a local dataset directory under prefix concurrently, returns the number uploaded"""
+  localPaths = [os.path.join(root, name) for root, dirs, files in os.walk(outputDir) for name in files]
+  # Through the client, which unlike the bucket resource can be shared by threads
+  client = bucket.meta.client
+  with ThreadPoolExecutor(max_workers=UPLOAD_THREADS) as executor:
+    list(executor.map(
+      lambda localPath: client.upload_file(localPath, bucket.name, f"{prefix}/{os.path.relpath(localPath, outputDir)}"),
+      localPaths
+    ))
+  return len(localPaths)
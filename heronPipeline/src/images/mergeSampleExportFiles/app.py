@@ -1,92 +1,68 @@
 import os
 import json
-import gzip
 import shutil
-import pandas as pd
+import functools
 from sys import exit, stderr
 from datetime import datetime
 import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
-
-
-def extractValue(dict, param, key):
-  if param in dict.keys():
-    paramDict = dict[param]
-    if key in paramDict.keys():
-      return paramDict[key]
-    else:
-      return "N/A"
-  else:
-    return "N/A"
-
-def createDict(dynamoItem):
-  dynamoItem = json.loads(dynamoItem)
-  dynamoItem = dynamoItem['Item']
-  
-  newDict = {
-        'cogUkId': extractValue(dynamoItem, 'cogUkId', 'S'),
-        'runMetaData': extractValue(dynamoItem, 'runMetaData', 'S'),
-        'consensusFastaHash': extractValue(dynamoItem, 'consensusFastaHash', 'S'),
-        'runCompleteDate': extractValue(dynamoItem, 'runCompleteDate', 'N'),
-        'lastChangedDate': extractValue(dynamoItem, 'lastChangedDate', 'N'),
-        'run' : extractValue(dynamoItem, 'run','N'),
-        'lane': extractValue(dynamoItem, 'lane', 'N'),
-        'tag' : extractValue(dynamoItem, 'tag', 'N')
-  }
-
-  return newDict
+import exportReader
+import exportSchema
+import parquetOutput
+
+
+# Columns of exported.csv
+SCHEMA = exportSchema.Schema([
+  exportSchema.column('cogUkId', exportSchema.STRING),
+  exportSchema.column('runMetaData', exportSchema.STRING),
+  exportSchema.column('consensusFastaHash', exportSchema.STRING),
+  exportSchema.column('runCompleteDate', exportSchema.INT),
+  exportSchema.column('lastChangedDate', exportSchema.INT),
+  exportSchema.column('run', exportSchema.INT),
+  exportSchema.column('lane', exportSchema.INT),
+  exportSchema.column('tag', exportSchema.INT)
+])
+
+def writePart(heronBucketName, partDir, dataFileKey):
+  """Decode one data file into columns and write them as a CSV part, runs in a worker process"""
+  decoder = SCHEMA.decoder()
+  for dynamoItem in exportReader.readItems(heronBucketName, dataFileKey):
+    decoder.append(dynamoItem)
+  partFilename = exportReader.partFilename(partDir, dataFileKey)
+  decoder.toDataFrame().to_csv(partFilename, index=False, na_rep="N/A")
+  if parquetOutput.enabled():
+    # The same rows as Parquet, the samples have no call date or lineage to partition by
+    table = decoder.toArrow()
+    parquetOutput.writePart(table, os.path.join(partDir, "parquetParts"), os.path.basename(partFilename)[:-len(".csv")])
+  return partFilename
 
 def main():
   exportArn = os.getenv("EXPORT_ARN")
   s3Prefix = os.getenv("S3_PREFIX")
   heronBucketName = os.getenv("HERON_BUCKET") 
-  exportFolder = os.path.basename(exportArn)
 
-  exportManifestS3Key = f"{s3Prefix}/AWSDynamoDB/{exportFolder}/manifest-files.json"
-  exportManifestLocalPath = "/tmp/manifest.json"
+  exportManifestS3Key, concatenatedFileS3Key = exportReader.exportKeys(s3Prefix, exportArn)
   concatenatedLocalFilePath = "/tmp/concatenated.csv"
-  concatenatedFileS3Key = f"{s3Prefix}/AWSDynamoDB/{exportFolder}/exported.csv"
   
   print(f"exportManifestS3Key: {exportManifestS3Key}")
   print(f"concatenatedFileS3Key: {concatenatedFileS3Key}")
 
-
-  #download manifest file
-  s3 = boto3.resource('s3', region_name='eu-west-1')
-  bucket = s3.Bucket(heronBucketName)
-
-  bucket.download_file(exportManifestS3Key, exportManifestLocalPath)
-
-  with open(exportManifestLocalPath) as file:
-    manifestFiles = file.readlines()
-
-  allDicts = []
-  for manifestLine in manifestFiles:
-    manifestItem = json.loads(manifestLine)
-    dataFileKey = manifestItem['dataFileS3Key']
-
-    # Download and unzip file
-    localDataFilePathZipped = f"/tmp/{os.path.basename(dataFileKey)}"
-    localDataFilePathUnZipped, ex = os.path.splitext(localDataFilePathZipped)
-    
-    bucket.download_file(dataFileKey, localDataFilePathZipped)
-    with gzip.open(localDataFilePathZipped, 'rb') as f_in:
-      with open(localDataFilePathUnZipped, 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-
-
-    with open(localDataFilePathUnZipped) as f:
-      dynamoLines = f.readlines()
-
-    frames = [createDict(f) for f in dynamoLines if f != '\n']
-    allDicts.extend(frames)
-
-  # Save the resulting dataframe back into S3
-  exportDf = pd.DataFrame(allDicts)
-  exportDf.to_csv(concatenatedLocalFilePath, index=False)
-  bucket.upload_file(concatenatedLocalFilePath, concatenatedFileS3Key)
+  # Each data file is streamed from S3 into its own CSV part in a worker process
+  dataFileKeys = exportReader.readManifest(heronBucketName, exportManifestS3Key)
+  partDir = exportReader.makePartDir()
+  partFilenames = exportReader.processFiles(functools.partial(writePart, heronBucketName, partDir), dataFileKeys)
+
+  # Join the parts and save the result back into S3
+  exportReader.concatenate(partFilenames, concatenatedLocalFilePath)
+  exportReader.getBucket(heronBucketName).upload_file(concatenatedLocalFilePath, concatenatedFileS3Key)
+  if parquetOutput.enabled():
+    # The workers' parts streamed into a single Parquet file
+    parquetOutput.combine(os.path.join(partDir, "parquetParts"), os.path.join(partDir, "parquet"), "exported")
+    parquetFiles = parquetOutput.upload(exportReader.getBucket(heronBucketName), os.path.join(partDir, "parquet"), parquetOutput.datasetPrefix(concatenatedFileS3Key))
+    print(f"Uploaded {parquetFiles} Parquet files to {parquetOutput.datasetPrefix(concatenatedFileS3Key)}")
+  shutil.rmtree(partDir, ignore_errors=True)
 
 
 if __name__ == '__main__':
@@ -1,120 +1,89 @@
 import os
 import json
-import gzip
 import shutil
-import pandas as pd
+import functools
 from sys import exit, stderr
 from datetime import datetime
 import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
-
-
-def extractValue(dict, param, key):
-  if param in dict.keys():
-    paramDict = dict[param]
-    if key in paramDict.keys():
-      return paramDict[key]
-    else:
-      return "N/A"
-  else:
-    return "N/A"
-
-def createDict(dynamoItem):
-  dynamoItem = json.loads(dynamoItem)
-  dynamoItem = dynamoItem['Item']
-  
-
-  newDict = {
-        'seqHash': extractValue(dynamoItem, 'seqHash', 'S'),
-        'pangoAmbiguityScore': extractValue(dynamoItem, 'pangoAmbiguityScore', 'N'),
-        'scorpioCall': extractValue(dynamoItem, 'scorpioCall', 'S'),
-        'scorpioSupport': extractValue(dynamoItem, 'scorpioSupport', 'N'),
-        'pangoNote' : extractValue(dynamoItem, 'pangoNote','S'),
-        'pangoLineage': extractValue(dynamoItem, 'pangoLineage', 'S'),
-        'pangoConflict' : extractValue(dynamoItem, 'pangoConflict', 'N'),
-        'genotypeVariantConf' : extractValue(dynamoItem, 'genotypeVariantConf', 'S'),
-        'scorpioConflict' : extractValue(dynamoItem, 'scorpioConflict', 'N'),
-        'consensusFastaPath': extractValue(dynamoItem, 'consensusFastaPath', 'S'),
-        'genotypeVariant': extractValue(dynamoItem, 'genotypeVariant', 'S'),
-        'pctCoveredBases' : extractValue(dynamoItem, 'pctCoveredBases', 'N'),
-        'numAlignedReads' : extractValue(dynamoItem, 'numAlignedReads', 'N'),
-        'genotypeProfile' : extractValue(dynamoItem, 'genotypeProfile', 'S'),
-        'genotypeCallDate': extractValue(dynamoItem, 'genotypeCallDate', 'N'),
-        'pangoCallDate': extractValue(dynamoItem, 'pangoCallDate', 'N'),
-        'scorpioNote': extractValue(dynamoItem, 'scorpioNote', 'S'),
-        'pangoQcNotes': extractValue(dynamoItem, 'pangoQcNotes', 'S'),
-        'pangoQcStatus': extractValue(dynamoItem, 'pangoQcStatus', 'S'),
-        'pangolinVersion': extractValue(dynamoItem, 'pangolinVersion', 'S'),
-        'constellationVersion': extractValue(dynamoItem, 'constellationVersion', 'S'),
-        'isDesignated': extractValue(dynamoItem, 'isDesignated', 'S'),
-        'pangoSoftwareVersion': extractValue(dynamoItem, 'pangoSoftwareVersion', 'S'),
-        'scorpioVersion': extractValue(dynamoItem, 'scorpioVersion', 'S')
-  }
-
-  matchedGenotypeProfiles = extractValue(dynamoItem, 'matchedGenotypeProfiles', 'M')
-  if isinstance(matchedGenotypeProfiles, dict):
-    keys = list(matchedGenotypeProfiles.keys())
-    matchedGenotypes = ""
-    for key in keys:
-      conf = matchedGenotypeProfiles[key]['S']
-      matchedGenotypes += f"{key}:{conf} "
-    newDict['matchedGenotypeProfiles'] = matchedGenotypes[0:-1]
-  else:
-    newDict['matchedGenotypeProfiles'] = "N/A"
-  
-  return newDict
+import exportReader
+import exportSchema
+import parquetOutput
+
+
+def formatProfiles(matchedGenotypeProfiles):
+  """The matched genotype profiles map as 'profile:confidence' pairs separated by spaces"""
+  return " ".join([f"{key}:{conf['S']}" for key, conf in matchedGenotypeProfiles.items()])
+
+# Columns of exported.csv
+SCHEMA = exportSchema.Schema([
+  exportSchema.column('seqHash', exportSchema.STRING),
+  exportSchema.column('pangoAmbiguityScore', exportSchema.FLOAT),
+  exportSchema.column('scorpioCall', exportSchema.STRING),
+  exportSchema.column('scorpioSupport', exportSchema.FLOAT),
+  exportSchema.column('pangoNote', exportSchema.STRING),
+  exportSchema.column('pangoLineage', exportSchema.STRING),
+  exportSchema.column('pangoConflict', exportSchema.FLOAT),
+  exportSchema.column('genotypeVariantConf', exportSchema.STRING),
+  exportSchema.column('scorpioConflict', exportSchema.FLOAT),
+  exportSchema.column('consensusFastaPath', exportSchema.STRING),
+  exportSchema.column('genotypeVariant', exportSchema.STRING),
+  exportSchema.column('pctCoveredBases', exportSchema.FLOAT),
+  exportSchema.column('numAlignedReads', exportSchema.INT),
+  exportSchema.column('genotypeProfile', exportSchema.STRING),
+  exportSchema.column('genotypeCallDate', exportSchema.INT),
+  exportSchema.column('pangoCallDate', exportSchema.INT),
+  exportSchema.column('scorpioNote', exportSchema.STRING),
+  exportSchema.column('pangoQcNotes', exportSchema.STRING),
+  exportSchema.column('pangoQcStatus', exportSchema.STRING),
+  exportSchema.column('pangolinVersion', exportSchema.STRING),
+  exportSchema.column('constellationVersion', exportSchema.STRING),
+  exportSchema.column('isDesignated', exportSchema.STRING),
+  exportSchema.column('pangoSoftwareVersion', exportSchema.STRING),
+  exportSchema.column('scorpioVersion', exportSchema.STRING),
+  exportSchema.column('matchedGenotypeProfiles', exportSchema.STRING, dynamoType='M', transform=formatProfiles)
+])
+
+def writePart(heronBucketName, partDir, dataFileKey):
+  """Decode one data file into columns and write them as a CSV part, runs in a worker process"""
+  decoder = SCHEMA.decoder()
+  for dynamoItem in exportReader.readItems(heronBucketName, dataFileKey):
+    decoder.append(dynamoItem)
+  partFilename = exportReader.partFilename(partDir, dataFileKey)
+  decoder.toDataFrame().to_csv(partFilename, index=False, na_rep="N/A")
+  if parquetOutput.enabled():
+    # The same rows as Parquet, partitioned by the day of the pangolin call and the lineage
+    table = parquetOutput.withLineage(parquetOutput.withDay(decoder.toArrow(), 'pangoCallDate'), 'pangoLineage')
+    parquetOutput.writePart(table, os.path.join(partDir, "parquetParts"), os.path.basename(partFilename)[:-len(".csv")])
+  return partFilename
 
 def main():
   exportArn = os.getenv("EXPORT_ARN")
   s3Prefix = os.getenv("S3_PREFIX")
   heronBucketName = os.getenv("HERON_BUCKET") 
-  exportFolder = os.path.basename(exportArn)
 
-  exportManifestS3Key = f"{s3Prefix}/AWSDynamoDB/{exportFolder}/manifest-files.json"
-  exportManifestLocalPath = "/tmp/manifest.json"
+  exportManifestS3Key, concatenatedFileS3Key = exportReader.exportKeys(s3Prefix, exportArn)
   concatenatedLocalFilePath = "/tmp/concatenated.csv"
-  concatenatedFileS3Key = f"{s3Prefix}/AWSDynamoDB/{exportFolder}/exported.csv"
   
   print(f"exportManifestS3Key: {exportManifestS3Key}")
   print(f"concatenatedFileS3Key: {concatenatedFileS3Key}")
 
-
-  #download manifest file
-  s3 = boto3.resource('s3', region_name='eu-west-1')
-  bucket = s3.Bucket(heronBucketName)
-
-  bucket.download_file(exportManifestS3Key, exportManifestLocalPath)
-
-  with open(exportManifestLocalPath) as file:
-    manifestFiles = file.readlines()
-
-  allDicts = []
-  for manifestLine in manifestFiles:
-    manifestItem = json.loads(manifestLine)
-    dataFileKey = manifestItem['dataFileS3Key']
-
-    # Download and unzip file
-    localDataFilePathZipped = f"/tmp/{os.path.basename(dataFileKey)}"
-    localDataFilePathUnZipped, ex = os.path.splitext(localDataFilePathZipped)
-    
-    bucket.download_file(dataFileKey, localDataFilePathZipped)
-    with gzip.open(localDataFilePathZipped, 'rb') as f_in:
-      with open(localDataFilePathUnZipped, 'wb') as f_out:
-        shutil.copyfileobj(f_in, f_out)
-
-
-    with open(localDataFilePathUnZipped) as f:
-      dynamoLines = f.readlines()
-
-    frames = [createDict(f) for f in dynamoLines if f != '\n']
-    allDicts.extend(frames)
-    
-  # Save the resulting dataframe back into S3
-  exportDf = pd.DataFrame(allDicts)
-  exportDf.to_csv(concatenatedLocalFilePath, index=False)
-  bucket.upload_file(concatenatedLocalFilePath, concatenatedFileS3Key)
+  # Each data file is streamed from S3 into its own CSV part in a worker process
+  dataFileKeys = exportReader.readManifest(heronBucketName, exportManifestS3Key)
+  partDir = exportReader.makePartDir()
+  partFilenames = exportReader.processFiles(functools.partial(writePart, heronBucketName, partDir), dataFileKeys)
+
+  # Join the parts and save the result back into S3
+  exportReader.concatenate(partFilenames, concatenatedLocalFilePath)
+  exportReader.getBucket(heronBucketName).upload_file(concatenatedLocalFilePath, concatenatedFileS3Key)
+  if parquetOutput.enabled():
+    # The workers' parts written as one dataset, one file per partition
+    parquetOutput.combine(os.path.join(partDir, "parquetParts"), os.path.join(partDir, "parquet"), "exported")
+    parquetFiles = parquetOutput.upload(exportReader.getBucket(heronBucketName), os.path.join(partDir, "parquet"), parquetOutput.datasetPrefix(concatenatedFileS3Key))
+    print(f"Uploaded {parquetFiles} Parquet files to {parquetOutput.datasetPrefix(concatenatedFileS3Key)}")
+  shutil.rmtree(partDir, ignore_errors=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+"""
+Stream the data files of a DynamoDB table export.
+
+An export is a manifest, manifest-files.json, listing gzipped data files of
+line delimited DynamoDB JSON, one {"Item": {...}} per line. Each data file
+is decompressed straight from its S3 response body and parsed a line at a
+time, with orjson when it is installed, so nothing is staged on disk and
+only one line of a file is in memory at once.
+
+The data files are processed concurrently in a process pool. Each worker
+reduces a file to a part file on local disk, and the image combines the parts
+once every file is done, so the memory a merge needs is set by the work on a
+single file rather than by the size of the table.
+"""
+
+import os
+import gzip
+import json
+import zlib
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import boto3
+
+try:
+  import orjson
+  loads = orjson.loads
+except ImportError:
+  orjson = None
+  loads = json.loads
+
+# S3 resources of this process, boto3 resources can't be shared between
+# processes so each worker starts with none of its own, see resetBuckets
+_buckets = dict()
+
+
+def exportKeys(s3Prefix, exportArn):
+  """S3 keys of an export's manifest and of the CSV merged from it"""
+  exportFolder = os.path.basename(exportArn)
+  prefix = f"{s3Prefix}/AWSDynamoDB/{exportFolder}"
+  return f"{prefix}/manifest-files.json", f"{prefix}/exported.csv"
+
+
+def getBucket(bucketName):
+  if bucketName not in _buckets:
+    _buckets[bucketName] = boto3.resource('s3', region_name='eu-west-1').Bucket(bucketName)
+  return _buckets[bucketName]
+
+
+def resetBuckets():
+  """Drop the resources a forked worker inherited from the parent, it builds its own as it needs them"""
+  _buckets.clear()
+
+
+def readManifest(bucketName, manifestKey):
+  """dataFileS3Key of every data file in the export"""
+  body = getBucket(bucketName).Object(manifestKey).get()['Body']
+  return [loads(f)['dataFileS3Key'] for f in body.iter_lines() if f.strip()]
+
+
+def readItems(bucketName, dataFileKey):
+  """Yield the Item of every line of a data file, lines that don't parse are reported and skipped"""
+  body = getBucket(bucketName).Object(dataFileKey).get()['Body']
+  with gzip.GzipFile(fileobj=body) as lines:
+    for line in lines:
+      if not line.strip():
+        continue
+      try:
+        yield loads(line)['Item']
+      except (ValueError, KeyError):
+        print(f"Error loading: {line[:200]}")
+
+
+def availableProcesses():
+  try:
+    return len(os.sched_getaffinity(0))
+  except AttributeError:
+    return os.cpu_count() or 1
+
+
+def processFiles(processFile, dataFileKeys, processes=None):
+  """Run processFile(dataFileKey) over every data file in a process pool
+
+  processFile must be a module level function, or a functools.partial of
+  one, so it can be sent to the workers. Returns its results in manifest
+  order.
+  """
+  processes = processes or int(os.getenv("EXPORT_PROCESSES", str(availableProcesses())))
+  print(f"Processing {len(dataFileKeys)} files in {processes} processes")
+  # Workers forked after readManifest would otherwise share the parent's S3
+  # resource and its connection pool
+  with ProcessPoolExecutor(max_workers=max(1, processes), initializer=resetBuckets) as executor:
+    return list(executor.map(processFile, dataFileKeys))
+
+
+def partFilename(partDir, dataFileKey, suffix=".csv"):
+  return os.path.join(partDir, os.path.basename(dataFileKey).split(".")[0] + suffix)
+
+
+def concatenate(partFilenames, outputFilename, headerLines=1):
+  """Join CSV parts into one file, keeping the header of the first part only"""
+  with open(outputFilename, "wb") as outputFile:
+    for i, partFilename in enumerate(partFilenames):
+      with open(partFilename, "rb") as partFile:
+        if i > 0:
+          for _ in range(headerLines):
+            partFile.readline()
+        shutil.copyfileobj(partFile, outputFile)
+
+
+def bucketOf(key, buckets):
+  """Stable bucket of a key, used to split records so each bucket can be grouped on its own"""
+  return zlib.crc32(key.encode()) % buckets
+
+
+def makePartDir():
+  return tempfile.mkdtemp(prefix="exportParts_", dir=os.getenv("EXPORT_TMP_DIR", "/tmp"))
@@ -0,0 +1,187 @@
+"""
+Decode DynamoDB export items straight into typed columns.
+
+Each merge image declares the columns it exports as a Schema, attribute by
+attribute:
+
+  Schema([
+    column('seqHash', STRING),
+    column('pangoCallDate', INT),
+    column('pangoConflict', FLOAT),
+    column('matchedGenotypeProfiles', STRING, dynamoType='M', transform=formatProfiles)
+  ])
+
+schema.decoder() compiles the columns into a Decoder whose append(item)
+reads each attribute of an item once and appends it to the column's builder:
+
+  STRING  dictionary encoded, each distinct value is stored once and rows
+          hold an int32 code, so lineages, versions and notes repeated
+          across millions of items cost four bytes a row
+  INT     parsed once into an int64 column with a validity mask
+  FLOAT   parsed once into a float64 column with a validity mask
+
+An attribute that is missing, or of another DynamoDB type, is null. A
+column with a transform is given the attribute's raw DynamoDB value and
+stores what it returns. The decoded columns come out as a pandas DataFrame,
+strings as categoricals, or as a pyarrow Table when pyarrow is installed.
+"""
+
+from array import array
+import numpy as np
+import pandas as pd
+
+try:
+  import pyarrow as pa
+except ImportError:
+  pa = None
+
+STRING = "string"
+INT = "int"
+FLOAT = "float"
+# The DynamoDB type each kind is read from unless the column says otherwise
+DYNAMO_TYPES = {STRING: 'S', INT: 'N', FLOAT: 'N'}
+
+
+class Column:
+  def __init__(self, attribute, kind, name=None, dynamoType=None, transform=None):
+    if kind not in DYNAMO_TYPES:
+      raise ValueError(f"Unknown column kind: {kind}")
+    self.attribute = attribute
+    self.kind = kind
+    self.name = name if name is not None else attribute
+    self.dynamoType = dynamoType if dynamoType is not None else DYNAMO_TYPES[kind]
+    self.transform = transform
+
+
+def column(attribute, kind, name=None, dynamoType=None, transform=None):
+  return Column(attribute, kind, name, dynamoType, transform)
+
+
+class StringBuilder:
+  """Dictionary encoded string column, code -1 is null"""
+
+  def __init__(self):
+    self.index = dict()
+    self.values = list()
+    self.codes = array('i')
+
+  def append(self, value):
+    code = self.index.get(value)
+    if code is None:
+      code = len(self.values)
+      self.index[value] = code
+      self.values.append(value)
+    self.codes.append(code)
+
+  def appendNull(self):
+    self.codes.append(-1)
+
+  def toPandas(self):
+    codes = np.frombuffer(self.codes, dtype=np.int32) if len(self.codes) > 0 else np.zeros(0, dtype=np.int32)
+    return pd.Categorical.from_codes(codes, categories=pd.Index(self.values, dtype=object))
+
+  def toArrow(self):
+    codes = np.frombuffer(self.codes, dtype=np.int32) if len(self.codes) > 0 else np.zeros(0, dtype=np.int32)
+    indices = pa.array(codes, mask=codes < 0, type=pa.int32())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(self.values, type=pa.string()))
+
+
+class NumberBuilder:
+  """int64 or float64 column with a validity mask"""
+
+  def __init__(self, kind):
+    self.kind = kind
+    self.values = array('q' if kind == INT else 'd')
+    self.valid = array('b')
+
+  def parse(self, value):
+    if self.kind == FLOAT:
+      return float(value)
+    try:
+      return int(value)
+    except ValueError:
+      return int(float(value))
+
+  def append(self, value):
+    try:
+      self.values.append(self.parse(value))
+    except (TypeError, ValueError, OverflowError):
+      self.appendNull()
+      return
+    self.valid.append(1)
+
+  def appendNull(self):
+    self.values.append(0)
+    self.valid.append(0)
+
+  def arrays(self):
+    dtype = np.int64 if self.kind == INT else np.float64
+    values = np.frombuffer(self.values, dtype=dtype) if len(self.values) > 0 else np.zeros(0, dtype=dtype)
+    valid = np.frombuffer(self.valid, dtype=np.int8).astype(bool) if len(self.valid) > 0 else np.zeros(0, dtype=bool)
+    return values, valid
+
+  def toPandas(self):
+    values, valid = self.arrays()
+    if self.kind == INT:
+      return pd.arrays.IntegerArray(values.copy(), ~valid)
+    return pd.arrays.FloatingArray(values.copy(), ~valid)
+
+  def toArrow(self):
+    values, valid = self.arrays()
+    return pa.array(values, mask=~valid)
+
+
+class Schema:
+  def __init__(self, columns):
+    self.columns = list(columns)
+    names = [f.name for f in self.columns]
+    if len(set(names)) != len(names):
+      raise ValueError("Column names must be unique")
+
+  @property
+  def names(self):
+    return [f.name for f in self.columns]
+
+  def decoder(self):
+    return Decoder(self)
+
+
+class Decoder:
+  """Append export items to the schema's column builders"""
+
+  def __init__(self, schema):
+    self.schema = schema
+    self.builders = [StringBuilder() if f.kind == STRING else NumberBuilder(f.kind) for f in schema.columns]
+    # Everything append needs for a column, looked up once here rather than for every item
+    self.plan = [
+      (f.attribute, f.dynamoType, f.transform, builder.append, builder.appendNull)
+      for f, builder in zip(schema.columns, self.builders)
+    ]
+    self.rows = 0
+
+  def __len__(self):
+    return self.rows
+
+  def append(self, item):
+    """Append one export Item, {attribute: {dynamoType: value}}"""
+    for attribute, dynamoType, transform, append, appendNull in self.plan:
+      typedValue = item.get(attribute)
+      if typedValue is None or dynamoType not in typedValue:
+        appendNull()
+        continue
+      value = typedValue[dynamoType]
+      if transform is not None:
+        value = transform(value)
+        if value is None:
+          appendNull()
+          continue
+      append(value)
+    self.rows += 1
+
+  def toDataFrame(self):
+    return pd.DataFrame({f: builder.toPandas() for f, builder in zip(self.schema.names, self.builders)})
+
+  def toArrow(self):
+    if pa is None:
+      raise ImportError("toArrow needs the pyarrow package")
+    return pa.table({f: builder.toArrow() for f, builder in zip(self.schema.names, self.builders)})
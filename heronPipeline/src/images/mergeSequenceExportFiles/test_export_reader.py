@@ -0,0 +1,41 @@
+"""
+Unit test exportReader.py's worker processes
+"""
+
+
+import unittest
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import exportReader
+
+
+def cachedBuckets(dataFileKey):
+  return (dataFileKey, sorted(exportReader._buckets))
+
+
+class TestExportReader(unittest.TestCase):
+
+  def tearDown(self):
+    exportReader.resetBuckets()
+
+  def test_workers_do_not_inherit_buckets(self):
+    """
+    A resource the parent cached reading the manifest isn't used by the workers.
+    """
+    exportReader._buckets['heron'] = object()
+    results = exportReader.processFiles(cachedBuckets, ["a", "b", "c"], processes=2)
+
+    self.assertEqual(results, [("a", []), ("b", []), ("c", [])])
+    self.assertIn('heron', exportReader._buckets)
+
+  def test_part_filename(self):
+    self.assertEqual(exportReader.partFilename("/tmp/parts", "AWSDynamoDB/1/data/abc.json.gz"), "/tmp/parts/abc.csv")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+"""
+Unit test exportSchema.py
+"""
+
+
+import unittest
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import exportSchema
+from exportSchema import column, STRING, INT, FLOAT
+
+
+SCHEMA = exportSchema.Schema([
+  column('seqHash', STRING),
+  column('pangoLineage', STRING, name='lineage'),
+  column('pangoCallDate', INT),
+  column('pangoConflict', FLOAT),
+  column('profiles', STRING, dynamoType='M', transform=lambda m: " ".join(sorted(m)))
+])
+
+ITEMS = [
+  {'seqHash': {'S': "a"}, 'pangoLineage': {'S': "B.1"}, 'pangoCallDate': {'N': "1650000000"}, 'pangoConflict': {'N': "0.5"}, 'profiles': {'M': {'x': {'S': "high"}}}},
+  {'seqHash': {'S': "b"}, 'pangoLineage': {'S': "B.1"}, 'pangoCallDate': {'N': "not a number"}},
+  {'seqHash': {'S': "c"}, 'pangoLineage': {'N': "1"}, 'pangoCallDate': {'N': "1650000001"}, 'pangoConflict': {'N': "0"}}
+]
+
+
+class TestExportSchema(unittest.TestCase):
+
+  def decode(self):
+    decoder = SCHEMA.decoder()
+    for item in ITEMS:
+      decoder.append(item)
+    return decoder
+
+  def test_strings_are_dictionary_encoded(self):
+    decoder = self.decode()
+    lineage = decoder.builders[1]
+    self.assertEqual(lineage.values, ["B.1"])
+    self.assertEqual(list(lineage.codes), [0, 0, -1])
+
+  def test_data_frame(self):
+    df = self.decode().toDataFrame()
+    self.assertEqual(list(df.columns), ['seqHash', 'lineage', 'pangoCallDate', 'pangoConflict', 'profiles'])
+    self.assertEqual(len(df), 3)
+    self.assertEqual(df['pangoCallDate'].tolist()[0], 1650000000)
+    self.assertTrue(df['pangoCallDate'].isna().tolist()[1])
+    self.assertEqual(df['pangoConflict'].tolist()[2], 0.0)
+    self.assertTrue(df['lineage'].isna().tolist()[2])
+    self.assertEqual(df['profiles'].tolist()[0], "x")
+    self.assertEqual(df.to_csv(index=False, na_rep="N/A").splitlines()[2], "b,B.1,N/A,N/A,N/A")
+
+  def test_arrow(self):
+    if exportSchema.pa is None:
+      self.skipTest("pyarrow is not installed")
+    table = self.decode().toArrow()
+    self.assertEqual(table.num_rows, 3)
+    self.assertEqual(str(table.schema.field('lineage').type), "dictionary<values=string, indices=int32, ordered=0>")
+    self.assertEqual(table.column('pangoCallDate').null_count, 1)
+    self.assertEqual(table.column('lineage').to_pylist(), ["B.1", "B.1", None])
+
+
+if __name__ == '__main__':
+  unittest.main()
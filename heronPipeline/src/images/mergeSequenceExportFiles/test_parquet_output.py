@@ -0,0 +1,107 @@
+"""
+Unit test parquetOutput.py
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import parquetOutput
+
+
+@unittest.skipIf(parquetOutput.pa is None, "pyarrow is not installed")
+class TestParquetOutput(unittest.TestCase):
+
+  def setUp(self):
+    self.outputDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.outputDir, ignore_errors=True)
+
+  def test_partitioned_by_day_and_lineage(self):
+    pa = parquetOutput.pa
+    table = pa.table({
+      'seqHash': ["a", "b", "c"],
+      'pangoCallDate': pa.array([1650000000, 1650003600, None], type=pa.int64()),
+      'pangoLineage': pa.array(["BA.2", "B.1", "BA.2"]).dictionary_encode()
+    })
+    table = parquetOutput.withLineage(parquetOutput.withDay(table, 'pangoCallDate'), 'pangoLineage')
+    parquetOutput.write(table, self.outputDir, "part0")
+
+    files = sorted([os.path.relpath(os.path.join(root, f), self.outputDir) for root, dirs, names in os.walk(self.outputDir) for f in names])
+    self.assertEqual(files, [
+      "date=2022-04-15/lineage=B.1/part0-0.parquet",
+      "date=2022-04-15/lineage=BA.2/part0-0.parquet",
+      "date=__HIVE_DEFAULT_PARTITION__/lineage=BA.2/part0-0.parquet"
+    ])
+
+    dataset = parquetOutput.ds.dataset(self.outputDir, partitioning="hive")
+    rows = dataset.to_table(columns=['seqHash'], filter=parquetOutput.ds.field('lineage') == "BA.2").column('seqHash').to_pylist()
+    self.assertEqual(sorted(rows), ["a", "c"])
+
+  def test_unpartitioned_table(self):
+    pa = parquetOutput.pa
+    parquetOutput.write(pa.table({'seqHash': ["a"], 'mutations': ["S:N501Y"]}), self.outputDir, "mutations_0")
+    self.assertEqual(os.listdir(self.outputDir), ["mutations_0-0.parquet"])
+
+  def test_parts_combine_into_one_file_per_partition(self):
+    pa = parquetOutput.pa
+    partDir = os.path.join(self.outputDir, "parts")
+    datasetDir = os.path.join(self.outputDir, "dataset")
+    days = [1650000000, 1650100000, 1650200000, None]
+    lineages = ["BA.2", "B.1", "BA.1"]
+    for part in range(6):
+      table = pa.table({
+        'seqHash': [f"{part}_{i}" for i in range(60)],
+        'pangoCallDate': pa.array([days[i % 4] for i in range(60)], type=pa.int64()),
+        'pangoLineage': pa.array([lineages[(i + part) % 3] for i in range(60)]).dictionary_encode()
+      })
+      table = parquetOutput.withLineage(parquetOutput.withDay(table, 'pangoCallDate'), 'pangoLineage')
+      parquetOutput.writePart(table, partDir, f"part{part}")
+    parquetOutput.combine(partDir, datasetDir, "exported")
+
+    directories = [os.path.relpath(root, datasetDir) for root, dirs, names in os.walk(datasetDir) if len(names) > 0]
+    self.assertEqual(len(directories), 12)
+    for root, dirs, names in os.walk(datasetDir):
+      self.assertLessEqual(len(names), 1, root)
+
+    dataset = parquetOutput.ds.dataset(datasetDir, partitioning="hive")
+    self.assertEqual(dataset.count_rows(), 360)
+    rows = dataset.to_table(columns=['seqHash'], filter=(parquetOutput.ds.field('lineage') == "B.1") & (parquetOutput.ds.field('date') == "2022-04-15")).column('seqHash').to_pylist()
+    self.assertEqual(len(rows), 30)
+
+  def test_unpartitioned_parts_combine_into_one_file(self):
+    pa = parquetOutput.pa
+    partDir = os.path.join(self.outputDir, "parts")
+    datasetDir = os.path.join(self.outputDir, "dataset")
+    for part in range(3):
+      parquetOutput.writePart(pa.table({'seqHash': [f"{part}_{i}" for i in range(10)]}), partDir, f"part{part}")
+    parquetOutput.combine(partDir, datasetDir, "samples")
+
+    self.assertEqual(os.listdir(datasetDir), ["samples-0.parquet"])
+    self.assertEqual(parquetOutput.ds.dataset(datasetDir).count_rows(), 30)
+
+  def test_upload_every_file(self):
+    uploaded = list()
+    client = type("Client", (), {'upload_file': lambda self, path, bucketName, key: uploaded.append((bucketName, key))})()
+    bucket = type("Bucket", (), {'name': "heron", 'meta': type("Meta", (), {'client': client})()})()
+    pa = parquetOutput.pa
+    table = parquetOutput.withLineage(pa.table({'seqHash': ["a", "b"], 'pangoLineage': ["A", "B"]}), 'pangoLineage')
+    parquetOutput.write(table, self.outputDir, "part0")
+
+    self.assertEqual(parquetOutput.upload(bucket, self.outputDir, "results"), 2)
+    self.assertEqual(sorted(uploaded), [("heron", "results/lineage=A/part0-0.parquet"), ("heron", "results/lineage=B/part0-0.parquet")])
+
+  def test_dataset_prefix(self):
+    self.assertEqual(parquetOutput.datasetPrefix("export/AWSDynamoDB/1/exported.csv"), "export/AWSDynamoDB/1/exported.parquet")
+
+
+if __name__ == '__main__':
+  unittest.main()
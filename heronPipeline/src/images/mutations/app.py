@@ -1,4 +1,5 @@
 import os
+import tempfile
 import subprocess
 import sys
 import shutil
@@ -17,6 +18,12 @@ import logging
 from datetime import datetime
 import mutations
 import translate_mutations
+import samArchive
+import alignedSequence
+import sequencePack
+import sequenceDedup
+import tracing
+import resultWriter
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -59,6 +66,7 @@ refAAFastaS3 = os.getenv("REF_AA_KEY")
 genesTsvS3Key = os.getenv('GENES_TSV_KEY')
 geneOverlapTsvS3Key = os.getenv('GENES_OVERLAP_TSV_KEY')
 threads = os.getenv('GO_FASTA_THREADS')
+tmpDir = tempfile.gettempdir()
 
 # Step 2. Create resources
 s3 = boto3.resource('s3', region_name='eu-west-1')
@@ -66,26 +74,27 @@ bucket = s3.Bucket(bucketName)
 dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
 sequencesTable = dynamodb.Table(heronSequencesTableName)
 mutationsTable = dynamodb.Table(mutationsTableName)
+writer = resultWriter.ResultWriter(boto3.client('dynamodb', region_name="eu-west-1", config=resultWriter.CONFIG))
 callDate = int(datetime.now().timestamp())
 
 # Step 3. Create local paths
-metadataLocalFilename = "/tmp/metdatata.tsv"
-fastaJsonLocalFilename = "/tmp/consensus.fa"
-referenceFastaLocalFilename = "/tmp/ref.fa"
-referenceGbLocalFilename = "/tmp/ref.gb"
-refAAFastaLocalFilename = "/tmp/ref_aa.fa"
-samLocalFilename = "/tmp/sample.aligned.sam"
-alignedFastaLocalFilename = "/tmp/sample.aligned.fasta"
-outputAAMutTsvLocalFilename = "/tmp/sample.aa_mut.fa"
-outputNucMutTsvLocalFilename = "/tmp/sample.nuc_mut.fa"
-genesTsvLocalFilename = "/tmp/genes.tsv"
-geneOverlapTsvLocalFilename = "/tmp/gene_overlap.tsv"
-outputNucIndelLocalFilenamePrefix = "/tmp/sample.nuc_indel"
+metadataLocalFilename = f"{tmpDir}/metdatata.tsv"
+fastaJsonLocalFilename = f"{tmpDir}/consensus.fa"
+referenceFastaLocalFilename = f"{tmpDir}/ref.fa"
+referenceGbLocalFilename = f"{tmpDir}/ref.gb"
+refAAFastaLocalFilename = f"{tmpDir}/ref_aa.fa"
+samLocalFilename = f"{tmpDir}/sample.aligned.sam"
+alignedFastaLocalFilename = f"{tmpDir}/sample.aligned.fasta"
+outputAAMutTsvLocalFilename = f"{tmpDir}/sample.aa_mut.fa"
+outputNucMutTsvLocalFilename = f"{tmpDir}/sample.nuc_mut.fa"
+genesTsvLocalFilename = f"{tmpDir}/genes.tsv"
+geneOverlapTsvLocalFilename = f"{tmpDir}/gene_overlap.tsv"
+outputNucIndelLocalFilenamePrefix = f"{tmpDir}/sample.nuc_indel"
 outputNucDelTsvLocalFilename = outputNucIndelLocalFilenamePrefix + ".deletions.tsv"
 outputNucInsTsvLocalFilename = outputNucIndelLocalFilenamePrefix + ".insertions.tsv"
-outputSnpAALinkTsvLocalFilename = "/tmp/snp_aa_link.tsv"
-outputDelNucAALinkTsvLocalFilename = "/tmp/del_nuc_aa_link.tsv"
-outputInsNucAALinkTsvLocalFilename = "/tmp/ins_nuc_aa_link.tsv"
+outputSnpAALinkTsvLocalFilename = f"{tmpDir}/snp_aa_link.tsv"
+outputDelNucAALinkTsvLocalFilename = f"{tmpDir}/del_nuc_aa_link.tsv"
+outputInsNucAALinkTsvLocalFilename = f"{tmpDir}/ins_nuc_aa_link.tsv"
 
 
 
@@ -95,42 +104,72 @@ seqFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.fasta"
 seqConsensusFile = f"{sampleDataRootSeqBatchesDir}/sequences_consensus{iterationUUID}.fasta"
 keyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
 messageListS3Key = f"messageLists/{dateString}/messageList{iterationUUID}.json"
-messageListLocalFilename = "/tmp/messageList.json"
-
+messageListLocalFilename = f"{tmpDir}/messageList.json"
 
 
 
+span = tracing.Span("mutations", iterationUUID)
 bucket.download_file(messageListS3Key, messageListLocalFilename)
+span.read(messageListLocalFilename)
 
 
 with open(messageListLocalFilename) as messageListFile:
   # load or die
   messageList = json.load(messageListFile)
 
+# Fetch the iteration's SAM archive with a single request, samples missing
+# from it fall back to their own SAM object
+samArchiveKey, samIndexKey = samArchive.archiveKeys(dateString, iterationUUID)
+try:
+  samReader = samArchive.SamArchiveReader(s3, bucketName, samIndexKey)
+  samReader.fetchAll()
+  span.bytesIn += len(samReader.data)
+except ClientError:
+  print(f"No SAM archive found: {samArchiveKey}")
+  samReader = None
+
+# Likewise the aligned sequences come from the iteration's sequence pack
+packed, packedBytes = sequencePack.readBatch(s3, bucketName, dateString, iterationUUID, messageList)
+span.bytesIn += packedBytes
+
+# Sequences identical to another in the batch get copies of its mutations
+duplicates = sequenceDedup.loadDuplicates(sequenceDedup.duplicatesFile(sampleDataRootSeqBatchesDir, iterationUUID))
+duplicateHashes = sequenceDedup.duplicateHashes(duplicates)
+
 for message in messageList:
   try:
     print(f'Message: {message["consensusFastaPath"]}')
     
     consensusFastaKey = message["consensusFastaPath"]
     consensusFastaHash = message['seqHash']
+    if consensusFastaHash in duplicateHashes:
+      continue
     samFileS3Key = f"samFiles/{consensusFastaHash}.fasta.sam"
   
-    sequenceLocalFilename = f"/tmp/seq_{consensusFastaHash}_.json"
+    sequenceLocalFilename = f"{tmpDir}/seq_{consensusFastaHash}_.json"
     
     mode = "aa_mutations"
     # Load or die
     bucket.download_file(referenceFastaPrefix, referenceFastaLocalFilename)
     bucket.download_file(referenceGbPrefix, referenceGbLocalFilename)
     bucket.download_file(refAAFastaS3, refAAFastaLocalFilename)
-    bucket.download_file(consensusFastaKey, sequenceLocalFilename)
-    bucket.download_file(samFileS3Key, samLocalFilename)
+    alignedFastaStr = packed[consensusFastaHash][1] if consensusFastaHash in packed else None
+    if alignedFastaStr is None:
+      bucket.download_file(consensusFastaKey, sequenceLocalFilename)
+    if samReader is not None and consensusFastaHash in samReader:
+      with open(samLocalFilename, 'w') as samFile:
+        samFile.write(samReader.read(consensusFastaHash))
+    else:
+      bucket.download_file(samFileS3Key, samLocalFilename)
     bucket.download_file(genesTsvS3Key, genesTsvLocalFilename)
     bucket.download_file(geneOverlapTsvS3Key, geneOverlapTsvLocalFilename)
     
 
-    with open(sequenceLocalFilename) as fh_fasta_json_in:
-        fastaDict = json.load(fh_fasta_json_in)
-    alignedFastaStr = fastaDict['aligned']
+    if alignedFastaStr is None:
+      span.read(sequenceLocalFilename)
+      with open(sequenceLocalFilename) as fh_fasta_json_in:
+          fastaDict = json.load(fh_fasta_json_in)
+      alignedFastaStr = alignedSequence.readAligned(s3, bucketName, fastaDict)
 
     with open(alignedFastaLocalFilename, 'w') as fh_aligned_fasta_out:
       fh_aligned_fasta_out.write(alignedFastaStr)
@@ -178,49 +217,44 @@ for message in messageList:
     ##############################################
     #     Update the record in dynamoDB
     ##############################################
-    for df in [linkMutOutDf, linkDelOutDf, linkInsOutDf]:
-      df = df.dropna(axis=0)
-      for i, row in df.iterrows():
+    # The mutations are written for each sequence identical to this one too
+    for targetHash in sequenceDedup.targets(duplicates, consensusFastaHash):
+      for df in [linkMutOutDf, linkDelOutDf, linkInsOutDf]:
+        df = df.dropna(axis=0)
+        for i, row in df.iterrows():
         
-        mutId = "_".join([consensusFastaHash, str(row["genome_mutation.pos"]), str(row["protein_mutation.gene"]), str(row["protein_mutation.pos"])]) 
-        # print(f"Mutation ID: {mutId}")
-
-        gmp = row["genome_mutation.pos"]
-        gmr = row["genome_mutation.ref"]
-        gma = row["genome_mutation.alt"]
-        pmg = row["protein_mutation.gene"]
-        pmp = row["protein_mutation.pos"]
-        pmr = row["protein_mutation.ref"]
-        pma = row["protein_mutation.alt"]
+          mutId = "_".join([targetHash, str(row["genome_mutation.pos"]), str(row["protein_mutation.gene"]), str(row["protein_mutation.pos"])]) 
+          # print(f"Mutation ID: {mutId}")
+
+          gmp = int(row["genome_mutation.pos"])
+          gmr = row["genome_mutation.ref"]
+          gma = row["genome_mutation.alt"]
+          pmg = row["protein_mutation.gene"]
+          pmp = int(row["protein_mutation.pos"])
+          pmr = row["protein_mutation.ref"]
+          pma = row["protein_mutation.alt"]
         
-        # print(f"{gmp} {type(gmp)}, {gmr} {type(gmr)}, {gma} {type(gma)}, {pmg} {type(pmg)}, {pmp} {type(pmp)}, {pmr} {type(pmr)}, {pma} {type(pma)}")
-
-        response = mutationsTable.update_item(
-          Key={'mutationId': mutId},
-          UpdateExpression="set seqHash=:sq, callDate=:cd, genomeMutationPos=:gmp, genomeMutationRef=:gmr, genomeMutationAlt=:gma, proteinMutationGene=:pmg, proteinMutationPos=:pmp, proteinMutationRef=:pmr, proteinMutationAlt=:pma",
-          ExpressionAttributeValues={
-            ':sq': consensusFastaHash,
-            ':cd': callDate,
-            ':gmp': gmp,
-            ':gmr': gmr,
-            ':gma': gma,
-            ':pmg': pmg,
-            ':pmp': pmp,
-            ':pmr': pmr,
-            ':pma': pma
-          })
-        # logger.debug(f"mut put response: {response}")
-
-    response = sequencesTable.query(
-        KeyConditionExpression=Key('seqHash').eq(consensusFastaHash)
-      )
-
-    ret = sequencesTable.update_item(
-        Key={'seqHash': consensusFastaHash},
-        UpdateExpression="set mutationCallDate=:d",
-        ExpressionAttributeValues={
-          ':d': callDate
-        }
-      )
+          # print(f"{gmp} {type(gmp)}, {gmr} {type(gmr)}, {gma} {type(gma)}, {pmg} {type(pmg)}, {pmp} {type(pmp)}, {pmr} {type(pmr)}, {pma} {type(pma)}")
+
+          # The update set every attribute of the mutation, so it is written as a whole item
+          writer.put(mutationsTableName, {
+              'mutationId': mutId,
+              'seqHash': targetHash,
+              'callDate': callDate,
+              'genomeMutationPos': gmp,
+              'genomeMutationRef': gmr,
+              'genomeMutationAlt': gma,
+              'proteinMutationGene': pmg,
+              'proteinMutationPos': pmp,
+              'proteinMutationRef': pmr,
+              'proteinMutationAlt': pma
+            }, ['mutationId'])
+
+      writer.update(heronSequencesTableName, {'seqHash': targetHash}, {'mutationCallDate': callDate})
+
+    span.sampleCount += 1
   except:
-    print(f"Failed to process {message['consensusFastaPath']}")
\ No newline at end of file
+    print(f"Failed to process {message['consensusFastaPath']}")
+
+span.finish(writes=writer.flush())
+writer.raiseOnFailures()
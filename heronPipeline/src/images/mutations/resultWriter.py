@@ -0,0 +1,261 @@
+"""
+Write a stage's results to DynamoDB in bulk.
+
+The stages used to write each sample's results with its own update_item,
+often after a query for the same key whose result was only used to check
+the item exists. A ResultWriter instead collects the results of the whole
+iteration, coalesced per item, and writes them concurrently when flushed:
+
+  update(table, key, values, remove)  an update_item setting values and
+                                      removing the remove attributes, with
+                                      mustExist=True it only updates an
+                                      existing item, in place of the query
+  put(table, item, keyNames)          a whole item, written through
+                                      BatchWriteItem 25 at a time
+
+Several updates of one item become a single update_item, the later value of
+an attribute winning, and a later put of an item replaces the earlier one.
+Values are serialized as they are queued, so a value DynamoDB can't store,
+e.g. a float or a numpy number, raises its TypeError in update or put rather
+than failing a whole flush.
+
+Writes that still fail are counted in the stats' failed count, and
+raiseOnFailures() raises if there were any so the stage exits non-zero.
+
+Throttled requests and unprocessed batch items are retried with exponential
+backoff. The backoff is shared by the writer's threads, so every thread
+slows down while the table is throttling and speeds up again once requests
+go through. Use a client made with CONFIG, botocore's own retries would hide
+the throttling from the writer.
+"""
+
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeSerializer
+
+THREADS = 16
+BATCH_SIZE = 25
+MAX_ATTEMPTS = 10
+# Updates are written once this many items are waiting, rather than all at the flush
+MAX_PENDING = 5000
+BASE_DELAY = 0.05
+MAX_DELAY = 5.0
+THROTTLE_CODES = ("ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded")
+
+CONFIG = Config(
+  retries = {
+    'max_attempts': 1,
+    'mode': 'standard'
+  },
+  max_pool_connections = THREADS * 2
+)
+
+
+class Backoff:
+  """Delay shared by the writer's threads, doubled on throttling and halved on success"""
+
+  def __init__(self, baseDelay=BASE_DELAY, maxDelay=MAX_DELAY):
+    self.baseDelay = baseDelay
+    self.maxDelay = maxDelay
+    self.delay = 0.0
+    self.lock = threading.Lock()
+
+  def throttled(self):
+    with self.lock:
+      self.delay = min(self.maxDelay, max(self.baseDelay, self.delay * 2))
+
+  def succeeded(self):
+    with self.lock:
+      self.delay = self.delay / 2 if self.delay >= self.baseDelay * 2 else 0.0
+
+  def wait(self):
+    delay = self.delay
+    if delay > 0:
+      time.sleep(random.uniform(delay / 2, delay))
+
+
+def keyOf(tableName, key):
+  return (tableName, tuple(sorted(key.items())))
+
+
+def serialize(values):
+  """DynamoDB typed values of a dict, raises TypeError for a value DynamoDB can't store"""
+  serializer = TypeSerializer()
+  return {f: serializer.serialize(v) for f, v in values.items()}
+
+
+def updateRequest(key, values, remove, mustExist):
+  """update_item arguments for one coalesced update, attribute names go through placeholders
+
+  key and values are already serialized.
+  """
+  names = dict()
+  attributeValues = dict()
+  setClauses = list()
+  removeClauses = list()
+  for i, (name, value) in enumerate(values.items()):
+    names[f"#s{i}"] = name
+    attributeValues[f":s{i}"] = value
+    setClauses.append(f"#s{i}=:s{i}")
+  for i, name in enumerate(sorted(remove)):
+    names[f"#r{i}"] = name
+    removeClauses.append(f"#r{i}")
+
+  if mustExist:
+    names["#k"] = sorted(key.keys())[0]
+
+  expression = list()
+  if len(removeClauses) > 0:
+    expression.append("remove " + ", ".join(removeClauses))
+  if len(setClauses) > 0:
+    expression.append("set " + ", ".join(setClauses))
+  request = {
+    'Key': key,
+    'UpdateExpression': " ".join(expression),
+    'ExpressionAttributeNames': names
+  }
+  if len(attributeValues) > 0:
+    request['ExpressionAttributeValues'] = attributeValues
+  if mustExist:
+    request['ConditionExpression'] = "attribute_exists(#k)"
+  return request
+
+
+class ResultWriter:
+  """Coalesce a stage's DynamoDB writes and send them concurrently"""
+
+  def __init__(self, client, threads=THREADS, maxPending=MAX_PENDING):
+    self.client = client
+    self.threads = threads
+    self.maxPending = maxPending
+    self.updates = dict()
+    self.puts = dict()
+    self.backoff = Backoff()
+    self.lock = threading.Lock()
+    self.stats = {'items': 0, 'requests': 0, 'throttles': 0, 'skipped': 0, 'failed': 0, 'coalesced': 0, 'seconds': 0.0}
+
+  def __len__(self):
+    return len(self.updates) + len(self.puts)
+
+  def update(self, tableName, key, values, remove=(), mustExist=False):
+    """Queue an update of one item, merged with any update of it already queued"""
+    serializedKey = serialize(key)
+    serializedValues = serialize(values)
+    itemKey = keyOf(tableName, key)
+    pending = self.updates.get(itemKey)
+    if pending is None:
+      self.updates[itemKey] = {
+        'table': tableName, 'key': serializedKey, 'values': serializedValues,
+        'remove': set(remove) - set(values), 'mustExist': mustExist
+      }
+    else:
+      self.stats['coalesced'] += 1
+      pending['values'].update(serializedValues)
+      pending['remove'] = (pending['remove'] | set(remove)) - set(pending['values'])
+      pending['mustExist'] = pending['mustExist'] and mustExist
+    self.flushIfFull()
+
+  def put(self, tableName, item, keyNames):
+    """Queue a whole item, keyNames are the table's key attributes"""
+    serializedItem = serialize(item)
+    itemKey = keyOf(tableName, {f: item[f] for f in keyNames})
+    if itemKey in self.puts:
+      self.stats['coalesced'] += 1
+    self.puts[itemKey] = (tableName, serializedItem)
+    self.flushIfFull()
+
+  def flushIfFull(self):
+    if len(self) >= self.maxPending:
+      self.flush()
+
+  def count(self, name, value=1):
+    with self.lock:
+      self.stats[name] += value
+
+  def call(self, method, **request):
+    """Make one request, retrying it while throttled, returns the response or None if it was skipped"""
+    for attempt in range(MAX_ATTEMPTS):
+      self.backoff.wait()
+      self.count('requests')
+      try:
+        response = method(**request)
+      except ClientError as e:
+        code = e.response['Error']['Code']
+        if code in THROTTLE_CODES:
+          self.count('throttles')
+          self.backoff.throttled()
+          continue
+        if code == "ConditionalCheckFailedException":
+          return None
+        raise
+      self.backoff.succeeded()
+      return response
+    raise RuntimeError(f"Still throttled after {MAX_ATTEMPTS} attempts")
+
+  def writeUpdate(self, pending):
+    try:
+      request = updateRequest(pending['key'], pending['values'], pending['remove'], pending['mustExist'])
+      response = self.call(self.client.update_item, TableName=pending['table'], **request)
+    except Exception as e:
+      print(f"Failed to update {pending['table']} {pending['key']}: {e}")
+      self.count('failed')
+      return
+    self.count('items' if response is not None else 'skipped')
+
+  def writeBatch(self, tableName, items):
+    requests = [{'PutRequest': {'Item': f}} for f in items]
+    for attempt in range(MAX_ATTEMPTS):
+      try:
+        response = self.call(self.client.batch_write_item, RequestItems={tableName: requests})
+      except Exception as e:
+        print(f"Failed to write {len(requests)} items to {tableName}: {e}")
+        self.count('failed', len(requests))
+        return
+      unprocessed = response.get('UnprocessedItems', dict()).get(tableName, list())
+      self.count('items', len(requests) - len(unprocessed))
+      if len(unprocessed) == 0:
+        return
+      # Unprocessed items are the table throttling part of the batch
+      self.count('throttles')
+      self.backoff.throttled()
+      requests = unprocessed
+    print(f"Failed to write {len(requests)} items to {tableName} after {MAX_ATTEMPTS} attempts")
+    self.count('failed', len(requests))
+
+  def flush(self):
+    """Write everything queued, returns the writer's stats so far"""
+    updates = list(self.updates.values())
+    byTable = dict()
+    for tableName, item in self.puts.values():
+      byTable.setdefault(tableName, list()).append(item)
+    self.updates = dict()
+    self.puts = dict()
+
+    tasks = [(self.writeUpdate, f) for f in updates]
+    for tableName, items in byTable.items():
+      for i in range(0, len(items), BATCH_SIZE):
+        tasks.append((self.writeBatch, tableName, items[i:i + BATCH_SIZE]))
+    if len(tasks) > 0:
+      startTime = time.time()
+      with ThreadPoolExecutor(max_workers=max(1, min(self.threads, len(tasks)))) as executor:
+        list(executor.map(lambda task: task[0](*task[1:]), tasks))
+      self.stats['seconds'] += time.time() - startTime
+    return self.report()
+
+  def raiseOnFailures(self):
+    """Raise if any write has failed, call after the last flush"""
+    if self.stats['failed'] > 0:
+      raise RuntimeError(f"{self.stats['failed']} DynamoDB writes failed")
+
+  def report(self):
+    """The stats with the write rate, printed as well"""
+    stats = dict(self.stats)
+    stats['itemsPerSecond'] = stats['items'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    print(f"Wrote {stats['items']} items in {stats['seconds']:.1f}s ({stats['itemsPerSecond']:.0f} items/s), "
+          f"{stats['requests']} requests, {stats['throttles']} throttled, {stats['skipped']} skipped, "
+          f"{stats['failed']} failed, {stats['coalesced']} coalesced")
+    return stats
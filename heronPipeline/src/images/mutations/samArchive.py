@@ -0,0 +1,77 @@
+"""
+One SAM archive per iteration instead of one S3 object per sample.
+
+The archive is a multi-member gzip file, every member holding the complete
+SAM (header included) of one sample, so any single sample can be
+decompressed from its own byte range into a valid SAM. Only the members are
+valid SAM on their own: decompressing the whole archive repeats the @SQ/@PG
+header before every sample, which samtools rejects. The index maps each
+seqHash to the [offset, length] of its member:
+
+  {"archive": "<archive key>", "samples": {"<seqHash>": [offset, length]}}
+"""
+
+import gzip
+import json
+
+ARCHIVE_FOLDER = "samFiles"
+
+
+def archiveKeys(dateString, iterationUUID):
+  """S3 keys of the archive and its index for an iteration"""
+  prefix = f"{ARCHIVE_FOLDER}/{dateString}/{iterationUUID}"
+  return f"{prefix}.sam.gz", f"{prefix}.index.json"
+
+
+class SamArchiveWriter:
+  """Collect the SAM of every sample in an iteration and upload them as one archive"""
+
+  def __init__(self, compressionLevel=6):
+    self.data = bytearray()
+    self.samples = dict()
+    self.compressionLevel = compressionLevel
+
+  def add(self, seqHash, samText):
+    if seqHash in self.samples:
+      return
+    member = gzip.compress(samText.encode(), compresslevel=self.compressionLevel)
+    self.samples[seqHash] = [len(self.data), len(member)]
+    self.data += member
+
+  def __len__(self):
+    return len(self.samples)
+
+  def upload(self, s3, bucketName, archiveKey, indexKey):
+    """Write the archive before the index, so a reader that finds the index always finds the archive"""
+    s3.Object(bucketName, archiveKey).put(Body=bytes(self.data))
+    index = {'archive': archiveKey, 'samples': self.samples}
+    s3.Object(bucketName, indexKey).put(Body=json.dumps(index))
+
+
+class SamArchiveReader:
+  """Read single samples out of an iteration's SAM archive"""
+
+  def __init__(self, s3, bucketName, indexKey):
+    self.s3 = s3
+    self.bucketName = bucketName
+    index = json.loads(s3.Object(bucketName, indexKey).get()['Body'].read())
+    self.archiveKey = index['archive']
+    self.samples = index['samples']
+    self.data = None
+
+  def __contains__(self, seqHash):
+    return seqHash in self.samples
+
+  def fetchAll(self):
+    """Download the whole archive in one request, later reads are served from memory"""
+    self.data = self.s3.Object(self.bucketName, self.archiveKey).get()['Body'].read()
+
+  def read(self, seqHash):
+    """SAM text of one sample, range read from S3 unless the archive has been fetched"""
+    offset, length = self.samples[seqHash]
+    if self.data is not None:
+      member = self.data[offset:offset + length]
+    else:
+      byteRange = f"bytes={offset}-{offset + length - 1}"
+      member = self.s3.Object(self.bucketName, self.archiveKey).get(Range=byteRange)['Body'].read()
+    return gzip.decompress(member).decode()
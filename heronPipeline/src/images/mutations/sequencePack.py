@@ -0,0 +1,218 @@
+"""
+Packed store of consensus and aligned sequences, a few thousand per S3 object.
+
+Reading a sample's consensus JSON and its aligned object costs every stage
+one or two GETs per sample. A pack holds the records of many samples back to
+back in a single object that is written once and never modified, under
+sequencePacks/{date}/{packId}.pack, with an index of where each record lies:
+
+  {"pack": "<pack key>", "records": {"<seqHash>": [offset, length]}}
+
+A record is a small header followed by the seqHash, the consensus fasta and
+the aligned sequence as alignedSequence encodes it, which is empty when the
+sample hasn't been aligned:
+
+  magic "HSP" | consensus encoding (uint8) | seqHash length (uint16) | consensus length (uint32) | aligned length (uint32)
+
+The consensus is zlib compressed, or zstd if the writer asks for it and the
+zstandard package is installed. The encoding byte says which, so a reader
+only needs zstandard for packs that were written with it.
+
+goFastaAlignment writes one pack per iteration with the iterationUUID as its
+packId, so the stages after it find the iteration's pack without a lookup,
+and points each sequence's DynamoDB item at its record with
+
+  sequencePack = "<pack key>#<offset>#<length>"
+
+Sequences from earlier runs are read through those pointers, records of the
+same pack that lie close together are fetched with a single ranged GET.
+"""
+
+import zlib
+import json
+import struct
+import alignedSequence
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+PACK_FOLDER = "sequencePacks"
+POINTER_ATTRIBUTE = "sequencePack"
+MAGIC = b"HSP"
+HEADER = struct.Struct(">3sBHII")
+ENCODING_ZLIB = 1
+ENCODING_ZSTD = 2
+# Ranged reads of one pack are merged when the bytes between them are fewer than this
+MAX_GAP = 256 * 1024
+
+
+def packKeys(dateString, packId):
+  """S3 keys of a pack and its index"""
+  prefix = f"{PACK_FOLDER}/{dateString}/{packId}"
+  return f"{prefix}.pack", f"{prefix}.index.json"
+
+
+def pointer(packKey, offset, length):
+  return f"{packKey}#{offset}#{length}"
+
+
+def parsePointer(value):
+  """(pack key, offset, length) of a sequencePack pointer"""
+  packKey, offset, length = value.rsplit("#", 2)
+  return packKey, int(offset), int(length)
+
+
+def encodeRecord(seqHash, consensus, aligned=None, encoding=ENCODING_ZLIB):
+  if encoding == ENCODING_ZSTD:
+    consensusData = zstandard.ZstdCompressor().compress(consensus.encode())
+  else:
+    consensusData = zlib.compress(consensus.encode())
+  alignedData = alignedSequence.encode(aligned) if aligned is not None else b""
+  seqHashBytes = seqHash.encode()
+  header = HEADER.pack(MAGIC, encoding, len(seqHashBytes), len(consensusData), len(alignedData))
+  return header + seqHashBytes + consensusData + alignedData
+
+
+def decodeRecord(data):
+  """(seqHash, consensus fasta, aligned fasta or None) of a record"""
+  magic, encoding, seqHashLength, consensusLength, alignedLength = HEADER.unpack_from(data)
+  if magic != MAGIC:
+    raise ValueError("Not a sequence pack record")
+  offset = HEADER.size
+  seqHash = bytes(data[offset:offset + seqHashLength]).decode()
+  offset += seqHashLength
+  consensusData = bytes(data[offset:offset + consensusLength])
+  offset += consensusLength
+  if encoding == ENCODING_ZSTD:
+    consensus = zstandard.ZstdDecompressor().decompress(consensusData).decode()
+  else:
+    consensus = zlib.decompress(consensusData).decode()
+  aligned = alignedSequence.decode(bytes(data[offset:offset + alignedLength])) if alignedLength > 0 else None
+  return seqHash, consensus, aligned
+
+
+class PackWriter:
+  """Collect sequence records and upload them as one pack"""
+
+  def __init__(self, encoding=ENCODING_ZLIB):
+    if encoding == ENCODING_ZSTD and zstandard is None:
+      raise ValueError("zstd packs need the zstandard package")
+    self.data = bytearray()
+    self.records = dict()
+    self.encoding = encoding
+
+  def add(self, seqHash, consensus, aligned=None):
+    if seqHash in self.records:
+      return
+    record = encodeRecord(seqHash, consensus, aligned, self.encoding)
+    self.records[seqHash] = [len(self.data), len(record)]
+    self.data += record
+
+  def __len__(self):
+    return len(self.records)
+
+  def pointers(self, packKey):
+    """The sequencePack pointer of every record, once uploaded to packKey"""
+    return {f: pointer(packKey, offset, length) for f, (offset, length) in self.records.items()}
+
+  def upload(self, s3, bucketName, packKey, indexKey):
+    """Write the pack before the index, so a reader that finds the index always finds the pack"""
+    s3.Object(bucketName, packKey).put(Body=bytes(self.data))
+    index = {'pack': packKey, 'records': self.records}
+    s3.Object(bucketName, indexKey).put(Body=json.dumps(index))
+
+
+class PackReader:
+  """Read records out of one pack through its index"""
+
+  def __init__(self, s3, bucketName, indexKey):
+    self.s3 = s3
+    self.bucketName = bucketName
+    index = json.loads(s3.Object(bucketName, indexKey).get()['Body'].read())
+    self.packKey = index['pack']
+    self.records = index['records']
+    self.data = None
+
+  def __contains__(self, seqHash):
+    return seqHash in self.records
+
+  def fetchAll(self):
+    """Download the whole pack in one request, later reads are served from memory"""
+    self.data = self.s3.Object(self.bucketName, self.packKey).get()['Body'].read()
+
+  def read(self, seqHash):
+    """(consensus, aligned) of one sequence, range read from S3 unless the pack has been fetched"""
+    offset, length = self.records[seqHash]
+    if self.data is not None:
+      record = memoryview(self.data)[offset:offset + length]
+    else:
+      byteRange = f"bytes={offset}-{offset + length - 1}"
+      record = self.s3.Object(self.bucketName, self.packKey).get(Range=byteRange)['Body'].read()
+    return decodeRecord(record)[1:]
+
+
+def coalesce(ranges, maxGap=MAX_GAP):
+  """Merge sorted (offset, length, seqHash) ranges into runs of [start, end, members]"""
+  runs = list()
+  for offset, length, seqHash in sorted(ranges):
+    if len(runs) > 0 and offset - runs[-1][1] <= maxGap:
+      runs[-1][1] = max(runs[-1][1], offset + length)
+      runs[-1][2].append((offset, length, seqHash))
+    else:
+      runs.append([offset, offset + length, [(offset, length, seqHash)]])
+  return runs
+
+
+def readPointers(s3, bucketName, pointers, maxGap=MAX_GAP):
+  """Read the records of a {seqHash: sequencePack pointer} dict
+
+  Returns {seqHash: (consensus, aligned)} and the bytes fetched.
+  """
+  byPack = dict()
+  for seqHash, value in pointers.items():
+    packKey, offset, length = parsePointer(value)
+    byPack.setdefault(packKey, list()).append((offset, length, seqHash))
+
+  records = dict()
+  bytesRead = 0
+  for packKey, ranges in byPack.items():
+    for start, end, members in coalesce(ranges, maxGap):
+      data = s3.Object(bucketName, packKey).get(Range=f"bytes={start}-{end - 1}")['Body'].read()
+      bytesRead += len(data)
+      view = memoryview(data)
+      for offset, length, seqHash in members:
+        records[seqHash] = decodeRecord(view[offset - start:offset - start + length])[1:]
+  return records, bytesRead
+
+
+def readBatch(s3, bucketName, dateString, iterationUUID, messages):
+  """Read the records of an iteration's messages from the packs
+
+  The iteration's own pack is fetched whole when it exists, anything not in
+  it is read through the messages' sequencePack pointers. Sequences found in
+  neither are left out, callers fall back to the sample JSON for those.
+  Returns {seqHash: (consensus, aligned)} and the bytes fetched.
+  """
+  records = dict()
+  bytesRead = 0
+  packKey, indexKey = packKeys(dateString, iterationUUID)
+  try:
+    reader = PackReader(s3, bucketName, indexKey)
+  except s3.meta.client.exceptions.NoSuchKey:
+    reader = None
+  if reader is not None and any([f['seqHash'] in reader for f in messages]):
+    reader.fetchAll()
+    bytesRead += len(reader.data)
+    for message in messages:
+      if message['seqHash'] in reader:
+        records[message['seqHash']] = reader.read(message['seqHash'])
+
+  pointers = {
+    f['seqHash']: f[POINTER_ATTRIBUTE] for f in messages
+    if f['seqHash'] not in records and f.get(POINTER_ATTRIBUTE)
+  }
+  pointerRecords, pointerBytes = readPointers(s3, bucketName, pointers)
+  records.update(pointerRecords)
+  return records, bytesRead + pointerBytes
@@ -0,0 +1,91 @@
+"""
+One pangolin-data install per pipeline execution, shared on EFS.
+
+updatePangoData.py runs once before the sample batches are processed. It
+installs the latest pangolin-data into a versioned directory on EFS:
+
+  {SEQ_DATA_ROOT}/pangolinData/{version}/
+  {SEQ_DATA_ROOT}/pangolinData/current.json   {"version", "datadir", "date"}
+
+runPango.py then points pangolin at the current install with --datadir and
+only reads from it, instead of every batch container updating its own copy.
+The install lives outside the date partitions, so cleanEfs leaves it for the
+next day's run.
+"""
+
+import os
+import re
+import json
+import shutil
+
+PANGO_DATA_FOLDER = "pangolinData"
+CURRENT_FILENAME = "current.json"
+# Installs kept on EFS, older ones are removed once a newer one is current
+KEEP_VERSIONS = 3
+
+
+def dataRoot(sampleDataRoot):
+  return f"{sampleDataRoot}/{PANGO_DATA_FOLDER}"
+
+
+def readVersion(datadir):
+  """pangolin-data version of an install, None if it isn't one"""
+  initFile = os.path.join(datadir, "pangolin_data", "__init__.py")
+  if not os.path.isfile(initFile):
+    return None
+  with open(initFile) as file:
+    match = re.search(r"__version__\s*=\s*['\"]([^'\"]+)['\"]", file.read())
+  return match.group(1) if match is not None else None
+
+
+def readCurrent(sampleDataRoot):
+  """The current install's record, None if there isn't a usable one"""
+  currentFile = os.path.join(dataRoot(sampleDataRoot), CURRENT_FILENAME)
+  if not os.path.isfile(currentFile):
+    return None
+  with open(currentFile) as file:
+    current = json.load(file)
+  if readVersion(current['datadir']) != current['version']:
+    return None
+  return current
+
+
+def install(stagingDir, sampleDataRoot, dateString):
+  """Move a fresh install into its version's directory and make it current
+
+  An install of a version that is already on EFS is discarded, the existing
+  directory is never modified while batch containers may be reading it.
+  Returns the new current record.
+  """
+  version = readVersion(stagingDir)
+  if version is None:
+    raise ValueError(f"No pangolin-data install in {stagingDir}")
+  datadir = os.path.join(dataRoot(sampleDataRoot), version)
+  if os.path.isdir(datadir) and readVersion(datadir) == version:
+    shutil.rmtree(stagingDir, ignore_errors=True)
+  else:
+    shutil.rmtree(datadir, ignore_errors=True)
+    os.rename(stagingDir, datadir)
+
+  current = {'version': version, 'datadir': datadir, 'date': dateString}
+  currentFile = os.path.join(dataRoot(sampleDataRoot), CURRENT_FILENAME)
+  # Replace the record in one step so readers never see a partial file
+  with open(f"{currentFile}.tmp", "w") as file:
+    json.dump(current, file)
+  os.replace(f"{currentFile}.tmp", currentFile)
+  return current
+
+
+def prune(sampleDataRoot, keep=KEEP_VERSIONS):
+  """Remove all but the newest installs, never the current one"""
+  root = dataRoot(sampleDataRoot)
+  current = readCurrent(sampleDataRoot)
+  installs = [
+    os.path.join(root, f) for f in os.listdir(root)
+    if os.path.isdir(os.path.join(root, f)) and not f.startswith("staging_")
+  ]
+  installs.sort(key=os.path.getmtime, reverse=True)
+  for datadir in installs[keep:]:
+    if current is None or datadir != current['datadir']:
+      print(f"Removing pangolin-data install: {datadir}")
+      shutil.rmtree(datadir, ignore_errors=True)
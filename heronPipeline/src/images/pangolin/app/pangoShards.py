@@ -0,0 +1,162 @@
+"""
+Run pangolin over an iteration's fasta in concurrent shards.
+
+A single pangolin run over the whole batch leaves most of the container's
+cores idle. The batch fasta is split into contiguous shards, one pangolin
+process per shard with a few threads each, and their reports are merged into
+one CSV in input order. A shard that fails is run once more, then every
+input taxon is checked against the merged report so a lost shard can't go
+unnoticed.
+"""
+
+import os
+import csv
+import time
+import math
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Fewer sequences than this per shard isn't worth another pangolin start up
+MIN_SHARD_SEQUENCES = 50
+
+
+def availableCores():
+  """Number of cores this container may actually use, honouring the cgroup CPU quota"""
+  try:
+    cores = len(os.sched_getaffinity(0))
+  except AttributeError:
+    cores = os.cpu_count() or 1
+
+  quota = None
+  try:
+    # cgroup v2
+    with open("/sys/fs/cgroup/cpu.max") as file:
+      limit, period = file.read().split()
+      if limit != "max":
+        quota = int(limit) / int(period)
+  except (OSError, ValueError):
+    try:
+      # cgroup v1
+      with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as file:
+        limit = int(file.read())
+      with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as file:
+        period = int(file.read())
+      if limit > 0:
+        quota = limit / period
+    except (OSError, ValueError):
+      pass
+
+  if quota is not None:
+    cores = min(cores, max(1, int(quota)))
+  return max(1, cores)
+
+
+def readRecords(fastaFilename):
+  """(taxon, record text) of every record in a fasta file"""
+  records = list()
+  with open(fastaFilename) as fastaFile:
+    for line in fastaFile:
+      if line.startswith(">"):
+        records.append([line[1:].strip(), line])
+      elif len(records) > 0:
+        records[-1][1] += line
+  return [tuple(f) for f in records]
+
+
+def shardCount(sequenceCount, cores, threadsPerShard):
+  """As many shards as the cores allow, but none smaller than MIN_SHARD_SEQUENCES"""
+  byCores = max(1, cores // threadsPerShard)
+  bySize = max(1, math.ceil(sequenceCount / MIN_SHARD_SEQUENCES))
+  return min(byCores, bySize)
+
+
+def splitFasta(fastaFilename, shardDir, cores, threadsPerShard):
+  """Write contiguous shards of the fasta, returns [(shard fasta, taxa)]"""
+  records = readRecords(fastaFilename)
+  if len(records) == 0:
+    return list()
+  shards = shardCount(len(records), cores, threadsPerShard)
+  size = math.ceil(len(records) / shards)
+  result = list()
+  for i in range(0, len(records), size):
+    shardFilename = os.path.join(shardDir, f"shard_{len(result)}.fasta")
+    with open(shardFilename, "w") as shardFile:
+      shardFile.writelines([f[1] for f in records[i:i + size]])
+    result.append((shardFilename, [f[0] for f in records[i:i + size]]))
+  return result
+
+
+def runShard(command, shardFilename, outputFilename, logFilename):
+  """Run one shard's pangolin, returns (succeeded, seconds)"""
+  startTime = time.time()
+  with open(logFilename, "w") as logFile:
+    process = subprocess.run(command, stdout=logFile, stderr=subprocess.STDOUT)
+  succeeded = process.returncode == 0 and os.path.isfile(outputFilename)
+  if not succeeded:
+    with open(logFilename) as logFile:
+      print(f"Shard {shardFilename} failed with exit code {process.returncode}: {logFile.read()[-2000:]}")
+  return succeeded, time.time() - startTime
+
+
+def runShards(shards, buildCommand, shardDir, retries=1):
+  """Run every shard concurrently, retrying failed ones
+
+  buildCommand(shardFasta, outputCsv, shardTmpDir) returns a shard's command.
+  Returns the CSVs of the shards that succeeded, in shard order, and the
+  timing of every run.
+  """
+  def run(index):
+    shardFilename = shards[index][0]
+    outputFilename = os.path.join(shardDir, f"shard_{index}.csv")
+    shardTmpDir = os.path.join(shardDir, f"tmp_{index}")
+    os.makedirs(shardTmpDir, exist_ok=True)
+    succeeded, seconds = runShard(
+      buildCommand(shardFilename, outputFilename, shardTmpDir),
+      shardFilename, outputFilename, os.path.join(shardDir, f"shard_{index}.log")
+    )
+    print(f"Shard {index}: {len(shards[index][1])} sequences in {seconds:.1f}s")
+    return index, outputFilename if succeeded else None, seconds
+
+  outputs = dict()
+  timings = list()
+  pending = list(range(len(shards)))
+  for attempt in range(retries + 1):
+    with ThreadPoolExecutor(max_workers=max(1, len(pending))) as executor:
+      results = list(executor.map(run, pending))
+    for index, outputFilename, seconds in results:
+      timings.append({'shard': index, 'sequences': len(shards[index][1]), 'seconds': seconds, 'attempt': attempt})
+      if outputFilename is not None:
+        outputs[index] = outputFilename
+    pending = [f for f in pending if f not in outputs]
+    if len(pending) == 0:
+      break
+  return [outputs[f] for f in sorted(outputs)], timings
+
+
+def mergeReports(reports, outputFilename):
+  """Concatenate the shards' CSVs under one header, returns the taxa reported"""
+  taxa = set()
+  header = None
+  with open(outputFilename, "w", newline="") as outputFile:
+    writer = csv.writer(outputFile)
+    for report in reports:
+      with open(report, newline="") as reportFile:
+        reader = csv.reader(reportFile)
+        rows = iter(reader)
+        shardHeader = next(rows, None)
+        if shardHeader is None:
+          continue
+        if header is None:
+          header = shardHeader
+          writer.writerow(header)
+        taxonColumn = shardHeader.index("taxon")
+        for row in rows:
+          # The shards come from one pangolin install, but map by name in case of reordering
+          writer.writerow(row if shardHeader == header else [row[shardHeader.index(f)] for f in header])
+          taxa.add(row[taxonColumn])
+  return taxa
+
+
+def missingTaxa(shards, reportedTaxa):
+  """Input taxa that are not in the merged report"""
+  return [f for shard in shards for f in shard[1] if f not in reportedTaxa]
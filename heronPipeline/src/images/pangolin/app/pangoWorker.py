@@ -0,0 +1,57 @@
+import os
+import runpy
+import subprocess
+import boto3
+import pangoData
+import warmWorker
+
+##############################################
+# Step 1. Get Env Vars
+##############################################
+dateString = os.getenv('DATE_PARTITION')
+bucketName = os.getenv('HERON_SAMPLES_BUCKET')
+sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
+# Stop once nothing has become ready or finished for this long
+idleSeconds = int(os.getenv('WORKER_IDLE_SECONDS', '900'))
+# How long to wait for the first iteration to become ready
+startupSeconds = int(os.getenv('WORKER_STARTUP_SECONDS', '7200'))
+
+sampleDataRootSeqBatchesDir = f"{sampleDataRoot}/{dateString}/seqBatchFiles"
+runPangoScript = os.path.join(os.path.dirname(os.path.realpath(__file__)), "runPango.py")
+
+s3 = boto3.resource('s3', region_name='eu-west-1')
+iterations = warmWorker.readIterations(s3, bucketName, dateString)
+print(f"Pangolin worker for {len(iterations)} iterations")
+
+##############################################
+# Step 2. Set up pangolin once for every iteration
+#         this worker processes
+##############################################
+if pangoData.readCurrent(sampleDataRoot) is None:
+  command = ["pangolin", "--update-data"]
+  print(f"Running Command: {command}")
+  try:
+    subprocess.run(command, check=True)
+  except subprocess.CalledProcessError as e:
+    print(f"Update Data error: {e}")
+  # runPango.py uses this container's copy without updating it again
+  os.environ['PANGO_DATA_UPDATED'] = "true"
+
+##############################################
+# Step 3. Run runPango.py in this process for each
+#         iteration as it becomes ready
+##############################################
+def processIteration(iterationUUID):
+  os.environ['ITERATION_UUID'] = iterationUUID
+  runpy.run_path(runPangoScript, run_name="__main__")
+
+processed = warmWorker.run(
+  "pangolin",
+  iterations,
+  f"{sampleDataRoot}/{dateString}/{warmWorker.WORK_FOLDER}",
+  lambda iterationUUID: os.path.isfile(warmWorker.readyFile(sampleDataRootSeqBatchesDir, iterationUUID)),
+  processIteration,
+  idleSeconds=idleSeconds,
+  startupSeconds=startupSeconds
+)
+print(f"Pangolin worker processed {processed} iterations")
@@ -1,5 +1,7 @@
 import os
+import tempfile
 import subprocess
+import time
 import sys
 import shutil
 import pandas as pd
@@ -11,6 +13,11 @@ from decimal import Decimal
 # from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import tracing
+import sequenceDedup
+import pangoData
+import pangoShards
+import resultWriter
 
 config = Config(
    retries = {
@@ -29,6 +36,9 @@ sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
 iterationUUID = os.getenv('ITERATION_UUID')
 bucketName = os.getenv('HERON_SAMPLES_BUCKET')
 heronSequencesTableName = os.getenv("HERON_SEQUENCES_TABLE")
+tmpDir = tempfile.gettempdir()
+# Threads given to each concurrent pangolin shard, the shard count follows from the cores
+threadsPerShard = int(os.getenv('PANGO_THREADS_PER_SHARD', '2'))
 
 
 ##############################################
@@ -39,6 +49,9 @@ s3 = boto3.resource('s3', region_name='eu-west-1')
 bucket = s3.Bucket(bucketName)
 dynamodb = boto3.resource('dynamodb', region_name="eu-west-1", config=config)
 sequencesTable = dynamodb.Table(heronSequencesTableName)
+# The calls are written in bulk once the report has been read
+writer = resultWriter.ResultWriter(boto3.client('dynamodb', region_name="eu-west-1", config=resultWriter.CONFIG))
+writeStats = None
 
 ##############################################
 ###### Create the input file paths ###########
@@ -47,42 +60,76 @@ sampleDataRootSeqBatchesDir = f"{sampleDataRoot}/{dateString}/seqBatchFiles"
 seqFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.fasta"
 seqConsensusFile = f"{sampleDataRootSeqBatchesDir}/sequences_consensus{iterationUUID}.fasta"
 keyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
+# Sequences identical to one in the batch get its call
+duplicates = sequenceDedup.loadDuplicates(sequenceDedup.duplicatesFile(sampleDataRootSeqBatchesDir, iterationUUID))
 
 print(f"Processing seqBatchFile: {seqConsensusFile}")
+span = tracing.Span("pangolin", iterationUUID)
+updateDataSeconds = 0
+pangoDataInstall = None
+shardTimings = list()
+missingTaxa = list()
 
 if os.path.isfile(seqFile) == True:
-
-  print(f"Update Pangolin Data")
-  command = ["pangolin", "--update-data"]
-  print(f"Processing seqBatchFile: {seqConsensusFile}")
-  try:
-    subprocess.run(command, check=True)
-  except subprocess.CalledProcessError as e:
-    print(f"Update Data error: {e}")
-  print(f"Completed pangolin data update")
-
-  print("Print pango versions")
-  command = ["pangolin", "--all-versions"]
-  try:
-    subprocess.run(command, check=True)
-  except subprocess.CalledProcessError as e:
-    print(f"Print versions error: {e}")
-
-
-  command = ["pangolin", "--analysis-mode", "accurate", seqFile, "--outfile", "/tmp/outputAccurate.csv"]
-  print(f"Running Command: {command}")
-  try:
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-  except subprocess.CalledProcessError as e:
-    print(f"Accurate mode error: {e}")
+  span.read(seqFile)
+
+  # Use the pangolin-data installed on EFS for this run by updatePangoData.py,
+  # only update the container's own copy when there isn't one
+  pangoDataInstall = pangoData.readCurrent(sampleDataRoot)
+  if pangoDataInstall is not None:
+    print(f"Using pangolin-data {pangoDataInstall['version']} from {pangoDataInstall['datadir']}")
+    dataDirArgs = ["--datadir", pangoDataInstall['datadir']]
+  elif os.getenv('PANGO_DATA_UPDATED') == "true":
+    # pangoWorker.py has already updated this container's copy
+    dataDirArgs = list()
+  else:
+    print(f"Update Pangolin Data")
+    command = ["pangolin", "--update-data"]
+    print(f"Processing seqBatchFile: {seqConsensusFile}")
+    updateStartTime = time.time()
+    try:
+      subprocess.run(command, check=True)
+    except subprocess.CalledProcessError as e:
+      print(f"Update Data error: {e}")
+    updateDataSeconds = time.time() - updateStartTime
+    print(f"Completed pangolin data update")
+
+    print("Print pango versions")
+    command = ["pangolin", "--all-versions"]
+    try:
+      subprocess.run(command, check=True)
+    except subprocess.CalledProcessError as e:
+      print(f"Print versions error: {e}")
+    dataDirArgs = list()
+
+
+  # Split the batch into shards sized to the container's cores and run them concurrently
+  shardDir = tempfile.mkdtemp(prefix="pangoShards_", dir=tmpDir)
+  cores = pangoShards.availableCores()
+  shards = pangoShards.splitFasta(seqFile, shardDir, cores, threadsPerShard)
+  print(f"Running {len(shards)} pangolin shards with {threadsPerShard} threads each on {cores} cores")
+  buildCommand = lambda shardFasta, outputCsv, shardTmpDir: [
+    "pangolin", "--analysis-mode", "accurate", shardFasta, "--outfile", outputCsv,
+    "--threads", str(threadsPerShard), "--tempdir", shardTmpDir
+  ] + dataDirArgs
+  print(f"Running Command: {buildCommand('<shard>', '<output>', '<tmp>')}")
+  reports, shardTimings = pangoShards.runShards(shards, buildCommand, shardDir)
+  reportedTaxa = pangoShards.mergeReports(reports, f"{tmpDir}/outputAccurate.csv")
+  missingTaxa = pangoShards.missingTaxa(shards, reportedTaxa)
+  if len(missingTaxa) > 0:
+    # Left without a pangoCallDate, so the next run picks them up again
+    print(f"{len(missingTaxa)} sequences missing from the pangolin report: {missingTaxa[:20]}")
+  shutil.rmtree(shardDir, ignore_errors=True)
   print(f"Completed running in accurate mode")
 
-  accurateModeDf = pd.read_csv("/tmp/outputAccurate.csv")
+  accurateModeDf = pd.read_csv(f"{tmpDir}/outputAccurate.csv")
 
   accurateModeDf['taxon'] = [f">{f}" for f in accurateModeDf['taxon']]
   keyFileDf = pd.read_json(keyFile, orient="records")
 
   accurateModeJoinedDf = pd.merge(accurateModeDf, keyFileDf, left_on="taxon", right_on="seqId", how="inner")
+  span.sampleCount = len(accurateModeJoinedDf)
+  span.wrote(f"{tmpDir}/outputAccurate.csv")
 
   callDate = int(datetime.now().timestamp())
   updateCount = 0
@@ -122,38 +169,41 @@ if os.path.isfile(seqFile) == True:
       scorpioCall = "N/A"
     
 
-    updateExpression = "remove armadillinCallDate, armadillinLineage, pangoLearnVersion, pangoUsherCallDate, pangoUsherLineage, pangoVersion, version set pangoCallDate=:pangoCallDate, pangoLineage=:pangoLineage, pangoConflict=:pangoConflict, pangoAmbiguityScore=:pangoAmbiguityScore, scorpioCall=:scorpioCall, scorpioSupport=:scorpioSupport, scorpioConflict=:scorpioConflict, scorpioNote=:scorpioNote, pangoSoftwareVersion=:pangoSoftwareVersion, pangolinVersion=:pangolinVersion, scorpioVersion=:scorpioVersion, constellationVersion=:constellationVersion, isDesignated=:isDesignated, pangoQcStatus=:qcStatus, pangoQcNotes=:qcNotes, pangoNote=:pangoNote" 
+    removeAttributes = ["armadillinCallDate", "armadillinLineage", "pangoLearnVersion", "pangoUsherCallDate", "pangoUsherLineage", "pangoVersion", "version"]
     
-    seqKey = {'seqHash': seqHash}
-
     pangolinPayload = {
-              ':pangoCallDate': callDate,
-              ':pangoLineage': lineage,
-              ':pangoConflict': conflict,
-              ':pangoAmbiguityScore': ambiguityScore,
-              ':scorpioCall': scorpioCall,
-              ':scorpioSupport': scorpioSupport,
-              ':scorpioConflict': scorpioConflict,
-              ':scorpioNote': scorpioNote,
-              ':pangoSoftwareVersion': version,
-              ':pangolinVersion': pangolinVersion,
-              ':scorpioVersion': scorpioVersion,
-              ':constellationVersion': constellationVersion,
-              ':isDesignated': isDesignated,
-              ':qcStatus': qcStatus,
-              ':qcNotes': qcNotes,
-              ':pangoNote': note
+              'pangoCallDate': callDate,
+              'pangoLineage': lineage,
+              'pangoConflict': conflict,
+              'pangoAmbiguityScore': ambiguityScore,
+              'scorpioCall': scorpioCall,
+              'scorpioSupport': scorpioSupport,
+              'scorpioConflict': scorpioConflict,
+              'scorpioNote': scorpioNote,
+              'pangoSoftwareVersion': version,
+              'pangolinVersion': pangolinVersion,
+              'scorpioVersion': scorpioVersion,
+              'constellationVersion': constellationVersion,
+              'isDesignated': isDesignated,
+              'pangoQcStatus': qcStatus,
+              'pangoQcNotes': qcNotes,
+              'pangoNote': note
             }
 
 
     seqId = row['seqId']
-    sequencesTable = dynamodb.Table(heronSequencesTableName)
-    ret = sequencesTable.update_item(
-            Key=seqKey,
-            UpdateExpression=updateExpression,
-            ExpressionAttributeValues=pangolinPayload
-          )
-    updateCount += 1
-
-
-  print(f"Updated {updateCount} out of {len(accurateModeJoinedDf)}")
\ No newline at end of file
+    for targetHash in sequenceDedup.targets(duplicates, seqHash):
+      writer.update(heronSequencesTableName, {'seqHash': targetHash}, pangolinPayload, remove=removeAttributes)
+      updateCount += 1
+
+  writeStats = writer.flush()
+  print(f"Updated {writeStats['items']} out of {updateCount}")
+
+span.finish(
+  updateDataSeconds=updateDataSeconds,
+  pangolinDataVersion=pangoDataInstall['version'] if pangoDataInstall is not None else None,
+  shards=shardTimings,
+  missingTaxa=len(missingTaxa),
+  writes=writeStats
+)
+writer.raiseOnFailures()
@@ -0,0 +1,87 @@
+"""
+Unit test pangoShards.py with a stand-in for pangolin
+"""
+
+
+import unittest
+import tempfile
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import pangoShards
+
+
+# Writes a pangolin style report for a fasta, failing the first time it sees a fasta named in FAIL_ONCE
+FAKE_PANGOLIN = """
+import os, sys
+fasta, outputCsv, marker = sys.argv[1], sys.argv[2], sys.argv[3]
+if os.path.basename(fasta) == os.environ.get("FAIL_ONCE") and not os.path.exists(marker):
+    open(marker, "w").close()
+    sys.exit(1)
+with open(fasta) as fastaFile, open(outputCsv, "w") as csvFile:
+    csvFile.write("taxon,lineage\\n")
+    for line in fastaFile:
+        if line.startswith(">"):
+            csvFile.write(line[1:].strip() + ",B.1\\n")
+"""
+
+
+class TestPangoShards(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.fasta = os.path.join(self.tmpDir.name, "batch.fasta")
+        with open(self.fasta, "w") as fastaFile:
+            for i in range(120):
+                fastaFile.write(f">sample{i}\nACGT\nACGT\n")
+        self.script = os.path.join(self.tmpDir.name, "fakePangolin.py")
+        with open(self.script, "w") as scriptFile:
+            scriptFile.write(FAKE_PANGOLIN)
+
+    def tearDown(self):
+        os.environ.pop("FAIL_ONCE", None)
+        self.tmpDir.cleanup()
+
+    def buildCommand(self, shardFasta, outputCsv, shardTmpDir):
+        return [sys.executable, self.script, shardFasta, outputCsv, os.path.join(shardTmpDir, "failed")]
+
+    def test_shards_follow_cores_and_minimum_size(self):
+        self.assertEqual(pangoShards.shardCount(2000, 16, 2), 8)
+        self.assertEqual(pangoShards.shardCount(120, 16, 2), 3)
+        self.assertEqual(pangoShards.shardCount(10, 16, 2), 1)
+        self.assertEqual(pangoShards.shardCount(2000, 1, 2), 1)
+
+    def test_split_keeps_every_record_in_order(self):
+        shards = pangoShards.splitFasta(self.fasta, self.tmpDir.name, 16, 2)
+        self.assertEqual(len(shards), 3)
+        self.assertEqual([f for shard in shards for f in shard[1]], [f"sample{i}" for i in range(120)])
+        self.assertEqual(len(pangoShards.readRecords(shards[0][0])), 40)
+
+    def test_failed_shard_is_retried_and_reports_merged(self):
+        os.environ["FAIL_ONCE"] = "shard_1.fasta"
+        shards = pangoShards.splitFasta(self.fasta, self.tmpDir.name, 16, 2)
+        reports, timings = pangoShards.runShards(shards, self.buildCommand, self.tmpDir.name)
+        self.assertEqual(len(reports), 3)
+        self.assertEqual(len(timings), 4)
+
+        output = os.path.join(self.tmpDir.name, "merged.csv")
+        taxa = pangoShards.mergeReports(reports, output)
+        self.assertEqual(pangoShards.missingTaxa(shards, taxa), [])
+        with open(output) as outputFile:
+            lines = outputFile.read().splitlines()
+        self.assertEqual(lines[0], "taxon,lineage")
+        self.assertEqual(lines[1:], [f"sample{i},B.1" for i in range(120)])
+
+    def test_missing_taxa_are_reported(self):
+        shards = pangoShards.splitFasta(self.fasta, self.tmpDir.name, 16, 2)
+        reports, timings = pangoShards.runShards(shards, self.buildCommand, self.tmpDir.name)
+        taxa = pangoShards.mergeReports(reports[1:], os.path.join(self.tmpDir.name, "merged.csv"))
+        self.assertEqual(pangoShards.missingTaxa(shards, taxa), [f"sample{i}" for i in range(40)])
+
+
+if __name__ == '__main__':
+    unittest.main()
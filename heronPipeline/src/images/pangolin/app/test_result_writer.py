@@ -0,0 +1,145 @@
+"""
+Unit test resultWriter.py against an in-memory stand-in for the DynamoDB client
+"""
+
+
+import unittest
+import threading
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+from botocore.exceptions import ClientError
+import resultWriter
+
+
+class FakeClient:
+  """Records requests, throttling the first `throttle` of them and leaving `unprocessed` batch items"""
+
+  def __init__(self, throttle=0, unprocessed=0, existing=()):
+    self.throttle = throttle
+    self.unprocessed = unprocessed
+    self.existing = set(existing)
+    self.updates = list()
+    self.batches = list()
+    self.lock = threading.Lock()
+
+  def throttled(self, operation):
+    with self.lock:
+      if self.throttle > 0:
+        self.throttle -= 1
+        raise ClientError({'Error': {'Code': "ProvisionedThroughputExceededException", 'Message': ""}}, operation)
+
+  def update_item(self, **request):
+    self.throttled("UpdateItem")
+    if 'ConditionExpression' in request and request['Key']['seqHash']['S'] not in self.existing:
+      raise ClientError({'Error': {'Code': "ConditionalCheckFailedException", 'Message': ""}}, "UpdateItem")
+    with self.lock:
+      self.updates.append(request)
+    return dict()
+
+  def batch_write_item(self, RequestItems):
+    self.throttled("BatchWriteItem")
+    tableName, requests = list(RequestItems.items())[0]
+    with self.lock:
+      keep = min(self.unprocessed, len(requests))
+      self.unprocessed -= keep
+      self.batches.append(requests[keep:])
+    if keep > 0:
+      return {'UnprocessedItems': {tableName: requests[:keep]}}
+    return {'UnprocessedItems': dict()}
+
+
+class TestResultWriter(unittest.TestCase):
+
+  def writer(self, client, threads=resultWriter.THREADS):
+    writer = resultWriter.ResultWriter(client, threads=threads)
+    writer.backoff = resultWriter.Backoff(0.001, 0.01)
+    return writer
+
+  def test_updates_are_coalesced_per_item(self):
+    client = FakeClient()
+    writer = self.writer(client)
+    writer.update("sequences", {'seqHash': "a"}, {'lineage': "B.1"}, remove=["armadillinLineage"])
+    writer.update("sequences", {'seqHash': "a"}, {'lineage': "B.1.1", 'callDate': 1})
+    writer.update("sequences", {'seqHash': "b"}, {'lineage': "A"})
+    stats = writer.flush()
+
+    self.assertEqual(stats['items'], 2)
+    self.assertEqual(stats['coalesced'], 1)
+    self.assertEqual(len(client.updates), 2)
+    request = [f for f in client.updates if f['Key']['seqHash']['S'] == "a"][0]
+    values = {request['ExpressionAttributeNames'][f.split("=")[0]]: request['ExpressionAttributeValues'][f.split("=")[1]]
+              for f in request['UpdateExpression'].split("set ")[1].split(", ")}
+    self.assertEqual(values, {'lineage': {'S': "B.1.1"}, 'callDate': {'N': "1"}})
+    self.assertTrue(request['UpdateExpression'].startswith("remove #r0 set"))
+
+  def test_must_exist_skips_missing_items(self):
+    client = FakeClient(existing=["a"])
+    writer = self.writer(client)
+    writer.update("sequences", {'seqHash': "a"}, {'x': 1}, mustExist=True)
+    writer.update("sequences", {'seqHash': "b"}, {'x': 1}, mustExist=True)
+    stats = writer.flush()
+
+    self.assertEqual(stats['items'], 1)
+    self.assertEqual(stats['skipped'], 1)
+
+  def test_throttled_requests_are_retried(self):
+    client = FakeClient(throttle=3)
+    writer = self.writer(client, threads=4)
+    for i in range(20):
+      writer.update("sequences", {'seqHash': str(i)}, {'x': i})
+    stats = writer.flush()
+
+    self.assertEqual(stats['items'], 20)
+    self.assertEqual(stats['throttles'], 3)
+    self.assertEqual(stats['failed'], 0)
+    self.assertEqual(len(client.updates), 20)
+
+  def test_puts_are_batched_and_unprocessed_items_retried(self):
+    client = FakeClient(unprocessed=5)
+    writer = self.writer(client)
+    for i in range(60):
+      writer.put("mutations", {'mutationId': str(i % 55), 'pos': i}, ['mutationId'])
+    stats = writer.flush()
+
+    written = [f['PutRequest']['Item'] for batch in client.batches for f in batch]
+    self.assertEqual(stats['items'], 55)
+    self.assertEqual(stats['coalesced'], 5)
+    self.assertEqual(len(written), 55)
+    self.assertTrue(all([len(f) <= resultWriter.BATCH_SIZE for f in client.batches]))
+    self.assertEqual({f['mutationId']['S']: f['pos']['N'] for f in written}['0'], "55")
+
+  def test_unserializable_value_raises_when_queued(self):
+    client = FakeClient()
+    writer = self.writer(client)
+    writer.update("sequences", {'seqHash': "a"}, {'x': 1})
+    with self.assertRaises(TypeError):
+      writer.put("mutations", {'mutationId': "m", 'pos': 1.5}, ['mutationId'])
+    with self.assertRaises(TypeError):
+      writer.update("sequences", {'seqHash': "a"}, {'x': 2.5})
+    stats = writer.flush()
+
+    self.assertEqual(stats['items'], 1)
+    self.assertEqual(stats['failed'], 0)
+    self.assertEqual(client.updates[0]['ExpressionAttributeValues'], {':s0': {'N': "1"}})
+    writer.raiseOnFailures()
+
+  def test_failed_writes_raise(self):
+    client = FakeClient(throttle=1000)
+    writer = self.writer(client, threads=2)
+    writer.update("sequences", {'seqHash': "a"}, {'x': 1})
+    writer.put("mutations", {'mutationId': "m"}, ['mutationId'])
+    stats = writer.flush()
+
+    self.assertEqual(stats['failed'], 2)
+    self.assertEqual(stats['items'], 0)
+    with self.assertRaises(RuntimeError):
+      writer.raiseOnFailures()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,107 @@
+"""
+Unit test warmWorker.py's idle and start up limits
+"""
+
+
+import unittest
+from unittest import mock
+import tempfile
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import warmWorker
+
+
+class FakeClock:
+    """time.time and time.sleep that advance together"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestWarmWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.patches = [
+            mock.patch.object(warmWorker.time, 'time', self.clock.time),
+            mock.patch.object(warmWorker.time, 'sleep', self.clock.sleep)
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.tmpDir.cleanup()
+
+    def run_worker(self, readyAt, **kwargs):
+        """Run a worker over iterations that become ready at the given times"""
+        processed = []
+        count = warmWorker.run(
+            "pangolin",
+            list(readyAt),
+            self.tmpDir.name,
+            lambda iterationUUID: self.clock.now >= readyAt[iterationUUID],
+            processed.append,
+            **kwargs
+        )
+        self.assertEqual(count, len(processed))
+        return processed
+
+
+    def test_waits_for_first_ready_iteration(self):
+        """
+        Idle time isn't counted before the first iteration is ready, so a slow
+        first alignment doesn't send the workers away.
+        """
+        processed = self.run_worker({"a": 3000, "b": 3500}, idleSeconds=900, startupSeconds=7200)
+        self.assertEqual(processed, ["a", "b"])
+
+
+    def test_stops_when_idle_after_first_ready(self):
+        """
+        Once an iteration has been ready, an iteration that never becomes
+        ready is left after idleSeconds without progress.
+        """
+        processed = self.run_worker({"a": 100, "b": float("inf")}, idleSeconds=900, startupSeconds=7200)
+        self.assertEqual(processed, ["a"])
+        self.assertLess(self.clock.now, 100 + 900 + 60)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpDir.name, "pangolin", "a.done")))
+
+
+    def test_stops_when_nothing_is_ready_by_startup_limit(self):
+        """
+        A worker leaves once startupSeconds pass without any iteration ready.
+        """
+        processed = self.run_worker({"a": float("inf")}, idleSeconds=900, startupSeconds=7200)
+        self.assertEqual(processed, [])
+        self.assertGreater(self.clock.now, 7200)
+        self.assertLess(self.clock.now, 7200 + 60)
+
+
+    def test_failed_iteration_is_marked(self):
+        """
+        An iteration whose processing raises is marked failed and not retried.
+        """
+        def process(iterationUUID):
+            raise ValueError("pangolin failed")
+        count = warmWorker.run("pangolin", ["a"], self.tmpDir.name, lambda iterationUUID: True, process)
+        self.assertEqual(count, 1)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpDir.name, "pangolin", "a.failed")))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import uuid
+import json
+import shutil
+import subprocess
+import boto3
+import pangoData
+
+##############################################
+# Step 1. Get Env Vars
+##############################################
+dateString = os.getenv('DATE_PARTITION')
+bucketName = os.getenv('HERON_SAMPLES_BUCKET')
+sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
+
+##############################################
+# Step 2. Install the latest pangolin-data into
+#         a staging directory on EFS
+##############################################
+root = pangoData.dataRoot(sampleDataRoot)
+os.makedirs(root, exist_ok=True)
+stagingDir = f"{root}/staging_{uuid.uuid4()}"
+
+command = ["pangolin", "--update-data", "--datadir", stagingDir]
+print(f"Running Command: {command}")
+try:
+  subprocess.run(command, check=True)
+  current = pangoData.install(stagingDir, sampleDataRoot, dateString)
+except (subprocess.CalledProcessError, ValueError) as e:
+  # The batches keep using the previous install, or update their own copy if there is none
+  print(f"Update Data error: {e}")
+  shutil.rmtree(stagingDir, ignore_errors=True)
+  current = pangoData.readCurrent(sampleDataRoot)
+
+##############################################
+# Step 3. Record the version this run uses
+##############################################
+if current is not None:
+  print(f"Using pangolin-data {current['version']} from {current['datadir']}")
+  command = ["pangolin", "--all-versions", "--datadir", current['datadir']]
+  try:
+    subprocess.run(command, check=True)
+  except subprocess.CalledProcessError as e:
+    print(f"Print versions error: {e}")
+
+  s3 = boto3.resource('s3', region_name='eu-west-1')
+  s3.Object(bucketName, f"{pangoData.PANGO_DATA_FOLDER}/{dateString}/version.json").put(Body=json.dumps(current))
+  pangoData.prune(sampleDataRoot)
+else:
+  print("No pangolin-data install available, batches will update their own")
@@ -1,4 +1,5 @@
 import os
+import tempfile
 import os.path
 import subprocess
 import pandas as pd
@@ -16,6 +17,8 @@ import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import sequencePack
+import tracing
 
 config = Config(
    retries = {
@@ -33,9 +36,11 @@ messageListKey = os.getenv('MESSAGE_LIST_S3_KEY')
 bucketName = os.getenv('HERON_SAMPLES_BUCKET')
 sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
 iterationUUID = os.getenv('ITERATION_UUID')
+tmpDir = tempfile.gettempdir()
 
 
 print(f"message list key {messageListKey}")
+span = tracing.Span("prepareConsensusSequences", iterationUUID)
 
 ##############################################
 # Step 1. Create resources
@@ -48,15 +53,16 @@ bucket = s3.Bucket(bucketName)
 # Step 2. Download the messages and concat into
 #         a single file and save to EFS
 ##############################################
-messageListLocalFilename = "/tmp/messageList.json"
+messageListLocalFilename = f"{tmpDir}/messageList.json"
 bucket.download_file(messageListKey, messageListLocalFilename)
+span.read(messageListLocalFilename)
 sampleDataRootSeqBatchesDir = f"{sampleDataRoot}/{dateString}/seqBatchFiles"
 
 if not os.path.exists(sampleDataRootSeqBatchesDir):
   os.makedirs(sampleDataRootSeqBatchesDir)
 
 
-outputFastaConsensusFile = f"/tmp/sequences_consensus_{iterationUUID}.fasta"
+outputFastaConsensusFile = f"{tmpDir}/sequences_consensus_{iterationUUID}.fasta"
 efsOutputConsensusFastaFile = f"{sampleDataRootSeqBatchesDir}/sequences_consensus{iterationUUID}.fasta"
 outputPlacementKeyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
 
@@ -65,15 +71,27 @@ with open(messageListLocalFilename) as json_file:
 
 print(f"Message count: {len(messageList)}")
 
+# Sequences that have been packed are read with a few ranged requests, the
+# rest from their own sample JSON
+packed, packedBytes = sequencePack.readBatch(s3, bucketName, dateString, iterationUUID, messageList)
+span.bytesIn += packedBytes
+print(f"Read {len(packed)} sequences from sequence packs")
 
 seqList = list()
+localFilename = None
 with open(outputFastaConsensusFile, "w+") as outputFile:
   for message in messageList:
     s3Key = message['consensusFastaPath']
     seqHash = message['seqHash']
-    localFilename = f"/tmp/{seqHash}.fa"
+    if seqHash in packed:
+      consensusSeq = packed[seqHash][0]
+      seqList.append({'seqId': consensusSeq.splitlines()[0], 'seqHash': seqHash})
+      outputFile.writelines(consensusSeq)
+      continue
+    localFilename = f"{tmpDir}/{seqHash}.fa"
     try:
       bucket.download_file(s3Key, localFilename)
+      span.read(localFilename)
       with open(localFilename, "r") as faFile:
         seqData = json.load(faFile)
       alignedSeq = seqData["consensus"]
@@ -84,10 +102,11 @@ with open(outputFastaConsensusFile, "w+") as outputFile:
     except:
       print(f"Could not download key: {s3Key}")
   
-  if os.path.isfile(localFilename):
+  if localFilename is not None and os.path.isfile(localFilename):
     os.remove(localFilename)
 
 seqDf = pd.DataFrame(seqList)
+span.sampleCount = len(seqList)
 
 ##############################################
 # Step 3. Upload resultant files to S3 and EFS
@@ -100,9 +119,13 @@ if os.path.isfile(outputFastaConsensusFile):
   seqDf.to_json(outputPlacementKeyFile, orient="records")
   S3Key = f"seqToPlace/{dateString}/sequences_{iterationUUID}.json"
   bucket.upload_file(outputPlacementKeyFile, S3Key)
+  span.wrote(outputFastaConsensusFile)
+  span.wrote(outputPlacementKeyFile)
 
   ##############################################
   # Step 4. Remove fasta file from tmp dir to
   #         free up space
   ##############################################
-  os.remove(outputFastaConsensusFile)
\ No newline at end of file
+  os.remove(outputFastaConsensusFile)
+
+span.finish()
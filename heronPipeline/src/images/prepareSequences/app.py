@@ -1,4 +1,5 @@
 import os
+import tempfile
 import os.path
 import subprocess
 import pandas as pd
@@ -16,6 +17,13 @@ import boto3
 from botocore.exceptions import ClientError
 from botocore.config import Config
 from boto3.dynamodb.conditions import Key
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import alignedSequence
+import sequencePack
+import sequenceDedup
+import tracing
 
 config = Config(
    retries = {
@@ -33,9 +41,15 @@ messageListKey = os.getenv('MESSAGE_LIST_S3_KEY')
 bucketName = os.getenv('HERON_SAMPLES_BUCKET')
 sampleDataRoot = os.getenv('SEQ_DATA_ROOT')
 iterationUUID = os.getenv('ITERATION_UUID')
+tmpDir = tempfile.gettempdir()
+# Concurrent S3 GETs while fetching the batch's samples
+fetchThreads = int(os.getenv('FETCH_THREADS', '32'))
+# Collapse identical sequences so the placement stages analyse each one once
+deduplicate = os.getenv('DEDUPLICATE_SEQUENCES', 'true').lower() == 'true'
 
 
 print(f"message list key {messageListKey}")
+span = tracing.Span("prepareSequences", iterationUUID)
 
 ##############################################
 # Step 1. Create resources
@@ -46,75 +60,105 @@ bucket = s3.Bucket(bucketName)
 
 ##############################################
 # Step 2. Download the messages and concat into
-#         a single file and save to EFS
+#         the batch files and save to EFS
 ##############################################
-messageListLocalFilename = "/tmp/messageList.json"
+messageListLocalFilename = f"{tmpDir}/messageList.json"
 bucket.download_file(messageListKey, messageListLocalFilename)
+span.read(messageListLocalFilename)
 sampleDataRootSeqBatchesDir = f"{sampleDataRoot}/{dateString}/seqBatchFiles"
 
 if not os.path.exists(sampleDataRootSeqBatchesDir):
   os.makedirs(sampleDataRootSeqBatchesDir)
 
 
-outputFastaFile = f"/tmp/sequences_{iterationUUID}.fasta"
-outputFastaConsensusFile = f"/tmp/sequences_consensus_{iterationUUID}.fasta"
+outputFastaFile = f"{tmpDir}/sequences_{iterationUUID}.fasta"
+outputFastaConsensusFile = f"{tmpDir}/sequences_consensus_{iterationUUID}.fasta"
 efsOutputFastaFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.fasta"
 efsOutputConsensusFastaFile = f"{sampleDataRootSeqBatchesDir}/sequences_consensus{iterationUUID}.fasta"
 outputPlacementKeyFile = f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.json"
+outputDuplicatesFile = sequenceDedup.duplicatesFile(sampleDataRootSeqBatchesDir, iterationUUID)
 
 with open(messageListLocalFilename) as json_file:
     messageList = json.load(json_file)
 
 print(f"Message count: {len(messageList)}")
 
-seqList = list()
-with open(outputFastaFile, "w+") as outputFile:
-  for message in messageList:
-    s3Key = message['consensusFastaPath']
-    seqHash = message['seqHash']
-    localFilename = f"/tmp/{seqHash}.fa"
-    try:
-      bucket.download_file(s3Key, localFilename)
-
-      with open(localFilename, "r") as faFile:
-        seqData = json.load(faFile)
-      alignedSeq = seqData["aligned"]
-      alignedSeqId = alignedSeq.splitlines()[0]
-      seqObject = {'seqId': alignedSeqId, 'seqHash': seqHash}
-      seqList.append(seqObject)
-      # outputFile.write(">")
-      outputFile.writelines(alignedSeq)
-    except:
-      print(f"Could not download key: {s3Key}")
-      # assert(False)
-    
-  
-  if os.path.isfile(localFilename):
-    os.remove(localFilename)
+def fetchSample(message):
+  """A sample from the packs when it was found there, otherwise from its JSON"""
+  if message['seqHash'] in packed:
+    consensus, alignedSeq = packed[message['seqHash']]
+    return message, {'consensus': consensus}, alignedSeq, 0
+  return fetchSampleJson(message)
+
+def fetchSampleJson(message):
+  """Get a sample JSON into memory and its aligned sequence, with this thread's own S3 resource
+
+  Returns the message, the parsed sample (None if it couldn't be read), the
+  aligned fasta (None if it has none) and the bytes read
+  """
+  if not hasattr(threadResources, 's3'):
+    threadResources.s3 = boto3.session.Session().resource('s3', region_name='eu-west-1')
+  s3Key = message['consensusFastaPath']
+  try:
+    body = threadResources.s3.Object(bucketName, s3Key).get()['Body'].read()
+    seqData = json.loads(body)
+  except Exception:
+    print(f"Could not download key: {s3Key}")
+    return message, None, None, 0
+  try:
+    alignedSeq = alignedSequence.readAligned(threadResources.s3, bucketName, seqData)
+  except Exception:
+    print(f"Could not read aligned sequence for: {s3Key}")
+    alignedSeq = None
+  return message, seqData, alignedSeq, len(body)
+
+def fetchInOrder(messages, workers):
+  """Fetch the samples concurrently, yielding them in message order
+
+  At most twice the pool width are fetched ahead of the writer, so memory
+  stays bounded however large the batch.
+  """
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    window = deque()
+    for message in messages:
+      window.append(executor.submit(fetchSample, message))
+      if len(window) >= 2 * workers:
+        yield window.popleft().result()
+    while len(window) > 0:
+      yield window.popleft().result()
 
+##############################################
+# Fetch every sample once and write the aligned
+# and consensus fastas and the key file together,
+# the iteration's sequence pack holds most of them
+##############################################
+packed, packedBytes = sequencePack.readBatch(s3, bucketName, dateString, iterationUUID, messageList)
+span.bytesIn += packedBytes
+print(f"Read {len(packed)} sequences from sequence packs")
+threadResources = threading.local()
+dedup = sequenceDedup.Deduplicator()
 seqList = list()
-with open(outputFastaConsensusFile, "w+") as outputFile:
-  for message in messageList:
-    s3Key = message['consensusFastaPath']
-    seqHash = message['seqHash']
-    localFilename = f"/tmp/{seqHash}.fa"
-    try:
-      bucket.download_file(s3Key, localFilename)
-      with open(localFilename, "r") as faFile:
-        seqData = json.load(faFile)
-      alignedSeq = seqData["consensus"]
-      alignedSeqId = alignedSeq.splitlines()[0]
-      seqObject = {'seqId': alignedSeqId, 'seqHash': seqHash}
-      seqList.append(seqObject)
-      outputFile.writelines(alignedSeq)
-    except:
-      print(f"Could not download key: {s3Key}")
-      # assert(False)
-  
-  if os.path.isfile(localFilename):
-    os.remove(localFilename)
+with open(outputFastaFile, "w+") as alignedFile, open(outputFastaConsensusFile, "w+") as consensusFile:
+  for message, seqData, alignedSeq, bytesRead in fetchInOrder(messageList, fetchThreads):
+    span.bytesIn += bytesRead
+    if seqData is None:
+      continue
+    consensusSeq = seqData.get("consensus")
+    # Repeats of a sequence already in the batch are only listed as its duplicates
+    if deduplicate and consensusSeq is not None and not dedup.add(message['seqHash'], consensusSeq):
+      continue
+    if alignedSeq is not None:
+      alignedFile.writelines(alignedSeq)
+
+    if consensusSeq is None:
+      continue
+    seqObject = {'seqId': consensusSeq.splitlines()[0], 'seqHash': message['seqHash']}
+    seqList.append(seqObject)
+    consensusFile.writelines(consensusSeq)
 
 seqDf = pd.DataFrame(seqList)
+span.sampleCount = len(seqList)
+print(f"{len(seqList)} distinct sequences, {dedup.duplicateCount()} duplicates")
 
 ##############################################
 # Step 3. Upload resultant files to S3 and EFS
@@ -132,9 +176,24 @@ if os.path.isfile(outputFastaFile):
   S3Key = f"seqToPlace/{dateString}/sequences_{iterationUUID}.json"
   bucket.upload_file(outputPlacementKeyFile, S3Key)
 
+  dedup.write(outputDuplicatesFile)
+  S3Key = f"seqToPlace/{dateString}/sequences_{iterationUUID}.duplicates.json"
+  bucket.upload_file(outputDuplicatesFile, S3Key)
+  span.wrote(outputFastaFile)
+  span.wrote(outputFastaConsensusFile)
+  span.wrote(outputPlacementKeyFile)
+
   ##############################################
   # Step 4. Remove fasta file from tmp dir to
   #         free up space
   ##############################################
   os.remove(outputFastaFile)
-  os.remove(outputFastaConsensusFile)
\ No newline at end of file
+  os.remove(outputFastaConsensusFile)
+
+##############################################
+# Step 5. Mark the iteration ready for the warm
+#         pangolin and armadillin workers
+##############################################
+open(f"{sampleDataRootSeqBatchesDir}/sequences_{iterationUUID}.ready", "w").close()
+
+span.finish(duplicates=dedup.duplicateCount())
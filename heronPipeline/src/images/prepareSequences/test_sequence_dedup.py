@@ -0,0 +1,50 @@
+"""
+Unit test sequenceDedup.py
+"""
+
+
+import unittest
+import tempfile
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+import sequenceDedup
+
+
+class TestSequenceDedup(unittest.TestCase):
+
+    def test_identical_sequences_collapse_onto_the_first(self):
+        dedup = sequenceDedup.Deduplicator()
+        self.assertTrue(dedup.add("a", ">sampleA\nACGTN\n"))
+        self.assertFalse(dedup.add("b", ">sampleB\nACG\ntn\n"))
+        self.assertTrue(dedup.add("c", ">sampleC\nACGTA\n"))
+        self.assertFalse(dedup.add("d", ">sampleD\nACGTN\n"))
+        self.assertEqual(dedup.duplicates, {"a": ["b", "d"]})
+        self.assertEqual(dedup.duplicateCount(), 2)
+
+    def test_repeated_messages_are_not_duplicates(self):
+        dedup = sequenceDedup.Deduplicator()
+        self.assertTrue(dedup.add("a", ">sampleA\nACGT\n"))
+        self.assertFalse(dedup.add("a", ">sampleA\nACGT\n"))
+        self.assertEqual(dedup.duplicates, {})
+
+    def test_results_fan_out_to_duplicates(self):
+        dedup = sequenceDedup.Deduplicator()
+        dedup.add("a", ">sampleA\nACGT\n")
+        dedup.add("b", ">sampleB\nACGT\n")
+        with tempfile.TemporaryDirectory() as tmpDir:
+            filename = sequenceDedup.duplicatesFile(tmpDir, "iteration")
+            self.assertEqual(sequenceDedup.loadDuplicates(filename), {})
+            dedup.write(filename)
+            duplicates = sequenceDedup.loadDuplicates(filename)
+        self.assertEqual(sequenceDedup.duplicateHashes(duplicates), {"b"})
+        self.assertEqual(sequenceDedup.targets(duplicates, "a"), ["a", "b"])
+        self.assertEqual(sequenceDedup.targets(duplicates, "c"), ["c"])
+
+
+if __name__ == '__main__':
+    unittest.main()
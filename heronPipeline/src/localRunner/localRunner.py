@@ -0,0 +1,177 @@
+"""
+Run the Heron pipeline end to end on one machine.
+
+  python localRunner.py <consensusDir> <outputDir> --resources <resourcesDir>
+
+Follows the daily state machine: addSequencesToQueue writes the messageList
+manifests and updatePangoData installs pangolin-data in the local EFS
+directory, then each manifest is an iteration that goes through
+prepareConsensusSequences, goFastaAlignment and prepareSequences and then
+pangolin, genotypeVariants and mutations in parallel, after which the
+tables are exported, exportResults joins them and cleanEfs clears the
+day's files. The stages run from their image directories, so the tools
+their Dockerfiles install (minimap2, gofasta, pangolin) must be on the path
+or in those directories.
+
+S3 and DynamoDB are served locally by localServices, the EFS mount is a
+local directory. The run's throughput, per-stage timings and the trace
+summary are written to <outputDir>/localRun.json, the stages' spans to
+<outputDir>/traces.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime
+
+from pipeline import Stage, Pipeline, runStage
+from localServices import LocalServices
+import traceTimeline
+
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "images")
+
+# processSampleBatchStateMachine, the last level is placeSequencesParallel
+LEVELS = [
+  ['prepareConsensusSequences'],
+  ['goFastaAlignment'],
+  ['prepareSequences'],
+  ['pangolin', 'genotypeVariants', 'mutations']
+]
+
+STAGES = [
+  Stage('addSequencesToQueue', f"{IMAGES_DIR}/addSequencesToQueue"),
+  Stage('prepareConsensusSequences', f"{IMAGES_DIR}/prepareConsensusSequences"),
+  Stage('goFastaAlignment', f"{IMAGES_DIR}/goFastaAlignment"),
+  Stage('prepareSequences', f"{IMAGES_DIR}/prepareSequences"),
+  Stage('pangolin', f"{IMAGES_DIR}/pangolin/app", "runPango.py"),
+  Stage('updatePangoData', f"{IMAGES_DIR}/pangolin/app", "updatePangoData.py"),
+  Stage('genotypeVariants', f"{IMAGES_DIR}/genotypeVariants", tmpFiles=["phe-recipes.yml"]),
+  Stage('mutations', f"{IMAGES_DIR}/mutations"),
+  Stage('exportResults', f"{IMAGES_DIR}/exportResults"),
+  Stage('cleanEfs', f"{IMAGES_DIR}/cleanEfs")
+]
+
+MANIFEST_INDEX_KEY = "messageLists/{date}/manifests.json"
+
+
+def parseWorkers(values):
+  """--workers goFastaAlignment=2 pangolin=4"""
+  workers = dict()
+  for value in values or list():
+    name, count = value.split("=")
+    workers[name] = int(count)
+  return workers
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Run the Heron pipeline locally")
+  parser.add_argument('consensusDir', help="Directory of consensus JSON files")
+  parser.add_argument('outputDir')
+  parser.add_argument('--resources', required=True, help="Directory uploaded as resources/, the reference and gene files")
+  parser.add_argument('--date', default=datetime.now().strftime("%Y-%m-%d"))
+  parser.add_argument('--sample-batch-size', type=int, default=2000)
+  parser.add_argument('--workers', nargs='*', help="Worker processes per stage, e.g. pangolin=4")
+  parser.add_argument('--queue-size', type=int, default=2, help="Iterations waiting in front of each stage")
+  parser.add_argument('--go-fasta-threads', type=int, default=os.cpu_count())
+  parser.add_argument('--skip', nargs='*', default=list(), choices=LEVELS[-1], help="Parallel stages to leave out")
+  parser.add_argument('--port', type=int, default=5000)
+  args = parser.parse_args()
+
+  outputDir = os.path.abspath(args.outputDir)
+  seqDataRoot = os.path.join(outputDir, "seqData")
+  os.makedirs(seqDataRoot, exist_ok=True)
+  tmpRoot = tempfile.mkdtemp(prefix="heronLocalRun_")
+  stages = {f.name: f for f in STAGES}
+
+  services = LocalServices(port=args.port)
+  services.start()
+  try:
+    count = services.seedConsensus(args.consensusDir)
+    services.uploadDirectory(args.resources, "resources")
+    print(f"Seeded {count} sequences")
+
+    baseEnvironment = dict(
+      services.environment(),
+      DATE_PARTITION=args.date,
+      HERON_SAMPLES_BUCKET=services.bucketName,
+      HERON_SEQUENCES_TABLE=services.tableNames['sequences'],
+      HERON_MUTATIONS_TABLE=services.tableNames['mutations'],
+      SEQ_DATA_ROOT=seqDataRoot,
+      TRACE_SINK=os.path.join(outputDir, "traces"),
+      SAMPLE_BATCH_SIZE=str(args.sample_batch_size),
+      GO_FASTA_THREADS=str(args.go_fasta_threads),
+      RECIPE_FILE_PATH="resources/phe-recipes.yml",
+      REF_FASTA_KEY="resources/MN908947.fa",
+      REF_GB_KEY="resources/MN908947.gb",
+      REF_AA_KEY="resources/MN908947.aa.fa",
+      GENES_TSV_KEY="resources/genes.tsv",
+      GENES_OVERLAP_TSV_KEY="resources/gene_overlaps.tsv",
+      TRIM_START="265",
+      TRIM_END="29674"
+    )
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Write the messageList manifests, the local tables
+    # have no stream so the pending work index isn't used
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    succeeded, seconds = runStage(stages['addSequencesToQueue'], dict(
+      baseEnvironment,
+      EXECUTION_MODE="DAILY",
+      WORK_DISTRIBUTION="MANIFEST",
+      USE_PENDING_WORK_INDEX="false"
+    ), tmpRoot)
+    if not succeeded:
+      sys.exit("addSequencesToQueue failed")
+    manifestIndex = json.loads(
+      services.resource('s3').Object(services.bucketName, MANIFEST_INDEX_KEY.format(date=args.date)).get()['Body'].read()
+    )
+    iterations = manifestIndex['manifests']
+    print(f"{manifestIndex['messageCount']} sequences in {len(iterations)} iterations")
+
+    # Install pangolin-data once for the run, as prepareRunParallel does
+    if 'pangolin' not in args.skip:
+      runStage(stages['updatePangoData'], baseEnvironment, tmpRoot)
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Process the iterations
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    levels = LEVELS[:-1] + [[f for f in LEVELS[-1] if f not in args.skip]]
+    pipeline = Pipeline(
+      [stages[f] for level in levels for f in level], levels,
+      lambda iteration: dict(baseEnvironment, ITERATION_UUID=iteration['iterationUUID'], MESSAGE_LIST_S3_KEY=iteration['messageListS3Key']),
+      workers=parseWorkers(args.workers), queueSize=args.queue_size, tmpRoot=tmpRoot
+    )
+    report = pipeline.run(iterations)
+    report['traceSummary'] = traceTimeline.summarise(
+      [f for f in traceTimeline.timelines(traceTimeline.loadSpans(baseEnvironment['TRACE_SINK'])) if f is not None]
+    )
+    print(f"Processed {report['samples']} samples in {report['seconds']:.1f}s ({report['samplesPerSecond']:.2f} samples/s), {len(report['failed'])} iterations failed")
+
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    # Export the tables, join them and clean up
+    #+++++++++++++++++++++++++++++++++++++++++++++++++++++
+    exportKeys = {f: f"localExports/{args.date}/{f}.csv" for f in ['mutations', 'sequences', 'samples']}
+    for table, key in exportKeys.items():
+      services.exportTable(table, key)
+    runStage(stages['exportResults'], dict(
+      baseEnvironment,
+      BRANCH_ZERO=exportKeys['mutations'],
+      BRANCH_ONE=exportKeys['sequences'],
+      BRANCH_TWO=exportKeys['samples'],
+      EXECUTION_ID=f"local-{int(time.time())}"
+    ), tmpRoot)
+    runStage(stages['cleanEfs'], baseEnvironment, tmpRoot)
+
+    services.downloadPrefix(f"results/{args.date}", outputDir)
+    services.downloadPrefix(f"localExports/{args.date}", outputDir)
+    with open(os.path.join(outputDir, "localRun.json"), "w") as reportFile:
+      json.dump(report, reportFile, indent=2)
+  finally:
+    services.stop()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,135 @@
+"""
+Local stand-ins for the S3 bucket and DynamoDB tables the stages use.
+
+A moto server on localhost provides both, the stage processes are pointed at
+it with AWS_ENDPOINT_URL so their boto3 calls run unchanged. The bucket is
+seeded from local directories before a run and its results are copied back
+to the output directory afterwards, the tables are created with the keys
+Infrastructure.cs gives them.
+"""
+
+import os
+import csv
+import json
+import tempfile
+import boto3
+from moto.server import ThreadedMotoServer
+
+REGION = "eu-west-1"
+
+TABLE_KEYS = {
+  'samples': [('cogUkId', 'HASH'), ('runMetaData', 'RANGE')],
+  'sequences': [('seqHash', 'HASH')],
+  'mutations': [('mutationId', 'HASH')]
+}
+
+
+class LocalServices:
+
+  def __init__(self, port=5000, bucketName="heron-local"):
+    self.port = port
+    self.bucketName = bucketName
+    self.tableNames = {f: f"heron{f[0].upper()}{f[1:]}Table" for f in TABLE_KEYS}
+    self.server = None
+
+  def environment(self):
+    """Variables that send a stage's boto3 calls to the local server"""
+    return {
+      'AWS_ENDPOINT_URL': f"http://127.0.0.1:{self.port}",
+      'AWS_ACCESS_KEY_ID': "local",
+      'AWS_SECRET_ACCESS_KEY': "local",
+      'AWS_DEFAULT_REGION': REGION
+    }
+
+  def session(self):
+    environment = self.environment()
+    return boto3.session.Session(
+      aws_access_key_id=environment['AWS_ACCESS_KEY_ID'],
+      aws_secret_access_key=environment['AWS_SECRET_ACCESS_KEY'],
+      region_name=REGION
+    )
+
+  def resource(self, name):
+    return self.session().resource(name, endpoint_url=self.environment()['AWS_ENDPOINT_URL'])
+
+  def start(self):
+    self.server = ThreadedMotoServer(port=self.port, verbose=False)
+    self.server.start()
+    self.resource('s3').create_bucket(Bucket=self.bucketName, CreateBucketConfiguration={'LocationConstraint': REGION})
+    dynamodb = self.resource('dynamodb')
+    for table, keys in TABLE_KEYS.items():
+      dynamodb.create_table(
+        TableName=self.tableNames[table],
+        KeySchema=[{'AttributeName': name, 'KeyType': keyType} for name, keyType in keys],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name, keyType in keys],
+        BillingMode='PAY_PER_REQUEST'
+      )
+
+  def stop(self):
+    if self.server is not None:
+      self.server.stop()
+
+  def uploadDirectory(self, localDir, prefix):
+    bucket = self.resource('s3').Bucket(self.bucketName)
+    for root, dirs, files in os.walk(localDir):
+      for f in files:
+        path = os.path.join(root, f)
+        bucket.upload_file(path, f"{prefix}/{os.path.relpath(path, localDir)}")
+
+  def downloadPrefix(self, prefix, localDir):
+    bucket = self.resource('s3').Bucket(self.bucketName)
+    for obj in bucket.objects.filter(Prefix=prefix):
+      path = os.path.join(localDir, obj.key)
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      bucket.download_file(obj.key, path)
+
+  def seedConsensus(self, inputDir):
+    """Load a directory of consensus JSONs as new sequences
+
+    Each file holds the consensus fasta under 'consensus' as the importer
+    writes it, the seqHash is taken from the file or else its name.
+    Returns the number of sequences added.
+    """
+    bucket = self.resource('s3').Bucket(self.bucketName)
+    dynamodb = self.resource('dynamodb')
+    sequencesTable = dynamodb.Table(self.tableNames['sequences'])
+    samplesTable = dynamodb.Table(self.tableNames['samples'])
+
+    count = 0
+    with sequencesTable.batch_writer() as sequences, samplesTable.batch_writer() as samples:
+      for f in sorted(os.listdir(inputDir)):
+        if not f.endswith(".json"):
+          continue
+        with open(os.path.join(inputDir, f)) as jsonFile:
+          seqData = json.load(jsonFile)
+        seqHash = seqData.get('seqHash', os.path.splitext(f)[0])
+        seqId = seqData['consensus'].splitlines()[0].lstrip(">")
+        consensusFastaPath = f"consensus/{f}"
+        bucket.upload_file(os.path.join(inputDir, f), consensusFastaPath)
+        sequences.put_item(Item={'seqHash': seqHash, 'consensusFastaPath': consensusFastaPath, 'processingState': "consensus"})
+        samples.put_item(Item={'cogUkId': seqId, 'runMetaData': "local", 'consensusFastaHash': seqHash})
+        count += 1
+    return count
+
+  def exportTable(self, table, key):
+    """Write a table to the bucket as CSV, standing in for the DynamoDB export and merge"""
+    dynamodbTable = self.resource('dynamodb').Table(self.tableNames[table])
+    items = list()
+    scanKwargs = dict()
+    while True:
+      response = dynamodbTable.scan(**scanKwargs)
+      items.extend(response['Items'])
+      if 'LastEvaluatedKey' not in response:
+        break
+      scanKwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    columns = sorted(set([k for item in items for k in item]))
+    localFilename = os.path.join(tempfile.gettempdir(), f"{table}Export.csv")
+    with open(localFilename, "w", newline="") as csvFile:
+      writer = csv.DictWriter(csvFile, fieldnames=columns)
+      writer.writeheader()
+      for item in items:
+        writer.writerow({k: (json.dumps(v, default=str) if isinstance(v, (dict, list)) else v) for k, v in item.items()})
+    self.resource('s3').Bucket(self.bucketName).upload_file(localFilename, key)
+    os.remove(localFilename)
+    return len(items)
@@ -0,0 +1,179 @@
+"""
+Run the per-iteration stages of the sample processing DAG as a local
+multiprocessing pipeline.
+
+The stages are grouped into levels the way processSampleBatchStateMachine
+chains them, an iteration enters a level once every stage of the level
+before has finished it, so a level of several stages is a Parallel state.
+Each stage has its own pool of worker processes fed through a bounded
+queue, so a slow stage holds back the stages in front of it rather than
+letting iterations pile up in memory.
+
+Every stage invocation runs the stage's script in a fresh Python process
+with the environment the Fargate task would get and a private temp
+directory, the local equivalent of one container.
+"""
+
+import os
+import sys
+import time
+import runpy
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from collections import defaultdict
+
+
+class Stage:
+  """A stage script, run with its directory as the working directory"""
+
+  def __init__(self, name, directory, script="app.py", tmpFiles=None):
+    self.name = name
+    self.directory = os.path.abspath(directory)
+    self.script = script
+    # Files the image bakes into /tmp, copied into each invocation's temp directory
+    self.tmpFiles = tmpFiles or list()
+
+
+def runScript(directory, script, environment):
+  """Entry point of an invocation's process, runs the script as __main__"""
+  os.environ.update(environment)
+  os.chdir(directory)
+  sys.path.insert(0, directory)
+  sys.argv = [script]
+  try:
+    runpy.run_path(script, run_name="__main__")
+  except SystemExit as e:
+    if e.code not in (None, 0):
+      raise
+
+
+def runStage(stage, environment, tmpRoot):
+  """Run one invocation of a stage, returns (succeeded, seconds)"""
+  tmpDir = tempfile.mkdtemp(prefix=f"{stage.name}_", dir=tmpRoot)
+  for f in stage.tmpFiles:
+    shutil.copy(os.path.join(stage.directory, f), tmpDir)
+  environment = dict(environment, TMPDIR=tmpDir)
+
+  startTime = time.time()
+  process = multiprocessing.get_context("spawn").Process(
+    target=runScript, args=(stage.directory, stage.script, environment)
+  )
+  process.start()
+  process.join()
+  seconds = time.time() - startTime
+  shutil.rmtree(tmpDir, ignore_errors=True)
+  return process.exitcode == 0, seconds
+
+
+def stageWorker(stage, inQueue, resultQueue, tmpRoot):
+  while True:
+    item = inQueue.get()
+    if item is None:
+      return
+    iteration, environment = item
+    succeeded, seconds = runStage(stage, environment, tmpRoot)
+    resultQueue.put({
+      'stage': stage.name,
+      'iterationUUID': iteration['iterationUUID'],
+      'succeeded': succeeded,
+      'startTime': time.time() - seconds,
+      'seconds': seconds
+    })
+
+
+class Pipeline:
+  """Pass iterations through levels of stages
+
+  levels is a list of lists of stage names, workers maps a stage name to its
+  number of worker processes (default 1) and environment(iteration) returns
+  the environment for an iteration's invocations.
+  """
+
+  def __init__(self, stages, levels, environment, workers=None, queueSize=2, tmpRoot=None):
+    self.stages = {f.name: f for f in stages}
+    self.levels = levels
+    self.environment = environment
+    self.workers = workers or dict()
+    self.queueSize = queueSize
+    self.tmpRoot = tmpRoot
+
+  def run(self, iterations):
+    """Process every iteration, returns a report of the invocations and throughput"""
+    context = multiprocessing.get_context("spawn")
+    resultQueue = context.Queue()
+    queues = dict()
+    processes = dict()
+    for name in [f for level in self.levels for f in level]:
+      queues[name] = context.Queue(maxsize=self.queueSize)
+      processes[name] = [
+        context.Process(target=stageWorker, args=(self.stages[name], queues[name], resultQueue, self.tmpRoot))
+        for f in range(self.workers.get(name, 1))
+      ]
+      for p in processes[name]:
+        p.start()
+
+    byUUID = {f['iterationUUID']: f for f in iterations}
+    environments = {f['iterationUUID']: self.environment(f) for f in iterations}
+
+    def enqueue(level, iterationUUID):
+      for name in self.levels[level]:
+        queues[name].put((byUUID[iterationUUID], environments[iterationUUID]))
+
+    # Feed the first level from a thread, its puts block while the queue is full
+    feeder = threading.Thread(target=lambda: [enqueue(0, f) for f in byUUID])
+    startTime = time.time()
+    feeder.start()
+
+    levelOf = {name: i for i, level in enumerate(self.levels) for name in level}
+    pending = defaultdict(set)
+    failed = set()
+    completed = list()
+    invocations = list()
+    outstanding = len(byUUID)
+    while outstanding > 0:
+      result = resultQueue.get()
+      invocations.append(result)
+      iterationUUID = result['iterationUUID']
+      level = levelOf[result['stage']]
+      if not result['succeeded']:
+        print(f"{result['stage']} failed for iteration {iterationUUID}")
+        failed.add(iterationUUID)
+
+      done = pending[(iterationUUID, level)]
+      done.add(result['stage'])
+      if len(done) < len(self.levels[level]):
+        continue
+      del pending[(iterationUUID, level)]
+      # Like a failed Map item, a failed iteration goes no further
+      if iterationUUID in failed:
+        outstanding -= 1
+      elif level + 1 < len(self.levels):
+        enqueue(level + 1, iterationUUID)
+      else:
+        completed.append(iterationUUID)
+        outstanding -= 1
+
+    seconds = time.time() - startTime
+    feeder.join()
+    for name, workerProcesses in processes.items():
+      for p in workerProcesses:
+        queues[name].put(None)
+      for p in workerProcesses:
+        p.join()
+
+    samples = sum([int(byUUID[f].get('messageCount', 0)) for f in completed])
+    stageSeconds = defaultdict(float)
+    for f in invocations:
+      stageSeconds[f['stage']] += f['seconds']
+    return {
+      'iterations': len(byUUID),
+      'completed': len(completed),
+      'failed': sorted(failed),
+      'samples': samples,
+      'seconds': seconds,
+      'samplesPerSecond': samples / seconds if seconds > 0 else 0.0,
+      'stageSeconds': dict(stageSeconds),
+      'invocations': invocations
+    }
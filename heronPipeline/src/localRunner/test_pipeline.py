@@ -0,0 +1,95 @@
+"""
+Unit test the local Pipeline with stand-in stage scripts
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+
+from pipeline import Stage, Pipeline
+
+
+# Appends the stage, the iteration and the files from the stage's temp directory to a log
+STAGE_SCRIPT = """
+import os
+import json
+import tempfile
+name = os.path.basename(os.getcwd())
+iterationUUID = os.getenv('ITERATION_UUID')
+with open(os.getenv('LOG_FILE'), 'a') as logFile:
+  logFile.write(json.dumps([name, iterationUUID, sorted(os.listdir(tempfile.gettempdir()))]) + "\\n")
+if name == os.getenv('FAIL_STAGE') and iterationUUID == os.getenv('FAIL_ITERATION'):
+  exit(1)
+"""
+
+
+class TestPipeline(unittest.TestCase):
+
+
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.logFile = os.path.join(self.root, "log.jsonl")
+        self.stages = list()
+        for name in ['prepare', 'align', 'left', 'right']:
+            os.makedirs(os.path.join(self.root, name))
+            with open(os.path.join(self.root, name, "app.py"), "w") as script:
+                script.write(STAGE_SCRIPT)
+            with open(os.path.join(self.root, name, "baked.txt"), "w") as baked:
+                baked.write(name)
+            self.stages.append(Stage(name, os.path.join(self.root, name), tmpFiles=["baked.txt"] if name == 'left' else None))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+
+    def run_pipeline(self, iterations, **environment):
+        levels = [['prepare'], ['align'], ['left', 'right']]
+        pipeline = Pipeline(self.stages, levels,
+                            lambda f: dict(environment, ITERATION_UUID=f['iterationUUID'], LOG_FILE=self.logFile),
+                            workers={'align': 2}, queueSize=1, tmpRoot=self.root)
+        report = pipeline.run(iterations)
+        with open(self.logFile) as logFile:
+            log = [json.loads(f) for f in logFile]
+        return report, log
+
+
+    def test_levels_run_in_order(self):
+        """
+        Every iteration goes through every stage, a level only after the one
+        before it, and each invocation has its own temp directory.
+        """
+        iterations = [{'iterationUUID': str(i), 'messageCount': 10} for i in range(5)]
+        report, log = self.run_pipeline(iterations)
+        self.assertEqual(report['completed'], 5)
+        self.assertEqual(report['samples'], 50)
+        for iteration in iterations:
+            stages = [f[0] for f in log if f[1] == iteration['iterationUUID']]
+            self.assertEqual(stages[:2], ['prepare', 'align'])
+            self.assertEqual(sorted(stages[2:]), ['left', 'right'])
+        self.assertTrue(all([f[2] == (['baked.txt'] if f[0] == 'left' else []) for f in log]))
+
+
+    def test_failed_iteration_stops(self):
+        """
+        An iteration whose stage fails goes no further, the others complete.
+        """
+        iterations = [{'iterationUUID': str(i), 'messageCount': 10} for i in range(3)]
+        report, log = self.run_pipeline(iterations, FAIL_STAGE='align', FAIL_ITERATION='1')
+        self.assertEqual(report['completed'], 2)
+        self.assertEqual(report['failed'], ['1'])
+        self.assertEqual([f[0] for f in log if f[1] == '1'], ['prepare', 'align'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Unit test traceTimeline.py with spans written by tracing.py
+"""
+
+
+import unittest
+import tempfile
+import shutil
+import json
+import sys
+import os
+
+
+CURR_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, CURR_DIR)
+sys.path.insert(0, os.path.join(CURR_DIR, "..", "images", "prepareConsensusSequences"))
+
+import traceTimeline
+import tracing
+
+
+class TestTraceTimeline(unittest.TestCase):
+
+
+
+    def setUp(self):
+        self.traceDir = tempfile.mkdtemp()
+        os.environ['TRACE_SINK'] = self.traceDir
+
+
+    def tearDown(self):
+        del os.environ['TRACE_SINK']
+        shutil.rmtree(self.traceDir)
+
+
+    def write_span(self, stage, iterationUUID, start, end, samples=10):
+        record = {'stage': stage, 'iterationUUID': iterationUUID, 'sampleCount': samples,
+                  'bytesIn': 0, 'bytesOut': 0, 'startTime': start, 'endTime': end}
+        tracing.writeSpan(json.dumps(record), "2022-01-01", iterationUUID, stage, None)
+
+
+    def test_critical_path(self):
+        """
+        The slowest parallel branch gates the iteration and gaps measure the
+        time between levels.
+        """
+        self.write_span('readSampleBatchFromQueue', 'a', 0, 5)
+        self.write_span('prepareConsensusSequences', 'a', 65, 80)
+        self.write_span('goFastaAlignment', 'a', 140, 200)
+        self.write_span('prepareSequences', 'a', 260, 270)
+        self.write_span('pangolin', 'a', 330, 600)
+        self.write_span('genotypeVariants', 'a', 330, 400)
+        self.write_span('mutations', 'a', 335, 500)
+        self.write_span('prepareConsensusSequences', 'b', 1000, 1010)
+        self.write_span('goFastaAlignment', 'b', 1020, 1030)
+
+        timelines = {f['iterationUUID']: f for f in traceTimeline.timelines(traceTimeline.loadSpans(self.traceDir))}
+        a = timelines['a']
+        self.assertEqual(a['criticalPath'][-1], 'pangolin')
+        self.assertEqual(a['totalSeconds'], 600)
+        gaps = {f['stage']: f['gapSeconds'] for f in a['stages']}
+        self.assertEqual(gaps['prepareConsensusSequences'], 60)
+        self.assertEqual(gaps['mutations'], 65)
+        self.assertEqual(timelines['b']['criticalPath'], ['prepareConsensusSequences', 'goFastaAlignment'])
+
+        summary = traceTimeline.summarise(list(timelines.values()))
+        self.assertEqual(summary['gatingBranches'], {'pangolin': 1})
+        self.assertEqual(summary['iterations'], 2)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Build per-iteration timelines from the stages' trace spans.
+
+  python traceTimeline.py <traceDir>
+  python traceTimeline.py s3://<bucket> --date <date>
+
+Spans are the JSON lines written by each stage's tracing module, either to
+a local directory or under traces/{date}/ in the bucket. For every
+iteration the stages are laid out in the order the state machine runs them
+with the gap before each one, the time Step Functions and Fargate took to
+start it. In a level of parallel stages the one that finishes last gates
+the iteration, the summary counts how often each branch of
+placeSequencesParallel was the one holding the iteration up.
+"""
+
+import os
+import json
+import argparse
+from collections import defaultdict, Counter
+
+TRACE_PREFIX = "traces"
+
+# The order processSampleBatchStateMachine runs the stages in, the last
+# level is placeSequencesParallel
+LEVELS = [
+  ['readSampleBatchFromQueue'],
+  ['prepareConsensusSequences'],
+  ['goFastaAlignment'],
+  ['prepareSequences'],
+  ['pangolin', 'genotypeVariants', 'mutations']
+]
+
+
+def parseSpans(lines):
+  return [json.loads(f) for f in lines if f.strip()]
+
+
+def loadSpans(source, dateString=None):
+  """Read every span from a local trace directory or an s3://bucket"""
+  spans = list()
+  if source.startswith("s3://"):
+    import boto3
+    bucketName = source[len("s3://"):].split("/")[0]
+    bucket = boto3.resource('s3', region_name='eu-west-1').Bucket(bucketName)
+    prefix = f"{TRACE_PREFIX}/{dateString}/" if dateString else f"{TRACE_PREFIX}/"
+    for obj in bucket.objects.filter(Prefix=prefix):
+      spans.extend(parseSpans(obj.get()['Body'].read().decode().splitlines()))
+  else:
+    for root, dirs, files in os.walk(source):
+      for f in files:
+        if f.endswith(".jsonl"):
+          with open(os.path.join(root, f)) as traceFile:
+            spans.extend(parseSpans(traceFile))
+  return spans
+
+
+def timeline(spans, levels=LEVELS):
+  """Lay out one iteration's spans level by level
+
+  A stage that ran more than once, e.g. retried, is represented by its last
+  run. Returns the stages with their offsets from the iteration's first span
+  and the gap since the previous level finished, plus the stage that gated
+  each level and the iteration's total seconds.
+  """
+  byStage = dict()
+  for span in sorted(spans, key=lambda f: f['startTime']):
+    byStage[span['stage']] = span
+  if len(byStage) == 0:
+    return None
+  origin = min([f['startTime'] for f in byStage.values()])
+
+  stages = list()
+  gating = list()
+  previousEnd = None
+  for level in levels:
+    present = [byStage[f] for f in level if f in byStage]
+    if len(present) == 0:
+      continue
+    for span in present:
+      stages.append({
+        'stage': span['stage'],
+        'offsetSeconds': span['startTime'] - origin,
+        'durationSeconds': span['endTime'] - span['startTime'],
+        'gapSeconds': span['startTime'] - previousEnd if previousEnd is not None else 0.0,
+        'sampleCount': span.get('sampleCount', 0),
+        'bytesIn': span.get('bytesIn', 0),
+        'bytesOut': span.get('bytesOut', 0)
+      })
+    last = max(present, key=lambda f: f['endTime'])
+    gating.append(last['stage'])
+    previousEnd = last['endTime']
+
+  return {
+    'iterationUUID': next(iter(byStage.values()))['iterationUUID'],
+    'stages': stages,
+    'criticalPath': gating,
+    'totalSeconds': previousEnd - origin
+  }
+
+
+def timelines(spans, levels=LEVELS):
+  byIteration = defaultdict(list)
+  for span in spans:
+    byIteration[span['iterationUUID']].append(span)
+  return [timeline(f, levels) for f in byIteration.values()]
+
+
+def summarise(iterationTimelines, levels=LEVELS):
+  """Mean duration and gap per stage, and how often each parallel branch gated"""
+  durations = defaultdict(list)
+  gaps = defaultdict(list)
+  gatingBranches = Counter()
+  parallel = set(levels[-1])
+  for t in iterationTimelines:
+    for stage in t['stages']:
+      durations[stage['stage']].append(stage['durationSeconds'])
+      gaps[stage['stage']].append(stage['gapSeconds'])
+    gatingBranches.update([f for f in t['criticalPath'] if f in parallel])
+  mean = lambda values: sum(values) / len(values) if len(values) > 0 else 0.0
+  return {
+    'iterations': len(iterationTimelines),
+    'meanTotalSeconds': mean([f['totalSeconds'] for f in iterationTimelines]),
+    'meanDurationSeconds': {k: mean(v) for k, v in durations.items()},
+    'meanGapSeconds': {k: mean(v) for k, v in gaps.items()},
+    'gatingBranches': dict(gatingBranches)
+  }
+
+
+def printTimeline(t):
+  print(f"Iteration {t['iterationUUID']}: {t['totalSeconds']:.1f}s, critical path {' > '.join(t['criticalPath'])}")
+  for stage in t['stages']:
+    print(f"  {stage['stage']:<28} +{stage['offsetSeconds']:8.1f}s  {stage['durationSeconds']:8.1f}s  gap {stage['gapSeconds']:6.1f}s  {stage['sampleCount']:6d} samples")
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Per-iteration timelines from trace spans")
+  parser.add_argument('source', help="Trace directory or s3://bucket")
+  parser.add_argument('--date', default=None, help="Date partition to read from the bucket")
+  parser.add_argument('--iterations', action='store_true', help="Print every iteration's timeline")
+  parser.add_argument('--json', action='store_true')
+  args = parser.parse_args()
+
+  iterationTimelines = [f for f in timelines(loadSpans(args.source, args.date)) if f is not None]
+  summary = summarise(iterationTimelines)
+  if args.json:
+    print(json.dumps({'summary': summary, 'iterations': iterationTimelines if args.iterations else None}, indent=2))
+    return
+  if args.iterations:
+    for t in sorted(iterationTimelines, key=lambda f: -f['totalSeconds']):
+      printTimeline(t)
+  print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,46 @@
+import json
+import time
+import boto3
+from botocore.config import Config
+from boto3.dynamodb.conditions import Key, Attr
+import pendingWork
+
+config = Config(
+   retries = {
+      'max_attempts': 10,
+      'mode': 'standard'
+   }
+)
+
+# Run once after deploying the pendingWorkIndex, the markPendingWork stream
+# function only sees sequences that change after it is deployed. Daily runs
+# keep scanning the table until this has finished and written its marker
+heronSequencesTableName = "HeronPipelineStack-sequencesTableAE1FA49B-JC9JE7I63NG3"
+bucketName = "heron-pipeline"
+
+session = boto3.Session(aws_access_key_id='',aws_secret_access_key='')
+dynamodb = session.resource('dynamodb', region_name="eu-west-1", config=config)
+s3 = session.resource('s3', region_name="eu-west-1")
+sequencesTable = dynamodb.Table(heronSequencesTableName)
+
+scan_kwargs = {
+    'FilterExpression': Attr("processingState").eq("consensus") | Attr("pangoCallDate").not_exists() | Attr("genotypeCallDate").not_exists(),
+    'ProjectionExpression': "seqHash"
+}
+
+marked = 0
+while True:
+    response = sequencesTable.scan(**scan_kwargs)
+    for item in response['Items']:
+        marked += pendingWork.markPending(sequencesTable, item['seqHash'])
+
+    startKey = response.get('LastEvaluatedKey', None)
+    if startKey is None:
+        break
+    scan_kwargs['ExclusiveStartKey'] = startKey
+
+print(f"Marked {marked} sequences as pending work")
+
+# Only written once every existing sequence has been looked at
+s3.Object(bucketName, pendingWork.BACKFILL_MARKER_KEY).put(Body=json.dumps({'marked': marked, 'finished': int(time.time())}))
+print(f"Wrote s3://{bucketName}/{pendingWork.BACKFILL_MARKER_KEY}, daily runs now query the pendingWorkIndex")
@@ -0,0 +1,83 @@
+import json
+import uuid
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from boto3.dynamodb.conditions import Key, Attr
+import alignedSequence
+import sequencePack
+
+config = Config(
+   retries = {
+      'max_attempts': 10,
+      'mode': 'standard'
+   },
+   max_pool_connections=64
+)
+
+# Packs the existing per-sample consensus JSONs and their aligned objects into
+# sequence packs and points each sequence at its record. Sequences that
+# already have a sequencePack are skipped, so it can be rerun until every
+# sequence is packed. The per-sample objects are left in place.
+bucketName = "heron-pipeline"
+heronSequencesTableName = "HeronPipelineStack-sequencesTableAE1FA49B-JC9JE7I63NG3"
+packPartition = "migrated"
+recordsPerPack = 4000
+fetchThreads = 64
+
+session = boto3.Session(aws_access_key_id='',aws_secret_access_key='')
+s3 = session.resource('s3', region_name="eu-west-1", config=config)
+dynamodb = session.resource('dynamodb', region_name="eu-west-1", config=config)
+sequencesTable = dynamodb.Table(heronSequencesTableName)
+
+def fetchSample(item):
+    """(seqHash, consensus, aligned) of a sequence's JSON, None if it can't be read"""
+    try:
+        sample = json.loads(s3.Object(bucketName, item['consensusFastaPath']).get()['Body'].read())
+        return item['seqHash'], sample['consensus'], alignedSequence.readAligned(s3, bucketName, sample)
+    except Exception as e:
+        print(f"Could not read {item['consensusFastaPath']}: {e}")
+        return None
+
+def writePack(items, executor):
+    packWriter = sequencePack.PackWriter()
+    for result in executor.map(fetchSample, items):
+        if result is not None:
+            packWriter.add(*result)
+    if len(packWriter) == 0:
+        return 0
+
+    packKey, indexKey = sequencePack.packKeys(packPartition, str(uuid.uuid4()))
+    packWriter.upload(s3, bucketName, packKey, indexKey)
+    pointers = packWriter.pointers(packKey)
+    list(executor.map(lambda seqHash: sequencesTable.update_item(
+        Key={'seqHash': seqHash},
+        UpdateExpression="set sequencePack=:p",
+        ExpressionAttributeValues={':p': pointers[seqHash]}
+    ), pointers))
+    print(f"Packed {len(packWriter)} sequences into {packKey}")
+    return len(packWriter)
+
+scan_kwargs = {
+    'FilterExpression': Attr("sequencePack").not_exists() & Attr("consensusFastaPath").exists(),
+    'ProjectionExpression': "seqHash, consensusFastaPath"
+}
+
+packed = 0
+pending = list()
+with ThreadPoolExecutor(max_workers=fetchThreads) as executor:
+    while True:
+        response = sequencesTable.scan(**scan_kwargs)
+        pending.extend(response['Items'])
+        while len(pending) >= recordsPerPack:
+            packed += writePack(pending[:recordsPerPack], executor)
+            pending = pending[recordsPerPack:]
+
+        startKey = response.get('LastEvaluatedKey', None)
+        if startKey is None:
+            break
+        scan_kwargs['ExclusiveStartKey'] = startKey
+
+    packed += writePack(pending, executor)
+
+print(f"Packed {packed} sequences")